@@ -0,0 +1,33 @@
+import sys
+import timeit
+
+import numpy
+
+import awkward.type
+
+import rejig.typing
+from rejig.syntaxtree import *
+
+def throughput(name, fcn, args, numentries, repeat=5):
+    best = min(timeit.repeat(lambda: fcn(*args), number=1, repeat=repeat))
+    print("{0:>40s}: {1:8.3f} s {2:12.0f} entries/s".format(name, best, numentries / best))
+
+numentries = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+
+# a.map(lambda x: x + 3.14)
+flat = rejig.typing.typify(Suite((Call('return', Call(Call('.', Name('a'), 'map'), Def(('x',), (), Suite((Call('return', Call('+', Name('x'), Const(3.14))),))))),)), {"a": awkward.type.ArrayType(numpy.inf, numpy.dtype(float))})
+a = list(numpy.random.normal(0, 1, numentries))
+throughput("generated a.map(x + 3.14)", flat.aspython(), (a,), numentries)
+throughput("hand-written list comprehension", lambda a: [x + 3.14 for x in a], (a,), numentries)
+
+# [x[0] + n for x in a if len(x) >= 2]
+jagged = rejig.typing.typify(Suite((Call('return', Call(Call('.', Call(Call('.', Name('a'), 'filter'), Def(('x',), (), Suite((Call('return', Call('>=', Call('len', Name('x')), Const(2))),)))), 'map'), Def(('x',), (), Suite((Call('return', Call('+', Call('[.]', Name('x'), Const(0)), Name('n'))),))))),)), {"a": awkward.type.ArrayType(numpy.inf, numpy.inf, numpy.dtype(float)), "n": numpy.dtype(float)})
+counts = numpy.random.poisson(2, numentries // 2)
+content = list(numpy.random.normal(0, 1, counts.sum()))
+offsets = numpy.concatenate([[0], numpy.cumsum(counts)])
+a = [content[offsets[i]:offsets[i + 1]] for i in range(len(counts))]
+throughput("generated filter(len >= 2).map(x[0] + n)", jagged.aspython(), (a, 1.0), len(counts))
+throughput("hand-written list comprehension", lambda a, n: [x[0] + n for x in a if len(x) >= 2], (a, 1.0), len(counts))
+
+# code generation and compilation, which the Action caches
+throughput("typify + aspython (uncached)", lambda: rejig.typing.typify(flat.typedast.ast, flat.argtypes).aspython(), (), 1)
@@ -0,0 +1,1058 @@
+import math
+import numbers
+import re
+
+import numpy
+
+import awkward
+import awkward.type
+
+import rejig.typedast
+import rejig.typing
+
+def compilesource(source, name, namespace, filename=None):
+    if filename is None:
+        filename = "<rejig {0}>".format(name)
+    code = compile(source, filename, "exec")
+    exec(code, namespace)
+    out = namespace[name]
+    out.source = source
+    return out
+
+def shared(node):
+    # ids of the typed subtrees that are reached more than once, as an assigned name's expression is from each of its reads
+    counts = {}
+    def walk(node):
+        if isinstance(node, (rejig.typedast.Def, rejig.typedast.Call)):
+            counts[id(node)] = counts.get(id(node), 0) + 1
+            if counts[id(node)] > 1:
+                return
+        if isinstance(node, rejig.typedast.Def):
+            walk(node.typedbody)
+        elif isinstance(node, rejig.typedast.Call):
+            for x in node.typedargs:
+                walk(x)
+            if isinstance(getattr(node.typedfcn, "array", None), rejig.typedast.AST):
+                walk(node.typedfcn.array)
+    walk(node)
+    return set(x for x, count in counts.items() if count > 1)
+
+def boundnames(node):
+    # names read by a typed tree that aren't bound by lambdas within it
+    if isinstance(node, rejig.typedast.Name):
+        return set([node.name])
+    elif isinstance(node, rejig.typedast.Def):
+        return boundnames(node.typedbody) - set(node.argnames)
+    elif isinstance(node, rejig.typedast.Call):
+        out = set()
+        for x in node.typedargs:
+            out.update(boundnames(x))
+        if isinstance(getattr(node.typedfcn, "array", None), rejig.typedast.AST):
+            out.update(boundnames(node.typedfcn.array))
+        return out
+    else:
+        return set()
+
+def canfail(node):
+    # True if evaluating node might raise, which only a bounds-checked [.] and min or max of a possibly empty list can
+    if isinstance(node, rejig.typedast.Def):
+        return canfail(node.typedbody)
+    elif isinstance(node, rejig.typedast.Call):
+        if node.fcn == "[.]" and rejig.typing.boundscheck(node):
+            return True
+        if str(node.typedfcn) in ("min", "max") and len(node.typedargs) == 1:
+            return True
+        if isinstance(getattr(node.typedfcn, "array", None), rejig.typedast.AST) and canfail(node.typedfcn.array):
+            return True
+        return any(canfail(x) for x in node.typedargs)
+    else:
+        return False
+
+def hoistable(node, argnames, ids):
+    # subtrees that read nothing but the function's arguments wherever they appear: those among ids and the largest ones inside lambdas,
+    # which would otherwise be computed again for every item (unless they might fail, and the lambda might never run)
+    out = set(ids)
+    def walk(node, scope, inside):
+        if isinstance(node, rejig.typedast.Def):
+            walk(node.typedbody, scope.union(node.argnames), True)
+        elif isinstance(node, rejig.typedast.Call):
+            names = boundnames(node)
+            invariant = names.issubset(argnames) and len(names & scope) == 0
+            if not invariant:
+                out.discard(id(node))
+            elif inside and not canfail(node):
+                out.add(id(node))
+                return
+            for x in node.typedargs:
+                walk(x, scope, inside)
+            if isinstance(getattr(node.typedfcn, "array", None), rejig.typedast.AST):
+                walk(node.typedfcn.array, scope, inside)
+    walk(node, frozenset(), False)
+    return out
+
+def cost(node):
+    # a rough count of operations per item; a lambda's body runs once per item of a list
+    if isinstance(node, rejig.typedast.Def):
+        return 4 * cost(node.typedbody)
+    elif isinstance(node, rejig.typedast.Call):
+        out = 1 + sum(cost(x) for x in node.typedargs if isinstance(x, rejig.typedast.AST))
+        if isinstance(getattr(node.typedfcn, "array", None), rejig.typedast.AST):
+            out += cost(node.typedfcn.array)
+        return out
+    else:
+        return 0
+
+_selectivities = {"==": 0.1, "!=": 0.9, "<": 1.0/3, "<=": 1.0/3, ">": 1.0/3, ">=": 1.0/3}
+
+def selectivity(node):
+    # estimated fraction of items for which a predicate is True, without looking at any data
+    if isinstance(node, rejig.typedast.Const):
+        return 1.0 if node.value else 0.0
+    elif isinstance(node, rejig.typedast.Call) and str(node.typedfcn) in _selectivities:
+        return _selectivities[str(node.typedfcn)]
+    elif isinstance(node, rejig.typedast.Call) and str(node.typedfcn) == "not":
+        return 1.0 - selectivity(node.typedargs[0])
+    elif isinstance(node, rejig.typedast.Call) and str(node.typedfcn) == "and":
+        return numpy.prod([selectivity(x) for x in node.typedargs])
+    elif isinstance(node, rejig.typedast.Call) and str(node.typedfcn) == "or":
+        return 1.0 - numpy.prod([1.0 - selectivity(x) for x in node.typedargs])
+    else:
+        return 0.5
+
+def junctionorder(call):
+    # the arguments of an "and" or "or" with those that decide the most items for the least work first;
+    # one that might fail stays after all of the arguments before it, which may be guarding it
+    conjunction = str(call.typedfcn) == "and"
+    def rank(x):
+        decided = 1.0 - selectivity(x) if conjunction else selectivity(x)
+        return cost(x) / max(decided, 1e-3)
+    out = []
+    segment = []
+    for x in call.typedargs:
+        if canfail(x) and len(segment) > 0:
+            out.extend(sorted(segment, key=rank))
+            segment = []
+        segment.append(x)
+    out.extend(sorted(segment, key=rank))
+    return out
+
+_identifier = re.compile(r"^[A-Za-z_][A-Za-z_0-9]*$")
+
+class PythonGenerator(object):
+    def __init__(self, action):
+        self.action = action
+        self.shared = shared(action.typedast)
+        self.hoistable = hoistable(action.typedast, set(action.argtypes), self.shared)
+        self.hoisted = {}
+        self.prelude = []
+        self.arrays = {}
+        self.constants = []
+
+    def const(self, value):
+        if isinstance(value, float) and not math.isinf(value) and not math.isnan(value):
+            return repr(value)
+        elif isinstance(value, float):
+            return "float({0})".format(repr(repr(value)))
+        elif value is None or isinstance(value, (bool, numbers.Number, str)):
+            return repr(value)
+        else:
+            raise NotImplementedError("no Python literal for {0}".format(repr(value)))
+
+    def array(self, node):
+        # a table is built once, when the generated module is loaded
+        dtype = _leaf(node.rettype)
+        key = (id(node.value), dtype)
+        if key not in self.arrays:
+            self.arrays[key] = "_c{0}".format(len(self.arrays))
+            self.constants.append("{0} = numpy.array([{1}], dtype=numpy.{2})\n".format(self.arrays[key], ", ".join(self.const(x) for x in node.value.tolist()), dtype.type.__name__))
+        return self.arrays[key]
+
+    def expr(self, node):
+        if isinstance(node, rejig.typedast.Const) and isinstance(node.value, numpy.ndarray):
+            return self.array(node)
+
+        elif isinstance(node, rejig.typedast.Const):
+            return self.const(node.value)
+
+        elif isinstance(node, rejig.typedast.Name):
+            return node.name
+
+        elif isinstance(node, rejig.typedast.Call) and id(node) in self.hoistable:
+            # computed once, before the return, unless it depends on a lambda's argument
+            if id(node) not in self.hoisted:
+                self.hoisted[id(node)] = "_s{0}".format(len(self.hoisted))
+                self.prelude.append("    {0} = {1}\n".format(self.hoisted[id(node)], node.typedfcn.aspython(node, self)))
+            return self.hoisted[id(node)]
+
+        elif isinstance(node, rejig.typedast.Call):
+            return node.typedfcn.aspython(node, self)
+
+        else:
+            raise AssertionError(type(node))
+
+    def source(self, name):
+        result = self.expr(self.action.typedast)
+        return "{0}def {1}({2}):\n{3}    return {4}\n".format("".join(self.constants), name, ", ".join(self.action.argtypes), "".join(self.prelude), result)
+
+def pythonsource(action, name="fcn"):
+    return PythonGenerator(action).source(name)
+
+def aspython(action, name="fcn"):
+    return compilesource(pythonsource(action, name), name, runtime("python"))
+
+def _prod(items, initial):
+    out = initial
+    for x in items:
+        out = out * x
+    return out
+
+_reducers = {"sum": numpy.add, "count": numpy.add, "prod": numpy.multiply, "min": numpy.minimum, "max": numpy.maximum, "any": numpy.logical_or, "all": numpy.logical_and}
+
+def _identity(how, dtype):
+    if how in ("sum", "count"):
+        return 0
+    elif how == "prod":
+        return 1
+    elif how in ("any", "all"):
+        return how == "all"
+    elif issubclass(dtype.type, numpy.bool_):
+        return how == "min"
+    elif issubclass(dtype.type, numpy.integer):
+        return numpy.iinfo(dtype).max if how == "min" else numpy.iinfo(dtype).min
+    else:
+        return numpy.inf if how == "min" else -numpy.inf
+
+def _reduce(how, array, dtype, segmented, required):
+    # segmented reduces each list (or row) separately; an empty one is only an error for min and max without an initial value
+    ufunc = _reducers[how]
+    if not segmented:
+        data = numpy.asarray(array)
+        if len(data) == 0:
+            if required and how in ("min", "max"):
+                raise ValueError("{0}() of an empty list".format(how))
+            return dtype.type(_identity(how, dtype))
+        return dtype.type(ufunc.reduce(data, dtype=dtype))
+
+    elif isinstance(array, awkward.JaggedArray):
+        # contiguous lists, so that every nonempty one starts where the last ended
+        array = array.compact()
+        nonempty = array.counts > 0
+        if required and how in ("min", "max") and not nonempty.all():
+            raise ValueError("{0}() of an empty list".format(how))
+        out = numpy.full(len(nonempty), _identity(how, dtype), dtype=dtype)
+        if nonempty.any():
+            out[nonempty] = ufunc.reduceat(array.content, array.starts[nonempty], dtype=dtype)
+        return out
+
+    else:
+        data = numpy.asarray(array)
+        if data.shape[1] == 0:
+            if required and how in ("min", "max") and len(data) > 0:
+                raise ValueError("{0}() of an empty list".format(how))
+            return numpy.full(len(data), _identity(how, dtype), dtype=dtype)
+        return ufunc.reduce(data, axis=1, dtype=dtype)
+
+def _jaggedfilter(array, mask):
+    # positions of the surviving content, so that starts and stops can be translated without a copy of the array structure
+    index = numpy.empty(len(mask) + 1, dtype=array.starts.dtype)
+    index[0] = 0
+    numpy.cumsum(mask, out=index[1:])
+    return awkward.JaggedArray(index[array.starts], index[array.stops], array.content[mask])
+
+def _filter(array, mask):
+    # mask may also be an array of indexes
+    if isinstance(array, awkward.JaggedArray):
+        return awkward.JaggedArray(array.starts[mask], array.stops[mask], array.content)
+    else:
+        return array[mask]
+
+def _gather(array, index, boundscheck):
+    array = numpy.asarray(array)
+    if boundscheck and ((index < -len(array)) | (index >= len(array))).any():
+        raise IndexError("index out of bounds in at least one item")
+    return array[index]
+
+def _jaggedgetitem(array, index, boundscheck):
+    if boundscheck and (array.counts <= (index if index >= 0 else -index - 1)).any():
+        raise IndexError("index {0} is out of bounds in at least one list".format(index))
+    if index >= 0:
+        return array.content[array.starts + index]
+    else:
+        return array.content[array.stops + index]
+
+class Vector(object):
+    # depth is the number of enclosing .maps this value is vectorized over; depth 0 is an ordinary value
+    def __init__(self, expr, depth, istemp=False, dtype=None):
+        self.expr = expr
+        self.depth = depth
+        self.istemp = istemp
+        self.dtype = dtype
+
+    def __repr__(self):
+        return "<Vector {0} at depth {1}>".format(self.expr, self.depth)
+
+    @property
+    def isarray(self):
+        return self.depth > 0
+
+class NumpyGenerator(PythonGenerator):
+    def __init__(self, action, scratch=False):
+        super(NumpyGenerator, self).__init__(action)
+        self.scratch = scratch
+        self.lines = []
+        self.numtemps = 0
+        self.env = {}
+        self.hidden = []
+        self.levels = {}
+        self.parents = {}
+        self.memo = {}
+
+    def newtemp(self):
+        out = "_t{0}".format(self.numtemps)
+        self.numtemps += 1
+        return out
+
+    def emit(self, line):
+        self.lines.append("    " + line)
+
+    def dtype(self, dtype):
+        return "numpy." + dtype.type.__name__
+
+    def alloc(self, temp, like, dtype):
+        # with scratch, new arrays come from the caller's _alloc(key, like, dtype) so that buffers can be reused between calls
+        return "_alloc({0}, {1}, {2})".format(repr(temp), like, self.dtype(dtype))
+
+    def full(self, temp, like, value, dtype):
+        if self.scratch:
+            self.emit("{0} = {1}".format(temp, self.alloc(temp, like, dtype)))
+            self.emit("{0}[:] = {1}".format(temp, value))
+        else:
+            self.emit("{0} = numpy.full(len({1}), {2}, dtype={3})".format(temp, like, value, self.dtype(dtype)))
+
+    def vector(self, node):
+        if id(node) not in self.shared:
+            return self.evaluate(node)
+
+        # a shared subtree is computed once and never overwritten in place, since it has other readers
+        if id(node) not in self.memo:
+            out = self.evaluate(node)
+            if not _identifier.match(out.expr):
+                temp = self.newtemp()
+                self.emit("{0} = {1}".format(temp, out.expr))
+                out = Vector(temp, out.depth, out.istemp, out.dtype)
+            self.memo[id(node)] = Vector(out.expr, out.depth, False, out.dtype)
+        return self.memo[id(node)]
+
+    def evaluate(self, node):
+        if isinstance(node, rejig.typedast.Const) and isinstance(node.value, numpy.ndarray):
+            return Vector(self.array(node), 0)
+
+        elif isinstance(node, rejig.typedast.Const):
+            return Vector(self.const(node.value), 0)
+
+        elif isinstance(node, rejig.typedast.Name):
+            if node.name in self.env:
+                return self.env[node.name]
+            else:
+                return Vector(node.name, 0)
+
+        elif isinstance(node, rejig.typedast.Call):
+            return node.typedfcn.asnumpy(node, self)
+
+        else:
+            raise AssertionError(type(node))
+
+    def bind(self, name, vector):
+        # a bound name may be read more than once, so it must never be overwritten in place;
+        # a lambda inside another may have an argument of the same name, which hides the outer one until it's unbound
+        self.hidden.append(self.env.get(name))
+        self.env[name] = Vector(vector.expr, vector.depth, False, vector.dtype)
+
+    def unbind(self, name):
+        hidden = self.hidden.pop()
+        if hidden is None:
+            del self.env[name]
+        else:
+            self.env[name] = hidden
+
+    def lift(self, vector, depth):
+        # broadcast one value per list to one value per list item with the lists' parents index
+        while vector.depth < depth:
+            level = vector.depth + 1
+            if level not in self.parents:
+                self.parents[level] = self.newtemp()
+                self.emit("{0} = {1}.parents".format(self.parents[level], self.levels[level]))
+            temp = self.newtemp()
+            if self.scratch and vector.dtype is not None:
+                self.emit("{0} = numpy.take({1}, {2}, out={3})".format(temp, vector.expr, self.parents[level], self.alloc(temp, self.parents[level], vector.dtype)))
+            else:
+                self.emit("{0} = {1}[{2}]".format(temp, vector.expr, self.parents[level]))
+            vector = Vector(temp, level, True, vector.dtype)
+        return vector
+
+    def iterate(self, array, call):
+        # returns the vectorized elements of array and a function that packs a vectorized result back into lists
+        if not isinstance(call.typedfcn.array.rettype, awkward.type.ArrayType):
+            raise NotImplementedError("numpy backend can't iterate over {0}{1}".format(rejig.typedast._typestr(call.typedfcn.array.rettype, ""), call.errline()))
+
+        if array.depth == 0:
+            def pack(out, dtype, wrap=True):
+                if not out.isarray:
+                    temp = self.newtemp()
+                    self.full(temp, array.expr, out.expr, dtype)
+                    out = Vector(temp, 1, True, dtype)
+                return Vector(out.expr, 0, out.istemp, out.dtype)
+            return Vector(array.expr, 1), pack
+
+        else:
+            # array holds one list per item at this depth: work on its content and reuse its starts and stops
+            jagged = self.newtemp()
+            self.emit("{0} = {1}".format(jagged, array.expr))
+            depth = array.depth + 1
+            self.levels[depth] = jagged
+            self.parents.pop(depth, None)
+            def pack(out, dtype, wrap=True):
+                if not out.isarray:
+                    temp = self.newtemp()
+                    self.full(temp, jagged + ".content", out.expr, dtype)
+                    out = Vector(temp, depth, True, dtype)
+                else:
+                    out = self.lift(out, depth)
+                del self.levels[depth]
+                self.parents.pop(depth, None)
+                if not wrap:
+                    return out
+                temp = self.newtemp()
+                self.emit("{0} = awkward.JaggedArray({1}.starts, {1}.stops, {2})".format(temp, jagged, out.expr))
+                return Vector(temp, array.depth)
+            return Vector(jagged + ".content", depth), pack
+
+    def map(self, call, array):
+        defn = call.typedargs[0]
+        elements, pack = self.iterate(self.vector(array), call)
+        self.bind(defn.argnames[0], elements)
+        out = self.vector(defn.typedbody)
+        self.unbind(defn.argnames[0])
+        return pack(out, _leaf(call.rettype))
+
+    def filter(self, call, array):
+        defn = call.typedargs[0]
+        array = self.vector(array)
+        elements, pack = self.iterate(array, call)
+        self.bind(defn.argnames[0], elements)
+        mask = self.vector(defn.typedbody)
+        self.unbind(defn.argnames[0])
+        mask = pack(mask, numpy.dtype(numpy.bool_), wrap=False)
+        temp = self.newtemp()
+        if array.depth == 0:
+            self.emit("{0} = _filter({1}, {2})".format(temp, array.expr, mask.expr))
+        else:
+            self.emit("{0} = _jaggedfilter({1}, {2})".format(temp, array.expr, mask.expr))
+        return Vector(temp, array.depth)
+
+    def ufunc(self, ufunc, call, fixdtype=True):
+        vectors = [self.vector(x) for x in call.typedargs]
+        left = vectors[0]
+        for right in vectors[1:]:
+            left = self.binary(ufunc, call.rettype, left, right, fixdtype)
+        return left
+
+    def binary(self, ufunc, dtype, left, right, fixdtype):
+        if fixdtype:
+            options = ", dtype={0}, casting='unsafe'".format(self.dtype(dtype))
+        else:
+            options = ""
+
+        if not left.isarray and not right.isarray:
+            return Vector("{0}({1}, {2}{3})".format(ufunc, left.expr, right.expr, options), 0)
+
+        depth = max(left.depth, right.depth)
+        if left.isarray:
+            left = self.lift(left, depth)
+        if right.isarray:
+            right = self.lift(right, depth)
+
+        # every temporary in a tree is used exactly once, so a dying operand can take the result
+        for operand in (left, right):
+            if operand.istemp and operand.dtype is not None and operand.dtype == dtype:
+                self.emit("{0}({1}, {2}, out={3}{4})".format(ufunc, left.expr, right.expr, operand.expr, options))
+                return Vector(operand.expr, depth, True, dtype)
+
+        temp = self.newtemp()
+        if self.scratch:
+            self.emit("{0} = {1}({2}, {3}, out={4}{5})".format(temp, ufunc, left.expr, right.expr, self.alloc(temp, left.expr if left.isarray else right.expr, dtype), options))
+        else:
+            self.emit("{0} = {1}({2}, {3}{4})".format(temp, ufunc, left.expr, right.expr, options))
+        return Vector(temp, depth, True, dtype)
+
+    def unary(self, ufunc, call, fixdtype=True):
+        vector = self.vector(call.typedargs[0])
+        options = ", dtype={0}, casting='unsafe'".format(self.dtype(call.rettype)) if fixdtype else ""
+        if not vector.isarray:
+            return Vector("{0}({1}{2})".format(ufunc, vector.expr, options), 0)
+        elif vector.istemp and vector.dtype is not None and vector.dtype == call.rettype:
+            self.emit("{0}({1}, out={1}{2})".format(ufunc, vector.expr, options))
+            return vector
+        else:
+            temp = self.newtemp()
+            self.emit("{0} = {1}({2}{3})".format(temp, ufunc, vector.expr, options))
+            return Vector(temp, vector.depth, True, call.rettype)
+
+    def level(self):
+        # the number of .maps the code being generated is inside
+        return max([0] + [x.depth for x in self.env.values()])
+
+    def restricted(self, node, depth, index):
+        # node computed only for the items at depth selected by index
+        env, memo, parents, levels = self.env, self.memo, self.parents, self.levels
+        self.env = dict(env)
+        self.memo = dict((n, x) for n, x in memo.items() if x.depth < depth)
+        self.parents = dict(parents)
+        self.levels = dict(levels)
+        for n in boundnames(node):
+            if n in env and env[n].depth == depth:
+                temp = self.newtemp()
+                self.emit("{0} = _filter({1}, {2})".format(temp, env[n].expr, index))
+                self.env[n] = Vector(temp, depth, False, env[n].dtype)
+        if depth in levels and any(n in env and 0 < env[n].depth < depth for n in boundnames(node)):
+            # outer values are lifted to the selected items only
+            if depth not in parents:
+                parents[depth] = self.newtemp()
+                self.emit("{0} = {1}.parents".format(parents[depth], levels[depth]))
+            self.parents[depth] = self.newtemp()
+            self.emit("{0} = {1}[{2}]".format(self.parents[depth], parents[depth], index))
+        try:
+            out = self.vector(node)
+            return self.lift(out, depth) if out.isarray else out
+        finally:
+            self.env, self.memo, self.parents, self.levels = env, memo, parents, levels
+
+    def junction(self, call, conjunction):
+        # an "and" (or "or") keeps the indexes of the items not yet decided, and each later argument is only computed for those,
+        # so that the work shrinks with each argument and an argument guarded by earlier ones never sees an item they exclude
+        depth = self.level()
+        args = junctionorder(call)
+        def undecided(mask):
+            return mask if conjunction else "numpy.logical_not({0})".format(mask)
+        if depth == 0 and not any(canfail(x) for x in args[1:]):
+            left = self.vector(args[0])
+            for x in args[1:]:
+                left = self.binary("numpy.logical_and" if conjunction else "numpy.logical_or", call.rettype, left, self.vector(x), False)
+            return left
+        elif depth == 0:
+            # one value: an argument's statements only run if the arguments before it left it undecided, as in Python
+            temp = self.newtemp()
+            self.emit("{0} = {1}".format(temp, self.vector(args[0]).expr))
+            for x in args[1:]:
+                self.emit("if {0}{1}:".format("" if conjunction else "not ", temp))
+                start = len(self.lines)
+                memo = self.memo
+                self.memo = dict(memo)
+                try:
+                    self.emit("{0} = {1}".format(temp, self.vector(x).expr))
+                finally:
+                    # nothing computed under the if may be reused after it
+                    self.memo = memo
+                self.lines[start:] = ["    " + line for line in self.lines[start:]]
+            return Vector(temp, 0)
+
+        length = self.newtemp()
+        self.emit("{0} = len({1})".format(length, [x for x in self.env.values() if x.depth == depth][0].expr))
+        index = None
+        pending = []
+        for x in args:
+            if index is None and (len(pending) == 0 or not canfail(x)):
+                vector = self.vector(x)
+                if vector.isarray:
+                    vector = self.lift(vector, depth)
+                    index = self.newtemp()
+                    self.emit("{0} = numpy.flatnonzero({1})".format(index, undecided(vector.expr)))
+                    for scalar in pending:
+                        self.emit("{0} = {0} if {1}{2} else {0}[:0]".format(index, "" if conjunction else "not ", scalar.expr))
+                else:
+                    pending.append(vector)
+                continue
+
+            if index is None:
+                index = self.newtemp()
+                self.emit("{0} = numpy.arange({1})".format(index, length))
+                for scalar in pending:
+                    self.emit("{0} = {0} if {1}{2} else {0}[:0]".format(index, "" if conjunction else "not ", scalar.expr))
+
+            vector = self.restricted(x, depth, index)
+            if vector.isarray:
+                self.emit("{0} = {0}[{1}]".format(index, undecided(vector.expr)))
+            else:
+                self.emit("{0} = {0} if {1}{2} else {0}[:0]".format(index, "" if conjunction else "not ", vector.expr))
+
+        temp = self.newtemp()
+        if index is None:
+            self.emit("{0} = numpy.full({1}, {2}, numpy.bool_)".format(temp, length, " and ".join(x.expr for x in pending) if conjunction else " or ".join(x.expr for x in pending)))
+        else:
+            self.emit("{0} = numpy.full({1}, {2}, numpy.bool_)".format(temp, length, not conjunction))
+            self.emit("{0}[{1}] = {2}".format(temp, index, conjunction))
+        return Vector(temp, depth, True, call.rettype)
+
+    def where(self, call, condition, then, otherwise):
+        vectors = [self.vector(x) for x in (condition, then, otherwise)]
+        if not any(x.isarray for x in vectors):
+            return Vector("{0}({2} if {1} else {3})".format(self.dtype(call.rettype), *[x.expr for x in vectors]), 0)
+        depth = max(x.depth for x in vectors)
+        vectors = [self.lift(x, depth) if x.isarray else x for x in vectors]
+        temp = self.newtemp()
+        self.emit("{0} = numpy.where({1}, {2}, {3}).astype({4}, copy=False)".format(temp, vectors[0].expr, vectors[1].expr, vectors[2].expr, self.dtype(call.rettype)))
+        return Vector(temp, depth, True, call.rettype)
+
+    combiners = {"sum": "numpy.add", "count": "numpy.add", "prod": "numpy.multiply", "min": "numpy.minimum", "max": "numpy.maximum", "any": "numpy.logical_or", "all": "numpy.logical_and"}
+
+    def reduce(self, call, how, array, initial):
+        # inside a .map, each item's list is reduced separately
+        array = self.vector(array)
+        temp = self.newtemp()
+        self.emit("{0} = _reduce({1}, {2}, numpy.dtype({3}), {4}, {5})".format(temp, repr(how), array.expr, self.dtype(call.rettype), array.isarray, initial is None))
+        out = Vector(temp, array.depth, array.isarray, call.rettype)
+        if initial is None:
+            return out
+        else:
+            return self.binary(self.combiners[how], call.rettype, out, self.vector(initial), True)
+
+    def length(self, call, array):
+        array = self.vector(array)
+        if array.depth == 0:
+            return Vector("len({0})".format(array.expr), 0)
+        else:
+            return Vector("{0}.counts".format(array.expr), array.depth, False, call.rettype)
+
+    def getitem(self, call, array, index, boundscheck):
+        array = self.vector(array)
+        index = self.vector(index)
+        if index.isarray and array.depth == 0 and isinstance(call.rettype, numpy.dtype):
+            # a lookup into one array (such as a literal table) for every item
+            temp = self.newtemp()
+            self.emit("{0} = _gather({1}, {2}, {3})".format(temp, array.expr, index.expr, boundscheck))
+            return Vector(temp, index.depth, True, call.rettype)
+        elif index.isarray:
+            raise NotImplementedError("numpy backend can't vectorize [.] with an array of indexes{0}".format(call.errline()))
+        if array.depth == 0:
+            return Vector("{0}[{1}]".format(array.expr, index.expr), 0)
+        else:
+            temp = self.newtemp()
+            self.emit("{0} = _jaggedgetitem({1}, {2}, {3})".format(temp, array.expr, index.expr, boundscheck))
+            return Vector(temp, array.depth, True, _leaf(call.rettype))
+
+    def source(self, name):
+        result = self.vector(self.action.typedast)
+        params = list(self.action.argtypes) + (["_alloc"] if self.scratch else [])
+        lines = self.lines
+        if self.scratch:
+            lines, self.numbuffers = plan(lines, result.expr)
+        return "{0}def {1}({2}):\n{3}    return {4}\n".format("".join(self.constants), name, ", ".join(params), "".join(x + "\n" for x in lines), result.expr)
+
+def _leaf(type):
+    while isinstance(type, awkward.type.ArrayType):
+        type = type.to
+    return type
+
+_temp = re.compile(r"(?<!')\b_t[0-9]+\b(?!')")
+
+def plan(lines, result):
+    # assigns every temporary drawn from _alloc to one of as few buffers as possible, never sharing a buffer between two temporaries that are alive at once
+    defined = {}
+    fresh = set()
+    aliases = {}
+    lastuse = {}
+    for i, line in enumerate(lines + ["return " + result]):
+        target, expr = None, line.strip()
+        if re.match(r"_t[0-9]+ = ", expr):
+            target, expr = expr.split(" = ", 1)
+            defined[target] = i
+        if target is not None and "_alloc({0}".format(repr(target)) in expr:
+            fresh.add(target)
+        for x in _temp.findall(expr):
+            lastuse[x] = i
+            if target is not None and target not in fresh:
+                # anything not freshly allocated may be a view of its arguments
+                aliases.setdefault(x, set()).add(target)
+
+    # a temporary lives as long as any view of it does
+    end = {}
+    for x in sorted(defined, key=lambda x: -defined[x]):
+        end[x] = max([lastuse.get(x, defined[x])] + [end[y] for y in aliases.get(x, ()) if y in end])
+
+    slots = {}
+    free = []
+    active = []
+    numbuffers = 0
+    for x in sorted(fresh, key=lambda x: defined[x]):
+        for y in [y for y in active if end[y] < defined[x]]:
+            active.remove(y)
+            free.append(slots[y])
+        if len(free) > 0:
+            slots[x] = free.pop()
+        else:
+            slots[x] = numbuffers
+            numbuffers += 1
+        active.append(x)
+
+    lines = [re.sub(r"_alloc\('(_t[0-9]+)'", lambda m: "_alloc({0}".format(slots[m.group(1)]), x) for x in lines]
+    return lines, numbuffers
+
+def runtime(backend):
+    # everything that generated code of backend refers to; numexpr and numba are slow to import, so only their own backends import them
+    out = {"numpy": numpy, "awkward": awkward, "_filter": _filter, "_jaggedfilter": _jaggedfilter, "_jaggedgetitem": _jaggedgetitem, "_prod": _prod, "_reduce": _reduce, "_gather": _gather}
+    if backend in ("numexpr", "numba"):
+        try:
+            out[backend] = __import__(backend)
+        except ImportError:
+            pass
+    return out
+
+_slot = re.compile(r"_alloc\(([0-9]+),")
+
+def numbuffers(source):
+    # how many buffers the source of a scratch kernel draws from _alloc, for a kernel compiled from a cached source
+    return len(set(_slot.findall(source)))
+
+def numpysource(action, name="fcn", scratch=False):
+    return NumpyGenerator(action, scratch).source(name)
+
+def asnumpy(action, name="fcn", scratch=False):
+    generator = NumpyGenerator(action, scratch)
+    out = compilesource(generator.source(name), name, runtime("numpy"))
+    if scratch:
+        out.numbuffers = generator.numbuffers
+    return out
+
+# dtypes that numexpr's virtual machine can hold
+numexprtypes = frozenset(numpy.dtype(x) for x in (numpy.bool_, numpy.int32, numpy.int64, numpy.float32, numpy.float64, numpy.complex128))
+
+class NumexprGenerator(NumpyGenerator):
+    def __init__(self, action):
+        super(NumexprGenerator, self).__init__(action)
+        self.leaves = None
+
+    def fusable(self, node):
+        if isinstance(node, rejig.typedast.Call) and str(node.typedfcn) in ("and", "or") and canfail(node):
+            # evaluated everywhere, an argument that was guarded by the others could fail
+            return False
+        return isinstance(node, rejig.typedast.Call) and node.typedfcn.isnumexpr() and _leaf(node.rettype) in numexprtypes and all(isinstance(x, rejig.typedast.AST) and _leaf(x.rettype) in numexprtypes for x in node.typedargs)
+
+    def numexpr(self, node):
+        if isinstance(node, rejig.typedast.Const) and isinstance(node.value, (bool, numbers.Real)) and not (isinstance(node.value, float) and (math.isinf(node.value) or math.isnan(node.value))):
+            return self.const(node.value)
+
+        elif self.fusable(node) and id(node) not in self.hoistable:
+            return node.typedfcn.asnumexpr(node, self)
+
+        else:
+            # anything numexpr can't express (or that needn't be computed per item) is computed by the numpy path and passed in by name
+            self.leaves.append(self.vector(node))
+            return "_e{0}".format(len(self.leaves) - 1)
+
+    def evaluate(self, node):
+        if not self.fusable(node):
+            return super(NumexprGenerator, self).evaluate(node)
+
+        # a maximal numexpr subtree becomes one blocked evaluation with no full-size intermediates
+        outer, self.leaves = self.leaves, []
+        expr = node.typedfcn.asnumexpr(node, self)
+        leaves, self.leaves = self.leaves, outer
+
+        depth = max([0] + [x.depth for x in leaves])
+        leaves = [self.lift(x, depth) if x.isarray else x for x in leaves]
+        dtype = _leaf(node.rettype)
+
+        temp = self.newtemp()
+        self.emit("{0} = numexpr.evaluate({1}, local_dict={{{2}}}).astype({3}, copy=False){4}".format(temp, repr(expr), ", ".join("'_e{0}': {1}".format(i, x.expr) for i, x in enumerate(leaves)), self.dtype(dtype), "" if depth > 0 else "[()]"))
+        return Vector(temp, depth, depth > 0, dtype)
+
+def numexprsource(action, name="fcn"):
+    try:
+        import numexpr
+    except ImportError:
+        return numpysource(action, name)
+    return NumexprGenerator(action).source(name)
+
+def asnumexpr(action, name="fcn"):
+    return compilesource(numexprsource(action, name), name, runtime("numexpr"))
+
+class Chain(object):
+    # a .map/.filter chain over one array argument, fused into a single loop over its items
+    def __init__(self, source, stages):
+        self.source = source
+        self.stages = stages
+
+    def then(self, kind, defn):
+        return Chain(self.source, self.stages + ((kind, defn),))
+
+class NumbaGenerator(PythonGenerator):
+    def __init__(self, action, cache=False):
+        super(NumbaGenerator, self).__init__(action)
+        self.cache = cache
+        self.lines = []
+        self.indent = 1
+        self.numtemps = 0
+        self.env = None
+        self.params = {}
+        for n, t in action.argtypes.items():
+            self.params[n] = self.kind(t)
+
+    def kind(self, type):
+        if isinstance(type, numpy.dtype):
+            return "scalar"
+        elif isinstance(type, awkward.type.ArrayType):
+            inner = type.to
+            while isinstance(inner, awkward.type.ArrayType) and inner.takes != numpy.inf:
+                inner = inner.to
+            if isinstance(inner, numpy.dtype):
+                return "array"
+            elif isinstance(inner, awkward.type.ArrayType) and isinstance(inner.to, numpy.dtype) and type.to is inner:
+                return "jagged"
+        raise NotImplementedError("numba backend can't take {0} as an argument".format(rejig.typedast._typestr(type, "")))
+
+    def numbatype(self, type):
+        if isinstance(type, numpy.dtype):
+            return "boolean" if issubclass(type.type, numpy.bool_) else type.name
+        ndim = 0
+        while isinstance(type, awkward.type.ArrayType):
+            type = type.to
+            ndim += 1
+        return "{0}[{1}]".format(self.numbatype(type), ", ".join([":"] * ndim))
+
+    def signature(self, rettype):
+        args = []
+        for n, t in self.action.argtypes.items():
+            if self.params[n] == "jagged":
+                args.extend(["int64[:]", "int64[:]", self.numbatype(t.to.to) + "[:]"])
+            else:
+                args.append(self.numbatype(t))
+        return "{0}({1})".format(rettype, ", ".join(args))
+
+    def arguments(self, wrapper):
+        out = []
+        for n in self.action.argtypes:
+            if self.params[n] == "jagged" and wrapper:
+                out.extend(["numpy.asarray({0}.starts, numpy.int64)".format(n), "numpy.asarray({0}.stops, numpy.int64)".format(n), "{0}.content".format(n)])
+            elif self.params[n] == "jagged":
+                out.extend(["_{0}_starts".format(n), "_{0}_stops".format(n), "_{0}_content".format(n)])
+            else:
+                out.append(n)
+        return out
+
+    def newtemp(self):
+        out = "_v{0}".format(self.numtemps)
+        self.numtemps += 1
+        return out
+
+    def emit(self, line):
+        self.lines.append("    " * self.indent + line)
+
+    def dtype(self, dtype):
+        return "numpy." + dtype.type.__name__
+
+    def expr(self, node):
+        if isinstance(node, rejig.typedast.Name) and self.env is not None and self.env.get(node.name) == "list":
+            raise NotImplementedError("numba backend can't use the list {0} as a value".format(repr(node.name)))
+        elif isinstance(node, rejig.typedast.Call) and id(node) in self.hoistable and isinstance(node.rettype, numpy.dtype):
+            # numbers that don't depend on the item are computed before the loop
+            if id(node) not in self.hoisted:
+                value = node.typedfcn.asnumba(node, self)
+                self.hoisted[id(node)] = self.newtemp()
+                self.prelude.append("    {0} = {1}\n".format(self.hoisted[id(node)], value))
+            return self.hoisted[id(node)]
+        elif isinstance(node, rejig.typedast.Call):
+            return node.typedfcn.asnumba(node, self)
+        else:
+            return super(NumbaGenerator, self).expr(node)
+
+    def scalar(self, node):
+        out = self.expr(node)
+        if isinstance(out, Chain):
+            raise NotImplementedError("numba backend only fuses .map and .filter at the top of the expression{0}".format(node.errline() if isinstance(node, rejig.typedast.Call) else ""))
+        return out
+
+    def chain(self, call, array, kind):
+        if self.env is not None:
+            raise NotImplementedError("numba backend can't fuse a .map or .filter inside another{0}".format(call.errline()))
+        if isinstance(array, rejig.typedast.Name) and self.params.get(array.name) in ("array", "jagged"):
+            source = Chain(array.name, ())
+        else:
+            source = self.expr(array)
+            if not isinstance(source, Chain):
+                raise NotImplementedError("numba backend can only loop over arguments{0}".format(call.errline()))
+        return source.then(kind, call.typedargs[0])
+
+    def map(self, call, array):
+        return self.chain(call, array, "map")
+
+    def filter(self, call, array):
+        return self.chain(call, array, "filter")
+
+    def junction(self, call, conjunction):
+        args = junctionorder(call)
+        if not any(canfail(x) for x in args[1:]):
+            return "({0})".format(" {0} ".format("and" if conjunction else "or").join(self.scalar(x) for x in args))
+        # an argument's bounds checks are statements, so they only run where the arguments before it left the item undecided
+        temp = self.newtemp()
+        self.emit("{0} = {1}".format(temp, self.scalar(args[0])))
+        for x in args[1:]:
+            self.emit("if {0}{1}:".format("" if conjunction else "not ", temp))
+            self.indent += 1
+            self.emit("{0} = {1}".format(temp, self.scalar(x)))
+            self.indent -= 1
+        return temp
+
+    def boundscheck(self, index, length):
+        self.emit("if not -{1} <= {0} < {1}: raise IndexError(\"index out of bounds in at least one list\")".format(index, length))
+
+    def length(self, call, array):
+        if isinstance(array, rejig.typedast.Name) and self.env is not None and self.env.get(array.name) == "list":
+            return "(_stop - _start)"
+        elif isinstance(array, rejig.typedast.Name) and self.env is not None and self.env.get(array.name) == "row":
+            return "len({0})".format(array.name)
+        elif isinstance(array, rejig.typedast.Name) and self.params.get(array.name) == "jagged":
+            return "len(_{0}_starts)".format(array.name)
+        elif isinstance(array, rejig.typedast.Name) and self.params.get(array.name) == "array":
+            return "len({0})".format(array.name)
+        elif isinstance(array, rejig.typedast.Const) and isinstance(array.value, numpy.ndarray):
+            return str(len(array.value))
+        else:
+            raise NotImplementedError("numba backend can only take the length of arguments and their items{0}".format(call.errline()))
+
+    def getitem(self, call, array, index, boundscheck):
+        if not isinstance(call.rettype, numpy.dtype):
+            raise NotImplementedError("numba backend can't select lists with [.]{0}".format(call.errline()))
+        length = self.length(call, array)
+        value = self.scalar(index)
+        if boundscheck:
+            self.boundscheck(value, length)
+        if isinstance(array, rejig.typedast.Name) and self.env is not None and self.env.get(array.name) == "list":
+            content = "_{0}_content".format(self.sourcename)
+            if isinstance(index, rejig.typedast.Const):
+                return "{0}[{1} + {2}]".format(content, "_start" if index.value >= 0 else "_stop", value)
+            else:
+                return "{0}[(_start + {1}) if {1} >= 0 else (_stop + {1})]".format(content, value)
+        else:
+            return "{0}[{1}]".format(self.scalar(array), value)
+
+    def loop(self, chain, stages, predicates):
+        # emits the stages' bodies for item _i and returns the final item's expression and kind
+        if self.params[chain.source] == "jagged":
+            self.emit("_start = _{0}_starts[_i]".format(chain.source))
+            self.emit("_stop = _{0}_stops[_i]".format(chain.source))
+            item, kind = None, "list"
+        elif isinstance(self.action.argtypes[chain.source].to, awkward.type.ArrayType):
+            item, kind = "{0}[_i]".format(chain.source), "row"
+        else:
+            item, kind = "{0}[_i]".format(chain.source), "scalar"
+
+        for stage, defn in stages:
+            self.env[defn.argnames[0]] = kind
+            if kind != "list":
+                self.emit("{0} = {1}".format(defn.argnames[0], item))
+            if stage == "map":
+                if not isinstance(defn.typedbody.rettype, numpy.dtype):
+                    raise NotImplementedError("numba backend can only .map items to numbers")
+                value = self.scalar(defn.typedbody)
+                item, kind = self.newtemp(), "scalar"
+                self.emit("{0} = {1}".format(item, value))
+            elif predicates:
+                self.emit("if {0}:".format(self.scalar(defn.typedbody)))
+                self.indent += 1
+        return item, kind
+
+    def fused(self, chain, dtype):
+        self.sourcename = chain.source
+        self.env = {}
+        self.emit("_n = {0}".format("len(_{0}_starts)" if self.params[chain.source] == "jagged" else "len({0})").format(chain.source))
+        filters = [i for i, (stage, defn) in enumerate(chain.stages) if stage == "filter"]
+
+        if len(filters) == 0:
+            self.emit("_out = numpy.empty(_n, dtype={0})".format(self.dtype(dtype)))
+            self.emit("for _i in numba.prange(_n):")
+            self.indent += 1
+            item, kind = self.loop(chain, chain.stages, True)
+            if kind != "scalar":
+                raise NotImplementedError("numba backend can only return numbers from a .map")
+            self.emit("_out[_i] = {0}".format(item))
+            self.indent = 1
+            return "_out", self.numbatype(dtype) + "[:]", False
+
+        # first pass: which items survive every .filter
+        self.emit("_mask = numpy.zeros(_n, dtype=numpy.bool_)")
+        self.emit("for _i in numba.prange(_n):")
+        self.indent += 1
+        self.loop(chain, chain.stages[:filters[-1] + 1], True)
+        self.emit("_mask[_i] = True")
+        self.indent = 1
+        self.env = {}
+        if len(filters) == len(chain.stages):
+            return "_mask", "boolean[:]", True
+
+        # second pass: each survivor's output position, then the .map bodies of survivors only
+        self.emit("_index = numpy.empty(_n, dtype=numpy.int64)")
+        self.emit("_count = 0")
+        self.emit("for _i in range(_n):")
+        self.emit("    _index[_i] = _count")
+        self.emit("    _count += _mask[_i]")
+        self.emit("_out = numpy.empty(_count, dtype={0})".format(self.dtype(dtype)))
+        self.emit("for _i in numba.prange(_n):")
+        self.indent += 1
+        self.emit("if _mask[_i]:")
+        self.indent += 1
+        item, kind = self.loop(chain, chain.stages, False)
+        if kind != "scalar":
+            raise NotImplementedError("numba backend can only return numbers from a .map")
+        self.emit("_out[_index[_i]] = {0}".format(item))
+        self.indent = 1
+        return "_out", self.numbatype(dtype) + "[:]", False
+
+    def source(self, name):
+        result = self.expr(self.action.typedast)
+        if isinstance(result, Chain):
+            result, rettype, ismask = self.fused(result, _leaf(self.action.typedast.rettype))
+            options = ", parallel=True"
+        else:
+            rettype, ismask, options = self.numbatype(self.action.typedast.rettype), False, ""
+        if self.cache:
+            # numba's own cache of machine code, next to the file this source is loaded from
+            options += ", cache=True"
+
+        kernel = "_{0}_kernel".format(name)
+        call = "{0}({1})".format(kernel, ", ".join(self.arguments(True)))
+        if ismask:
+            call = "_filter({0}, {1})".format(self.sourcename, call)
+        # numba freezes the tables, which are globals, into the kernel
+        return "{0}@numba.njit({1}{2})\ndef {3}({4}):\n{5}    return {6}\n\ndef {7}({8}):\n    return {9}\n".format("".join(self.constants), repr(self.signature(rettype)), options, kernel, ", ".join(self.arguments(False)), "".join(self.prelude + [x + "\n" for x in self.lines]), result, name, ", ".join(self.action.argtypes), call)
+
+def numbasource(action, name="fcn", cache=False):
+    try:
+        import numba
+    except ImportError:
+        return numpysource(action, name)
+    try:
+        return NumbaGenerator(action, cache).source(name)
+    except NotImplementedError:
+        # only what fits in fused loops is compiled by numba; everything else stays vectorized
+        return numpysource(action, name)
+
+def asnumba(action, name="fcn"):
+    return compilesource(numbasource(action, name), name, runtime("numba"))
+
+backends = {"python": aspython, "numpy": asnumpy, "numexpr": asnumexpr, "numba": asnumba}
+sources = {"python": pythonsource, "numpy": numpysource, "numexpr": numexprsource, "numba": numbasource}
+
+# set by rejig.kernelcache.enable to load and store generated kernels on disk
+diskcache = None
+
+def build(action, backend, scratch=False):
+    # with scratch, a numpy kernel that draws its new arrays from the caller's _alloc (see asnumpy)
+    if backend not in backends:
+        raise ValueError("unrecognized backend: {0} (must be one of {1})".format(repr(backend), ", ".join(repr(x) for x in sorted(backends))))
+    if scratch and backend != "numpy":
+        raise ValueError("only the numpy backend has scratch kernels, not {0}".format(repr(backend)))
+    if diskcache is not None:
+        return diskcache.load(action, backend, scratch)
+    elif scratch:
+        return asnumpy(action, scratch=True)
+    return backends[backend](action)
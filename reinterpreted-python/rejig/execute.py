@@ -0,0 +1,416 @@
+import multiprocessing
+import threading
+import timeit
+import traceback
+
+import numpy
+
+import awkward
+
+import rejig.codegen
+import rejig.library
+import rejig.typedast
+
+class Executor(object):
+    def __init__(self, action, backend="python"):
+        self.action = action
+        self.backend = backend
+
+    def __repr__(self):
+        return "<{0} of {1} with {2} backend>".format(type(self).__name__, repr(self.action), repr(self.backend))
+
+    def __call__(self, *args):
+        return self.action.compile(self.backend)(*args)
+
+def cachesize(default=1048576):
+    # per-core L2 size on Linux, or default if it can't be read
+    try:
+        with open("/sys/devices/system/cpu/cpu0/cache/index2/size") as file:
+            text = file.read().strip()
+    except (IOError, OSError):
+        return default
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3}
+    if text[-1:].upper() in units:
+        return int(text[:-1]) * units[text[-1:].upper()]
+    else:
+        return int(text)
+
+def partitioned(action):
+    # name of the array argument whose items the result is computed from, if the result is an item-by-item .map/.filter chain over it
+    node = action.typedast
+    ischain = False
+    while isinstance(node, rejig.typedast.Call) and isinstance(node.typedfcn, (rejig.library.ArrayMap, rejig.library.ArrayFilter)):
+        node = node.typedfcn.array
+        ischain = True
+    if ischain and isinstance(node, rejig.typedast.Name) and node.name in action.argtypes:
+        return node.name
+    else:
+        return None
+
+def compact(array):
+    if isinstance(array, awkward.JaggedArray):
+        if not array.iscompact:
+            array = array.compact()
+        return awkward.JaggedArray.fromoffsets(array.offsets, compact(array.content))
+    else:
+        return array
+
+def block(array, start, stop):
+    # items start:stop of a compact array, with jagged content sliced along its offsets
+    if isinstance(array, awkward.JaggedArray):
+        offsets = array.offsets[start:stop + 1]
+        return awkward.JaggedArray.fromoffsets(offsets - offsets[0], block(array.content, offsets[0], offsets[-1]))
+    else:
+        return array[start:stop]
+
+def boundaries(array, blocksize):
+    # each block holds about blocksize items of content, without splitting a list
+    if isinstance(array, awkward.JaggedArray):
+        offsets = array.offsets
+        start = 0
+        while start < len(array):
+            stop = int(numpy.searchsorted(offsets, offsets[start] + blocksize, side="right")) - 1
+            stop = min(max(stop, start + 1), start + blocksize, len(array))
+            yield start, stop
+            start = stop
+    else:
+        for start in range(0, len(array), blocksize):
+            yield start, min(start + blocksize, len(array))
+
+def stitch(results, empty=None):
+    # with no blocks there's no result to take a type from, so empty() computes the result for no items
+    if len(results) == 0 and empty is not None:
+        return empty()
+    elif len(results) > 0 and isinstance(results[0], awkward.JaggedArray):
+        return awkward.JaggedArray.concatenate(results)
+    elif len(results) > 0 and isinstance(results[0], list):
+        return [x for result in results for x in result]
+    else:
+        return numpy.concatenate(results)
+
+class BufferPool(object):
+    # buffers for the planned slots of generated code, in power-of-two size classes and kept between calls (and between Actions, if shared)
+    def __init__(self, minsize=64):
+        self.minsize = minsize
+        self.slots = {}
+        self.free = {}
+        self.allocations = 0
+        self.reuses = 0
+        self.nbytes = 0
+        self.peak = 0
+
+    def sizeclass(self, nbytes):
+        out = self.minsize
+        while out < nbytes:
+            out *= 2
+        return out
+
+    def release(self, key):
+        buffer = self.slots.pop(key, None)
+        if buffer is not None:
+            self.free.setdefault(len(buffer), []).append(buffer)
+
+    def __call__(self, key, like, dtype):
+        dtype = numpy.dtype(dtype)
+        nbytes = len(like) * dtype.itemsize
+        buffer = self.slots.get(key, None)
+        if buffer is None or len(buffer) < nbytes:
+            self.release(key)
+            size = self.sizeclass(nbytes)
+            if len(self.free.get(size, [])) > 0:
+                buffer = self.free[size].pop()
+                self.reuses += 1
+            else:
+                buffer = numpy.empty(size, dtype=numpy.uint8)
+                self.allocations += 1
+                self.nbytes += size
+                self.peak = max(self.peak, self.nbytes)
+            self.slots[key] = buffer
+        else:
+            self.reuses += 1
+        return buffer[:nbytes].view(dtype)
+
+    def clear(self):
+        # the statistics describe the buffers held, so they start over with them
+        self.slots = {}
+        self.free = {}
+        self.allocations = 0
+        self.reuses = 0
+        self.nbytes = 0
+        self.peak = 0
+
+    def stats(self):
+        return {"allocations": self.allocations, "reuses": self.reuses, "nbytes": self.nbytes, "peak": self.peak}
+
+class ChunkedExecutor(Executor):
+    def __init__(self, action, backend="numpy", blocksize=None, pool=None):
+        super(ChunkedExecutor, self).__init__(action, backend)
+        self.source = partitioned(action)
+        if blocksize is None:
+            blocksize = max(1, cachesize() // self.rowbytes())
+        self.blocksize = blocksize
+        if pool is None:
+            pool = BufferPool()
+        self.pool = pool
+
+        rettype = action.typedast.rettype
+        self.flat = isinstance(rettype, awkward.type.ArrayType) and isinstance(rettype.to, numpy.dtype)
+        if backend == "numpy" and self.flat:
+            # the block's result is copied into the output before the next block overwrites its buffers
+            self.fcn = rejig.codegen.build(action, "numpy", scratch=True)
+        else:
+            self.fcn = None
+
+    def __repr__(self):
+        return "<{0} of {1} with {2} backend in blocks of {3}>".format(type(self).__name__, repr(self.action), repr(self.backend), self.blocksize)
+
+    def rowbytes(self):
+        # bytes touched per item: every argument column and every intermediate
+        types = [rejig.codegen._leaf(x) for x in self.action.argtypes.values()]
+        def recurse(node):
+            if isinstance(node, rejig.typedast.Call):
+                types.append(rejig.codegen._leaf(node.rettype))
+                for x in node.typedargs:
+                    recurse(x)
+            elif isinstance(node, rejig.typedast.Def):
+                recurse(node.typedbody)
+        recurse(self.action.typedast)
+        return max(1, sum(x.itemsize for x in types if isinstance(x, numpy.dtype)))
+
+    def evaluate(self, args):
+        if self.fcn is not None:
+            return self.fcn(*(args + (self.pool,)))
+        else:
+            return self.action.compile(self.backend)(*args)
+
+    def __call__(self, *args):
+        if self.source is None:
+            return super(ChunkedExecutor, self).__call__(*args)
+
+        index = list(self.action.argtypes).index(self.source)
+        array = compact(args[index])
+
+        if self.flat:
+            out = numpy.empty(len(array), dtype=self.action.typedast.rettype.to)
+            length = 0
+        else:
+            results = []
+
+        for start, stop in boundaries(array, self.blocksize):
+            blockargs = args[:index] + (block(array, start, stop),) + args[index + 1:]
+            result = self.evaluate(blockargs)
+            if self.flat:
+                out[length : length + len(result)] = result
+                length += len(result)
+            else:
+                results.append(result)
+
+        if self.flat:
+            return out[:length]
+        else:
+            return stitch(results, lambda: self.evaluate(args[:index] + (block(array, 0, 0),) + args[index + 1:]))
+
+def mapsonly(action):
+    # a chain without .filter has exactly one output per input item
+    node = action.typedast
+    while isinstance(node, rejig.typedast.Call) and isinstance(node.typedfcn, rejig.library.ArrayMap):
+        node = node.typedfcn.array
+    return not (isinstance(node, rejig.typedast.Call) and isinstance(node.typedfcn, rejig.library.ArrayFilter))
+
+class ThreadedExecutor(Executor):
+    def __init__(self, action, backend="numpy", workers=None, partitions=None):
+        super(ThreadedExecutor, self).__init__(action, backend)
+        self.source = partitioned(action)
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        if partitions is None:
+            partitions = workers
+        self.workers = workers
+        self.partitions = partitions
+        rettype = action.typedast.rettype
+        self.direct = isinstance(rettype, awkward.type.ArrayType) and isinstance(rettype.to, numpy.dtype) and mapsonly(action)
+        self.timing = []
+
+    def __repr__(self):
+        return "<{0} of {1} with {2} backend on {3} threads>".format(type(self).__name__, repr(self.action), repr(self.backend), self.workers)
+
+    def __call__(self, *args):
+        import concurrent.futures
+
+        if self.source is None:
+            return super(ThreadedExecutor, self).__call__(*args)
+
+        fcn = self.action.compile(self.backend)
+        index = list(self.action.argtypes).index(self.source)
+        array = compact(args[index])
+        if isinstance(array, awkward.JaggedArray):
+            size = array.offsets[-1] - array.offsets[0]
+        else:
+            size = len(array)
+        blocksize = max(1, -(-size // self.partitions))
+
+        if self.direct:
+            out = numpy.empty(len(array), dtype=self.action.typedast.rettype.to)
+
+        def run(start, stop):
+            starttime = timeit.default_timer()
+            result = fcn(*(args[:index] + (block(array, start, stop),) + args[index + 1:]))
+            if self.direct:
+                # each partition fills its own slice of the output
+                out[start:stop] = result
+                result = None
+            return result, {"start": start, "stop": stop, "thread": threading.current_thread().name, "time": timeit.default_timer() - starttime}
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = [pool.submit(run, start, stop) for start, stop in boundaries(array, blocksize)]
+            done = [x.result() for x in futures]
+
+        self.timing = [timing for result, timing in done]
+        if self.direct:
+            return out
+        else:
+            return stitch([result for result, timing in done], lambda: fcn(*(args[:index] + (block(array, 0, 0),) + args[index + 1:])))
+
+def share(array, blocks):
+    # copies an argument's buffers into new shared memory blocks and returns what a worker needs to attach them
+    from multiprocessing.shared_memory import SharedMemory
+    if isinstance(array, awkward.JaggedArray):
+        return ("jagged", share(array.offsets, blocks), share(array.content, blocks))
+    else:
+        array = numpy.ascontiguousarray(array)
+        shm = SharedMemory(create=True, size=max(1, array.nbytes))
+        blocks.append(shm)
+        numpy.ndarray(array.shape, array.dtype, buffer=shm.buf)[...] = array
+        return ("array", shm.name, array.dtype.str, array.shape)
+
+def attach(descriptor, blocks):
+    from multiprocessing.shared_memory import SharedMemory
+    if descriptor[0] == "jagged":
+        return awkward.JaggedArray.fromoffsets(attach(descriptor[1], blocks), attach(descriptor[2], blocks))
+    elif descriptor[0] == "array":
+        shm = SharedMemory(name=descriptor[1])
+        blocks.append(shm)
+        return numpy.ndarray(descriptor[3], numpy.dtype(descriptor[2]), buffer=shm.buf)
+    else:
+        return descriptor[1]
+
+_worker = {}
+
+def _initialize(action, backend, inputs, outputs, index):
+    _worker["fcn"] = action.compile(backend)
+    _worker["inputs"] = inputs
+    _worker["outputs"] = outputs
+    _worker["index"] = index
+
+def _run(start, stop):
+    # the shared memory is mapped for each partition and unmapped after it, so that a worker holds no mappings between tasks
+    blocks = []
+    try:
+        return _partition(start, stop, blocks)
+    except Exception as err:
+        # a traceback's frames would keep views of the shared memory, which can't be closed while they exist
+        traceback.clear_frames(err.__traceback__)
+        raise
+    finally:
+        for shm in blocks:
+            shm.close()
+
+def _partition(start, stop, blocks):
+    starttime = timeit.default_timer()
+    args = tuple(attach(x, blocks) for x in _worker["inputs"])
+    outputs = tuple(attach(x, blocks) for x in _worker["outputs"])
+    index = _worker["index"]
+    result = _worker["fcn"](*(args[:index] + (block(args[index], start, stop),) + args[index + 1:]))
+
+    # a partition's results fit in the output region of its own input items, since a .filter can only drop items
+    if len(outputs) == 1:
+        outputs[0][start : start + len(result)] = result
+        placed = (start, len(result), 0, 0)
+    else:
+        if isinstance(result, awkward.JaggedArray):
+            counts, content = result.counts, result.flatten()
+        else:
+            counts, content = [len(x) for x in result], [y for x in result for y in x]
+        offsets = args[index].offsets
+        contentstart = offsets[start] - offsets[0]
+        outputs[0][start : start + len(counts)] = counts
+        outputs[1][contentstart : contentstart + len(content)] = content
+        placed = (start, len(counts), contentstart, len(content))
+    return placed, {"start": start, "stop": stop, "process": multiprocessing.current_process().name, "time": timeit.default_timer() - starttime}
+
+def _context():
+    # a forked worker inherits the parent's threads in whatever state they're in (numba's thread pool, after a parallel kernel, can hang it),
+    # so workers start from a fresh process; those import the main module again, which must not start workers of its own
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    else:
+        return multiprocessing.get_context("spawn")
+
+class ProcessExecutor(Executor):
+    def __init__(self, action, backend="python", workers=None, partitions=None):
+        super(ProcessExecutor, self).__init__(action, backend)
+        self.source = partitioned(action)
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        if partitions is None:
+            partitions = workers
+        self.workers = workers
+        self.partitions = partitions
+        self.timing = []
+
+        rettype = action.typedast.rettype
+        if isinstance(rettype, awkward.type.ArrayType) and isinstance(rettype.to, numpy.dtype):
+            self.outtypes = (rettype.to,)
+        elif isinstance(rettype, awkward.type.ArrayType) and isinstance(rettype.to, awkward.type.ArrayType) and isinstance(rettype.to.to, numpy.dtype) and self.source is not None and isinstance(action.argtypes[self.source].to, awkward.type.ArrayType):
+            self.outtypes = (numpy.dtype(numpy.int64), rettype.to.to)
+        else:
+            self.outtypes = None
+
+    def __repr__(self):
+        return "<{0} of {1} with {2} backend on {3} processes>".format(type(self).__name__, repr(self.action), repr(self.backend), self.workers)
+
+    def __call__(self, *args):
+        import concurrent.futures
+
+        if self.source is None:
+            return super(ProcessExecutor, self).__call__(*args)
+        if self.outtypes is None:
+            raise NotImplementedError("{0} can only return flat or singly jagged columns of numbers, not {1}".format(type(self).__name__, rejig.typedast._typestr(self.action.typedast.rettype, "")))
+
+        index = list(self.action.argtypes).index(self.source)
+        args = tuple(compact(x) if isinstance(x, awkward.JaggedArray) else x for x in args)
+        array = args[index]
+        if isinstance(array, awkward.JaggedArray):
+            size = array.offsets[-1] - array.offsets[0]
+        else:
+            size = len(array)
+        blocksize = max(1, -(-size // self.partitions))
+
+        blocks = []
+        try:
+            inputs = tuple(share(x, blocks) if isinstance(t, awkward.type.ArrayType) else ("value", x) for x, t in zip(args, self.action.argtypes.values()))
+            sizes = (len(array), size)
+            outputs = tuple(share(numpy.empty(n, dtype=t), blocks) for n, t in zip(sizes, self.outtypes))
+
+            with concurrent.futures.ProcessPoolExecutor(max_workers=self.workers, mp_context=_context(), initializer=_initialize, initargs=(self.action, self.backend, inputs, outputs, index)) as pool:
+                futures = [pool.submit(_run, start, stop) for start, stop in boundaries(array, blocksize)]
+                done = [x.result() for x in futures]
+            self.timing = [timing for placed, timing in done]
+
+            # copy out of shared memory before it is released
+            attached = []
+            views = [attach(x, attached) for x in outputs]
+            pieces = [views[0][start : start + n] for (start, n, x, y), timing in done] or [views[0][:0]]
+            if len(views) == 1:
+                out = numpy.concatenate(pieces)
+            else:
+                out = awkward.JaggedArray.fromcounts(numpy.concatenate(pieces), numpy.concatenate([views[1][start : start + n] for (x, y, start, n), timing in done] or [views[1][:0]]))
+            del views, pieces
+            for shm in attached:
+                shm.close()
+            return out
+
+        finally:
+            for shm in blocks:
+                shm.close()
+                shm.unlink()
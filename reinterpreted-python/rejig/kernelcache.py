@@ -0,0 +1,144 @@
+import glob
+import hashlib
+import os
+import sys
+import tempfile
+
+import numpy
+
+import awkward
+
+import rejig.codegen
+import rejig.typedast
+
+def structure(node):
+    # everything code generation depends on: the typed tree's functions, types and shapes, not just its syntax
+    if isinstance(node, rejig.typedast.Const) and isinstance(node.value, numpy.ndarray):
+        # numpy abbreviates the repr of a large array
+        return "Const({0}:{1}, {2})".format(node.value.dtype.str, hashlib.sha256(node.value.tobytes()).hexdigest(), repr(node.rettype))
+    elif isinstance(node, rejig.typedast.Const):
+        return "Const({0}, {1})".format(repr(node.value), repr(node.rettype))
+    elif isinstance(node, rejig.typedast.Name):
+        return "Name({0}, {1}, {2})".format(repr(node.name), repr(node.rettype), repr(node.shape))
+    elif isinstance(node, rejig.typedast.Def):
+        return "Def({0}, {1}, {2})".format(repr(node.argnames), repr(node.argtypes), structure(node.typedbody))
+    elif isinstance(node, rejig.typedast.Call):
+        args = [structure(x) if isinstance(x, rejig.typedast.AST) else repr(x) for x in node.typedargs]
+        fcn = "{0}:{1}".format(type(node.typedfcn).__name__, str(node.typedfcn))
+        if isinstance(getattr(node.typedfcn, "array", None), rejig.typedast.AST):
+            # methods like .map carry the array they were taken from
+            fcn = "{0}({1})".format(fcn, structure(node.typedfcn.array))
+        return "Call({0}, {1}, {2}, [{3}])".format(fcn, repr(node.rettype), repr(node.shape), ", ".join(args))
+    else:
+        raise NotImplementedError(type(node))
+
+def versions(backend):
+    out = ["python " + sys.version, "numpy " + numpy.__version__, "awkward " + awkward.__version__]
+    # like codegen.runtime, only the backends that use numexpr or numba import them
+    if backend in ("numexpr", "numba"):
+        try:
+            out.append(backend + " " + __import__(backend).__version__)
+        except ImportError:
+            pass
+    # rejig has no version number, so the generators' own source stands in for one
+    digest = hashlib.sha256()
+    for module in ("codegen", "library", "typedast", "typing"):
+        with open(os.path.join(os.path.dirname(__file__), module + ".py"), "rb") as file:
+            digest.update(file.read())
+    out.append("rejig " + digest.hexdigest())
+    return out
+
+class KernelCache(object):
+    def __init__(self, directory, maxbytes=256*1024**2):
+        self.directory = directory
+        self.maxbytes = maxbytes
+        self.hits = 0
+        self.misses = 0
+        self.versions = {}
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def __repr__(self):
+        return "<KernelCache {0} ({1} hits, {2} misses)>".format(repr(self.directory), self.hits, self.misses)
+
+    def key(self, action, backend, scratch=False):
+        if backend not in self.versions:
+            self.versions[backend] = "\n".join(versions(backend))
+        text = "\n".join([structure(action.typedast), repr(list(action.argtypes.items())), action.precision, backend + (" scratch" if scratch else ""), self.versions[backend]])
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+    def path(self, key):
+        return os.path.join(self.directory, "rejig_{0}.py".format(key))
+
+    def load(self, action, backend, scratch=False):
+        key = self.key(action, backend, scratch)
+        path = self.path(key)
+        try:
+            with open(path) as file:
+                source = file.read()
+        except (IOError, OSError):
+            source = None
+
+        if source is not None:
+            self.hits += 1
+            # most recently used is evicted last
+            os.utime(path, None)
+        else:
+            self.misses += 1
+            if backend == "numba":
+                source = rejig.codegen.numbasource(action, cache=True)
+            elif scratch:
+                source = rejig.codegen.numpysource(action, scratch=True)
+            else:
+                source = rejig.codegen.sources[backend](action)
+            # another process may be writing the same kernel: only whole files are ever visible
+            fd, temp = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+            with os.fdopen(fd, "w") as file:
+                file.write(source)
+            getattr(os, "replace", os.rename)(temp, path)
+            self.evict()
+
+        # compiled from its file, so that numba can cache machine code alongside it
+        out = rejig.codegen.compilesource(source, "fcn", rejig.codegen.runtime(backend), path)
+        if scratch:
+            out.numbuffers = rejig.codegen.numbuffers(source)
+        return out
+
+    def files(self, key):
+        return [self.path(key)] + glob.glob(os.path.join(self.directory, "__pycache__", "rejig_{0}.*".format(key)))
+
+    def nbytes(self):
+        out = 0
+        for path in glob.glob(os.path.join(self.directory, "rejig_*.py")) + glob.glob(os.path.join(self.directory, "__pycache__", "rejig_*")):
+            try:
+                out += os.path.getsize(path)
+            except OSError:
+                pass
+        return out
+
+    def evict(self):
+        # least recently used kernels go first, with anything numba cached for them
+        kernels = []
+        for path in glob.glob(os.path.join(self.directory, "rejig_*.py")):
+            try:
+                kernels.append((os.path.getmtime(path), os.path.basename(path)[6:-3]))
+            except OSError:
+                pass
+        kernels.sort()
+        total = self.nbytes()
+        for mtime, key in kernels[:-1]:
+            if total <= self.maxbytes:
+                break
+            for path in self.files(key):
+                try:
+                    total -= os.path.getsize(path)
+                    os.remove(path)
+                except OSError:
+                    pass
+
+def enable(directory, maxbytes=256*1024**2):
+    rejig.codegen.diskcache = KernelCache(directory, maxbytes)
+    return rejig.codegen.diskcache
+
+def disable():
+    rejig.codegen.diskcache = None
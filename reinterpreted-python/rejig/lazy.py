@@ -0,0 +1,116 @@
+import collections
+
+import rejig.execute
+import rejig.optimize
+import rejig.syntaxtree
+import rejig.typing
+
+class Argument(object):
+    def __init__(self, name, type):
+        self.name = name
+        self.type = type
+
+    def __repr__(self):
+        return "<Argument {0}>".format(self.name)
+
+class Column(object):
+    # one assigned expression; it is typed when first needed and computed when first requested
+    def __init__(self, name, ast, dependencies, precision):
+        self.name = name
+        self.ast = ast
+        self.dependencies = dependencies
+        self.precision = precision
+        self._action = None
+
+    def __repr__(self):
+        return "<Column {0} := {1}>".format(self.name, str(self.ast))
+
+    @property
+    def type(self):
+        return self.action.typedast.rettype
+
+    @property
+    def action(self):
+        if self._action is None:
+            argtypes = collections.OrderedDict((n, x.type) for n, x in self.dependencies.items())
+            self._action = rejig.typing.typify(rejig.syntaxtree.Suite((rejig.syntaxtree.Call("return", self.ast, sourcepath=self.ast.sourcepath, linestart=self.ast.linestart),)), argtypes, precision=self.precision)
+        return self._action
+
+class Graph(object):
+    def __init__(self, arguments, outputs):
+        self.arguments = arguments
+        self.outputs = outputs
+
+    def __repr__(self):
+        return "<Graph of {0} from {1}>".format(", ".join(self.outputs), ", ".join(self.arguments))
+
+def graph(suite, argtypes, precision="strict"):
+    # a column can't hold a function, so lambdas assigned to names are substituted into the statements that use them, as typify would
+    suite = rejig.optimize.inline(suite, budget=float("inf"))
+    arguments = collections.OrderedDict((n, Argument(n, x)) for n, x in argtypes.items())
+    scope = dict(arguments)
+    outputs = collections.OrderedDict()
+
+    for statement in suite.body:
+        if isinstance(statement, rejig.syntaxtree.Assign) and isinstance(statement.expr, rejig.syntaxtree.Def) and all(isinstance(x, rejig.syntaxtree.Name) for x in statement.targets):
+            # the name no longer refers to a column
+            for target in statement.targets:
+                scope.pop(target.name, None)
+                outputs.pop(target.name, None)
+            continue
+
+        if isinstance(statement, rejig.syntaxtree.Assign):
+            ast = statement.expr
+            targets = statement.targets
+        elif isinstance(statement, rejig.syntaxtree.Call) and statement.fcn == "return":
+            ast = statement.args[0]
+            targets = ("return",)
+        else:
+            raise NotImplementedError("lazy graphs are built from assignments and a return, not {0}{1}".format(type(statement).__name__, statement.errline()))
+
+        dependencies = collections.OrderedDict()
+        for n in rejig.syntaxtree.freenames(ast):
+            if n in scope:
+                dependencies[n] = scope[n]
+
+        names = []
+        for target in targets:
+            if target == "return":
+                names.append(target)
+            elif isinstance(target, rejig.syntaxtree.Name):
+                names.append(target.name)
+            else:
+                raise NotImplementedError("lazy graphs can only assign to names{0}".format(statement.errline()))
+
+        column = Column(names[0], ast, dependencies, precision)
+        for name in names:
+            # a reassigned name refers to its new column from here on
+            if name in outputs:
+                del outputs[name]
+            scope[name] = outputs[name] = column
+
+    return Graph(arguments, outputs)
+
+class Session(object):
+    def __init__(self, graph, args, backend="numpy", executor=None):
+        self.graph = graph
+        self.backend = backend
+        if executor is None:
+            executor = lambda action: rejig.execute.Executor(action, backend)
+        self.executor = executor
+        self.values = {}
+        for n, x in graph.arguments.items():
+            self.values[x] = args[n]
+
+    def materialize(self, node):
+        # results are memoized for the session, so shared dependencies are computed once
+        if node not in self.values:
+            args = [self.materialize(x) for x in node.dependencies.values()]
+            self.values[node] = self.executor(node.action)(*args)
+        return self.values[node]
+
+    def __getitem__(self, name):
+        return self.materialize(self.graph.outputs[name])
+
+    def __contains__(self, name):
+        return name in self.graph.outputs and self.graph.outputs[name] in self.values
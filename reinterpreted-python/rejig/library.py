@@ -5,9 +5,11 @@ import numpy
 
 import awkward.type
 
+import rejig.codegen
 import rejig.syntaxtree
 import rejig.typedast
 import rejig.typing
+import rejig.valuerange
 
 root = rejig.typing.SymbolTable(None)
 
@@ -20,6 +22,24 @@ class Function(object):
     def isnumexpr(self):
         return False
 
+    def paramranges(self, i, recurse):
+        return ()
+
+    def valuerange(self, argranges, recurse):
+        return None
+
+    def aspython(self, call, generator):
+        raise NotImplementedError("no Python code generation for {0}{1}".format(str(self), call.errline()))
+
+    def asnumpy(self, call, generator):
+        raise NotImplementedError("no numpy code generation for {0}{1}".format(str(self), call.errline()))
+
+    def asnumexpr(self, call, generator):
+        raise NotImplementedError("no numexpr code generation for {0}{1}".format(str(self), call.errline()))
+
+    def asnumba(self, call, generator):
+        raise NotImplementedError("no numba code generation for {0}{1}".format(str(self), call.errline()))
+
 class Add(Function):
     def __str__(self):
         return "+"
@@ -32,15 +52,260 @@ class Add(Function):
 
     def infer(self, call, typedfcn, typedargs, symboltable):
         if all(isinstance(x.rettype, numpy.dtype) and issubclass(x.rettype.type, numpy.number) for x in typedargs):
-            return rejig.typedast.Call(call, rejig.typedast.numerical(*[x.rettype for x in typedargs]), typedfcn, typedargs)
+            return rejig.typedast.Call(call, rejig.typedast.promote(typedargs, symboltable.precision), typedfcn, typedargs, shape=rejig.typedast.broadcast(*[x.shape for x in typedargs]))
         else:
             return None
 
     def isnumexpr(self):
         return True
 
+    def valuerange(self, argranges, recurse):
+        if any(x is None for x in argranges):
+            return None
+        # covers every partial sum, so accumulating in the narrowed type can't overflow
+        totalmin, totalmax = argranges[0].min, argranges[0].max
+        lo, hi = totalmin, totalmax
+        for x in argranges[1:]:
+            totalmin += x.min
+            totalmax += x.max
+            lo = min(lo, totalmin)
+            hi = max(hi, totalmax)
+        return rejig.valuerange.Interval(lo, hi)
+
+    def aspython(self, call, generator):
+        return "({0})".format(" + ".join(generator.expr(x) for x in call.typedargs))
+
+    def asnumpy(self, call, generator):
+        return generator.ufunc("numpy.add", call)
+
+    def asnumexpr(self, call, generator):
+        return "({0})".format(" + ".join(generator.numexpr(x) for x in call.typedargs))
+
+    def asnumba(self, call, generator):
+        return self.aspython(call, generator)
+
 root["+"] = Add()
 
+class Reduce(Function):
+    # a whole array, or each list of one inside a .map, reduced to a single value; an initial value is folded in first
+    def __init__(self, name):
+        self.name = name
+
+    def __str__(self):
+        return self.name
+
+    def numargs(self, args):
+        return len(args) in (1, 2)
+
+    def typedargs(self, typedargs, kwargs):
+        return collections.OrderedDict([("array", typedargs[0])] + ([("initial", typedargs[1])] if len(typedargs) > 1 else []))
+
+    def infer(self, call, typedfcn, typedargs, symboltable):
+        array = typedargs[0]
+        if not isinstance(array.rettype, awkward.type.ArrayType) or not isinstance(array.rettype.to, numpy.dtype):
+            return None
+        item = array.rettype.to
+
+        if self.name in ("count", "any", "all"):
+            if item != numpy.dtype(numpy.bool_):
+                return None
+            rettype = numpy.dtype(numpy.int64) if self.name == "count" else item
+        elif not issubclass(item.type, (numpy.number, numpy.bool_)):
+            return None
+        elif self.name in ("sum", "prod") and issubclass(item.type, (numpy.bool_, numpy.signedinteger)):
+            # accumulates in the widest integer, as Python would never overflow
+            rettype = numpy.dtype(numpy.int64)
+        elif self.name in ("sum", "prod") and issubclass(item.type, numpy.unsignedinteger):
+            rettype = numpy.dtype(numpy.uint64)
+        else:
+            rettype = item
+
+        if len(typedargs) == 2:
+            initial = typedargs[1]
+            if not isinstance(initial.rettype, numpy.dtype):
+                return None
+            if self.name in ("any", "all"):
+                if initial.rettype != numpy.dtype(numpy.bool_):
+                    return None
+            elif not issubclass(initial.rettype.type, numpy.number):
+                return None
+            else:
+                rettype = rejig.typedast.promote((rejig.typedast.AST(call, rettype), initial), symboltable.precision)
+
+        return rejig.typedast.Call(call, rettype, typedfcn, typedargs)
+
+    def aspython(self, call, generator):
+        array = generator.expr(call.typedargs[0])
+        initial = generator.expr(call.typedargs[1]) if len(call.typedargs) > 1 else None
+        if self.name == "sum":
+            return "sum({0})".format(array) if initial is None else "sum({0}, {1})".format(array, initial)
+        elif self.name == "prod":
+            return "_prod({0}, {1})".format(array, 1 if initial is None else initial)
+        elif self.name in ("min", "max"):
+            return "{0}({1})".format(self.name, array) if initial is None else "{0}([{1}] + list({2}))".format(self.name, initial, array)
+        elif self.name == "count":
+            return "list({0}).count(True)".format(array) if initial is None else "({0} + list({1}).count(True))".format(initial, array)
+        else:
+            return "{0}({1})".format(self.name, array) if initial is None else "({0} {1} {2}({3}))".format(initial, "or" if self.name == "any" else "and", self.name, array)
+
+    def asnumpy(self, call, generator):
+        return generator.reduce(call, self.name, call.typedargs[0], call.typedargs[1] if len(call.typedargs) > 1 else None)
+
+for name in ("sum", "prod", "min", "max", "count", "any", "all"):
+    root[name] = Reduce(name)
+
+class Compare(Function):
+    def __init__(self, op):
+        self.op = op
+
+    def __str__(self):
+        return self.op
+
+    def numargs(self, args):
+        return len(args) == 2
+
+    def typedargs(self, typedargs, kwargs):
+        return collections.OrderedDict([("left", typedargs[0]), ("right", typedargs[1])])
+
+    def infer(self, call, typedfcn, typedargs, symboltable):
+        if all(isinstance(x.rettype, numpy.dtype) and issubclass(x.rettype.type, (numpy.number, numpy.bool_)) for x in typedargs):
+            return rejig.typedast.Call(call, numpy.dtype(numpy.bool_), typedfcn, typedargs, shape=rejig.typedast.broadcast(*[x.shape for x in typedargs]))
+        else:
+            return None
+
+    def isnumexpr(self):
+        return True
+
+    def aspython(self, call, generator):
+        return "({0} {1} {2})".format(generator.expr(call.typedargs[0]), self.op, generator.expr(call.typedargs[1]))
+
+    ufuncs = {"==": "numpy.equal", "!=": "numpy.not_equal", "<": "numpy.less", "<=": "numpy.less_equal", ">": "numpy.greater", ">=": "numpy.greater_equal"}
+
+    def asnumpy(self, call, generator):
+        return generator.ufunc(self.ufuncs[self.op], call, fixdtype=False)
+
+    def asnumexpr(self, call, generator):
+        return "({0} {1} {2})".format(generator.numexpr(call.typedargs[0]), self.op, generator.numexpr(call.typedargs[1]))
+
+    def asnumba(self, call, generator):
+        return self.aspython(call, generator)
+
+for op in ("==", "!=", "<", "<=", ">", ">="):
+    root[op] = Compare(op)
+
+class Junction(Function):
+    # "and" and "or" of predicates; the backends may evaluate the arguments in any order that respects guards (see codegen.junctionorder)
+    def __init__(self, op):
+        self.op = op
+
+    def __str__(self):
+        return self.op
+
+    def numargs(self, args):
+        return len(args) >= 2
+
+    def typedargs(self, typedargs, kwargs):
+        return collections.OrderedDict((str(i), x) for i, x in enumerate(typedargs))
+
+    def infer(self, call, typedfcn, typedargs, symboltable):
+        if all(x.rettype == numpy.dtype(numpy.bool_) for x in typedargs):
+            return rejig.typedast.Call(call, numpy.dtype(numpy.bool_), typedfcn, typedargs, shape=rejig.typedast.broadcast(*[x.shape for x in typedargs]))
+        else:
+            return None
+
+    def isnumexpr(self):
+        return True
+
+    def aspython(self, call, generator):
+        return "({0})".format(" {0} ".format(self.op).join(generator.expr(x) for x in rejig.codegen.junctionorder(call)))
+
+    def asnumpy(self, call, generator):
+        return generator.junction(call, self.op == "and")
+
+    def asnumexpr(self, call, generator):
+        return "({0})".format(" {0} ".format("&" if self.op == "and" else "|").join(generator.numexpr(x) for x in call.typedargs))
+
+    def asnumba(self, call, generator):
+        return generator.junction(call, self.op == "and")
+
+for op in ("and", "or"):
+    root[op] = Junction(op)
+
+class Not(Function):
+    def __str__(self):
+        return "not"
+
+    def numargs(self, args):
+        return len(args) == 1
+
+    def typedargs(self, typedargs, kwargs):
+        return collections.OrderedDict([("0", typedargs[0])])
+
+    def infer(self, call, typedfcn, typedargs, symboltable):
+        if typedargs[0].rettype == numpy.dtype(numpy.bool_):
+            return rejig.typedast.Call(call, numpy.dtype(numpy.bool_), typedfcn, typedargs, shape=typedargs[0].shape)
+        else:
+            return None
+
+    def isnumexpr(self):
+        return True
+
+    def aspython(self, call, generator):
+        return "(not {0})".format(generator.expr(call.typedargs[0]))
+
+    def asnumpy(self, call, generator):
+        return generator.unary("numpy.logical_not", call, fixdtype=False)
+
+    def asnumexpr(self, call, generator):
+        return "(~{0})".format(generator.numexpr(call.typedargs[0]))
+
+    def asnumba(self, call, generator):
+        return self.aspython(call, generator)
+
+root["not"] = Not()
+
+class Where(Function):
+    # both branches are computed and the condition picks between them item by item
+    def __str__(self):
+        return "where"
+
+    def numargs(self, args):
+        return len(args) == 3
+
+    def typedargs(self, typedargs, kwargs):
+        return collections.OrderedDict([("condition", typedargs[0]), ("then", typedargs[1]), ("else", typedargs[2])])
+
+    def infer(self, call, typedfcn, typedargs, symboltable):
+        condition, branches = typedargs[0], typedargs[1:]
+        if condition.rettype != numpy.dtype(numpy.bool_) or not all(isinstance(x.rettype, numpy.dtype) and issubclass(x.rettype.type, (numpy.number, numpy.bool_)) for x in branches):
+            return None
+        rettype = rejig.typedast.promote(branches, symboltable.precision)
+        if rettype is None:
+            return None
+        return rejig.typedast.Call(call, rettype, typedfcn, typedargs, shape=rejig.typedast.broadcast(*[x.shape for x in typedargs]))
+
+    def isnumexpr(self):
+        return True
+
+    def valuerange(self, argranges, recurse):
+        if argranges[1] is None or argranges[2] is None:
+            return None
+        return argranges[1].union(argranges[2])
+
+    def aspython(self, call, generator):
+        return "({1} if {0} else {2})".format(*[generator.expr(x) for x in call.typedargs])
+
+    def asnumpy(self, call, generator):
+        return generator.where(call, *call.typedargs)
+
+    def asnumexpr(self, call, generator):
+        return "where({0}, {1}, {2})".format(*[generator.numexpr(x) for x in call.typedargs])
+
+    def asnumba(self, call, generator):
+        return self.aspython(call, generator)
+
+root["where"] = Where()
+
 class ArrayMap(Function):
     def __init__(self, array):
         self.array = array
@@ -64,14 +329,84 @@ class ArrayMap(Function):
         if len(typedargs) == 1 and isinstance(typedargs[0], rejig.syntaxtree.Def) and len(typedargs[0].argnames) == 1:
             scope = rejig.typing.SymbolTable(symboltable)
             scope[typedargs[0].argnames[0]] = self.array.rettype.to
+            scope.refine(typedargs[0].argnames[0], self.array.shape[1:])
             typedbody = rejig.typing.typifystep(typedargs[0].body, scope)
             rettype = awkward.type.ArrayType(self.array.rettype.takes, typedbody.rettype)
             defn = rejig.typedast.Def(call.args[0], typedbody.rettype, (self.array.rettype.to,), typedbody)
-            return rejig.typedast.Call(call, rettype, typedfcn, (defn,))
+            return rejig.typedast.Call(call, rettype, typedfcn, (defn,), shape=self.array.shape[:1] + typedbody.shape)
+
+        else:
+            return None
+
+    def paramranges(self, i, recurse):
+        return (recurse(self.array),)
+
+    def valuerange(self, argranges, recurse):
+        return argranges[0]
+
+    def aspython(self, call, generator):
+        defn = call.typedargs[0]
+        return "[{0} for {1} in {2}]".format(generator.expr(defn.typedbody), defn.argnames[0], generator.expr(self.array))
+
+    def asnumpy(self, call, generator):
+        return generator.map(call, self.array)
+
+    def asnumba(self, call, generator):
+        return generator.map(call, self.array)
+
+class ArrayFilter(Function):
+    def __init__(self, array):
+        self.array = array
+
+    def __str__(self):
+        return ".filter"
+
+    def fcnarg(self, i):
+        if i == 0:
+            return 1
+        else:
+            return None
+
+    def numargs(self, args):
+        return len(args) == 1
+
+    def typedargs(self, typedargs, kwargs):
+        return collections.OrderedDict([("predicate", typedargs[0])])
+
+    def infer(self, call, typedfcn, typedargs, symboltable):
+        if len(typedargs) == 1 and isinstance(typedargs[0], rejig.syntaxtree.Def) and len(typedargs[0].argnames) == 1:
+            scope = rejig.typing.SymbolTable(symboltable)
+            scope[typedargs[0].argnames[0]] = self.array.rettype.to
+            scope.refine(typedargs[0].argnames[0], self.array.shape[1:])
+            typedbody = rejig.typing.typifystep(typedargs[0].body, scope)
+            if typedbody.rettype != numpy.dtype(numpy.bool_):
+                return None
+            # a filter can only shrink the outermost dimension, but a predicate on len(x) refines the next one
+            lo, hi = rejig.typing.refinements(typedbody, typedargs[0].argnames[0])
+            rettype = awkward.type.ArrayType(numpy.inf, self.array.rettype.to)
+            shape = ((0, self.array.shape[0][1]),) + rejig.typing.refine(self.array.shape[1:], lo, hi)
+            defn = rejig.typedast.Def(call.args[0], typedbody.rettype, (self.array.rettype.to,), typedbody)
+            return rejig.typedast.Call(call, rettype, typedfcn, (defn,), shape=shape)
 
         else:
             return None
 
+    def paramranges(self, i, recurse):
+        return (recurse(self.array),)
+
+    def valuerange(self, argranges, recurse):
+        return recurse(self.array)
+
+    def aspython(self, call, generator):
+        defn = call.typedargs[0]
+        return "[{0} for {0} in {1} if {2}]".format(defn.argnames[0], generator.expr(self.array), generator.expr(defn.typedbody))
+
+    def asnumpy(self, call, generator):
+        return generator.filter(call, self.array)
+
+    def asnumba(self, call, generator):
+        return generator.filter(call, self.array)
+
 class Attrib(Function):
     def __str__(self):
         return "."
@@ -92,7 +427,87 @@ class Attrib(Function):
         elif isinstance(typedargs[0].rettype, awkward.type.ArrayType) and typedargs[1] == "map":
             return ArrayMap(typedargs[0])
 
+        elif isinstance(typedargs[0].rettype, awkward.type.ArrayType) and typedargs[1] == "filter":
+            return ArrayFilter(typedargs[0])
+
         else:
             return None
 
+    def valuerange(self, argranges, recurse):
+        # only array sizes of unknown length remain as Calls
+        return rejig.valuerange.Interval(0, numpy.inf)
+
+    def aspython(self, call, generator):
+        return "len({0})".format(generator.expr(call.typedargs[0]))
+
+    def asnumpy(self, call, generator):
+        return generator.length(call, call.typedargs[0])
+
+    def asnumba(self, call, generator):
+        return generator.length(call, call.typedargs[0])
+
 root["."] = Attrib()
+
+class Len(Function):
+    def __str__(self):
+        return "len"
+
+    def numargs(self, args):
+        return len(args) == 1
+
+    def typedargs(self, typedargs, kwargs):
+        return collections.OrderedDict([("object", typedargs[0])])
+
+    def infer(self, call, typedfcn, typedargs, symboltable):
+        if isinstance(typedargs[0].rettype, awkward.type.ArrayType):
+            lo, hi = typedargs[0].shape[0]
+            if lo == hi:
+                return rejig.typedast.Const(rejig.syntaxtree.Const(lo), numpy.dtype(numpy.int64))
+            else:
+                return rejig.typedast.Call(call, numpy.dtype(numpy.int64), typedfcn, typedargs)
+        else:
+            return None
+
+    def valuerange(self, argranges, recurse):
+        return rejig.valuerange.Interval(0, numpy.inf)
+
+    def aspython(self, call, generator):
+        return "len({0})".format(generator.expr(call.typedargs[0]))
+
+    def asnumpy(self, call, generator):
+        return generator.length(call, call.typedargs[0])
+
+    def asnumba(self, call, generator):
+        return generator.length(call, call.typedargs[0])
+
+root["len"] = Len()
+
+class GetItem(Function):
+    def __str__(self):
+        return "[.]"
+
+    def numargs(self, args):
+        return len(args) == 2
+
+    def typedargs(self, typedargs, kwargs):
+        return collections.OrderedDict([("object", typedargs[0]), ("index", typedargs[1])])
+
+    def infer(self, call, typedfcn, typedargs, symboltable):
+        if isinstance(typedargs[0].rettype, awkward.type.ArrayType) and isinstance(typedargs[1].rettype, numpy.dtype) and issubclass(typedargs[1].rettype.type, numpy.integer):
+            return rejig.typedast.Call(call, typedargs[0].rettype.to, typedfcn, typedargs, shape=typedargs[0].shape[1:])
+        else:
+            return None
+
+    def valuerange(self, argranges, recurse):
+        return argranges[0]
+
+    def aspython(self, call, generator):
+        return "{0}[{1}]".format(generator.expr(call.typedargs[0]), generator.expr(call.typedargs[1]))
+
+    def asnumpy(self, call, generator):
+        return generator.getitem(call, call.typedargs[0], call.typedargs[1], rejig.typing.boundscheck(call))
+
+    def asnumba(self, call, generator):
+        return generator.getitem(call, call.typedargs[0], call.typedargs[1], rejig.typing.boundscheck(call))
+
+root["[.]"] = GetItem()
@@ -0,0 +1,472 @@
+import rejig.syntaxtree
+
+def _isreturn(ast):
+    return isinstance(ast, rejig.syntaxtree.Call) and ast.fcn == "return"
+
+def _isif(ast):
+    return isinstance(ast, rejig.syntaxtree.Call) and ast.fcn == "if" and len(ast.args) in (2, 3)
+
+def _targetnames(target):
+    # names bound by an assignment target, or None if it stores into something else (and so must be kept)
+    if isinstance(target, rejig.syntaxtree.Name):
+        return set([target.name])
+    elif isinstance(target, rejig.syntaxtree.Unpack):
+        out = set()
+        for x in target.subtargets:
+            names = _targetnames(x)
+            if names is None:
+                return None
+            out.update(names)
+        return out
+    else:
+        return None
+
+def _taken(ast):
+    # the branch of an if with a constant condition, or None if it isn't known before running
+    if isinstance(ast.args[0], rejig.syntaxtree.Const):
+        if ast.args[0].value:
+            return ast.args[1]
+        elif len(ast.args) == 3:
+            return ast.args[2]
+        else:
+            return rejig.syntaxtree.Suite((), sourcepath=ast.sourcepath, linestart=ast.linestart)
+    else:
+        return None
+
+def _expression(ast):
+    if isinstance(ast, rejig.syntaxtree.Def):
+        return rejig.syntaxtree.Def(ast.argnames, ast.defaults, eliminate(ast.body), sourcepath=ast.sourcepath, linestart=ast.linestart)
+
+    elif isinstance(ast, rejig.syntaxtree.Call):
+        if _isif(ast) and _taken(ast) is not None:
+            # a conditional expression's branches are one-expression Suites
+            branch = _taken(ast)
+            if len(branch.body) == 1 and not _isreturn(branch.body[0]):
+                return _expression(branch.body[0])
+        fcn = _expression(ast.fcn) if isinstance(ast.fcn, rejig.syntaxtree.AST) else ast.fcn
+        args = tuple(_expression(x) if isinstance(x, rejig.syntaxtree.AST) else x for x in ast.args)
+        return rejig.syntaxtree.Call(fcn, *args, sourcepath=ast.sourcepath, linestart=ast.linestart)
+
+    elif isinstance(ast, rejig.syntaxtree.Suite):
+        # an inlined call's assignments and return
+        return eliminate(ast)
+
+    else:
+        return ast
+
+def _eliminate(suite, live):
+    # splice in the taken branch of every if with a constant condition, up to the first return
+    statements = []
+    stack = list(reversed(suite.body))
+    while len(stack) > 0:
+        statement = stack.pop()
+        if _isif(statement) and _taken(statement) is not None:
+            stack.extend(reversed(_taken(statement).body))
+            continue
+        statements.append(statement)
+        if _isreturn(statement):
+            break
+
+    # walk backward, keeping only assignments to names that are read later
+    live = set(live)
+    out = []
+    for statement in reversed(statements):
+        if isinstance(statement, rejig.syntaxtree.Assign):
+            names = [_targetnames(x) for x in statement.targets]
+            if all(x is not None for x in names):
+                bound = set().union(*names)
+                if len(bound & live) == 0:
+                    continue
+                live.difference_update(bound)
+            live.update(rejig.syntaxtree.freenames(statement.expr))
+            out.append(rejig.syntaxtree.Assign(statement.targets, _expression(statement.expr), sourcepath=statement.sourcepath, linestart=statement.linestart))
+
+        elif _isreturn(statement):
+            live = set(rejig.syntaxtree.freenames(statement))
+            out.append(_expression(statement))
+
+        elif _isif(statement) and all(isinstance(x, rejig.syntaxtree.Suite) for x in statement.args[1:]):
+            branches = []
+            livein = set(rejig.syntaxtree.freenames(statement.args[0]))
+            for x in statement.args[1:]:
+                branch, branchlive = _eliminate(x, live)
+                branches.append(branch)
+                livein.update(branchlive)
+            if len(statement.args) == 2:
+                # falling through an if without an else
+                livein.update(live)
+            if all(len(x.body) == 0 for x in branches):
+                continue
+            live = livein
+            out.append(rejig.syntaxtree.Call("if", _expression(statement.args[0]), *branches, sourcepath=statement.sourcepath, linestart=statement.linestart))
+
+        else:
+            live.update(rejig.syntaxtree.freenames(statement))
+            out.append(_expression(statement))
+
+    return rejig.syntaxtree.Suite(tuple(reversed(out)), sourcepath=suite.sourcepath, linestart=suite.linestart), live
+
+def eliminate(suite, live=()):
+    # dead-code elimination: drops assignments that are never read and branches that are never taken; live names are read after the suite
+    return _eliminate(suite, live)[0]
+
+def size(ast):
+    if isinstance(ast, rejig.syntaxtree.Def):
+        return 1 + size(ast.body)
+    elif isinstance(ast, rejig.syntaxtree.Suite):
+        return sum(size(x) for x in ast.body)
+    elif isinstance(ast, rejig.syntaxtree.AST):
+        return 1 + sum(size(y) for x in ast.params for y in (x if isinstance(x, tuple) else (x,)) if isinstance(y, rejig.syntaxtree.AST))
+    else:
+        return 0
+
+class _Fresh(object):
+    # new names that clash with nothing in the tree being rewritten
+    def __init__(self, avoid):
+        self.avoid = set(avoid)
+        self.number = 0
+
+    def __call__(self, prefix):
+        while True:
+            out = "{0}_{1}".format(prefix, self.number)
+            self.number += 1
+            if out not in self.avoid:
+                self.avoid.add(out)
+                return out
+
+def _allnames(ast):
+    if isinstance(ast, rejig.syntaxtree.Name):
+        return set([ast.name])
+    elif isinstance(ast, rejig.syntaxtree.Def):
+        return set(ast.argnames).union(_allnames(ast.body), *[_allnames(x) for x in ast.defaults])
+    elif isinstance(ast, rejig.syntaxtree.AST):
+        out = set()
+        for x in ast.params:
+            for y in (x if isinstance(x, tuple) else (x,)):
+                if isinstance(y, rejig.syntaxtree.AST):
+                    out.update(_allnames(y))
+        return out
+    else:
+        return set()
+
+def _assigned(suite):
+    # names assigned anywhere in a suite, including in its ifs' branches (but not in nested lambdas)
+    out = set()
+    for x in suite.body:
+        if isinstance(x, rejig.syntaxtree.Assign):
+            for target in x.targets:
+                out.update(_targetnames(target) or ())
+        elif _isif(x):
+            for branch in x.args[1:]:
+                if isinstance(branch, rejig.syntaxtree.Suite):
+                    out.update(_assigned(branch))
+    return out
+
+def _rename(target, renames):
+    if isinstance(target, rejig.syntaxtree.Name) and target.name in renames:
+        return rejig.syntaxtree.Name(renames[target.name], sourcepath=target.sourcepath, linestart=target.linestart)
+    elif isinstance(target, rejig.syntaxtree.Unpack):
+        return rejig.syntaxtree.Unpack(tuple(_rename(x, renames) for x in target.subtargets), sourcepath=target.sourcepath, linestart=target.linestart)
+    else:
+        return substitute(target, {}, None, renames)
+
+def substitute(ast, mapping, fresh, renames=None):
+    # replaces free names by expressions; a binder that would capture a free name of one of the expressions is renamed first
+    if renames is not None:
+        mapping = dict(mapping)
+        for n, x in renames.items():
+            mapping[n] = rejig.syntaxtree.Name(x, sourcepath=ast.sourcepath, linestart=ast.linestart)
+
+    if len(mapping) == 0:
+        return ast
+
+    elif isinstance(ast, rejig.syntaxtree.Name):
+        return mapping.get(ast.name, ast)
+
+    elif isinstance(ast, rejig.syntaxtree.Def):
+        defaults = tuple(substitute(x, mapping, fresh) for x in ast.defaults)
+        mapping = dict((n, x) for n, x in mapping.items() if n not in ast.argnames)
+        captured = set(y for x in mapping.values() for y in rejig.syntaxtree.freenames(x))
+        argnames = []
+        renames = {}
+        for n in ast.argnames:
+            if n in captured:
+                renames[n] = fresh(n)
+            argnames.append(renames.get(n, n))
+        return rejig.syntaxtree.Def(tuple(argnames), defaults, substitute(ast.body, mapping, fresh, renames), sourcepath=ast.sourcepath, linestart=ast.linestart)
+
+    elif isinstance(ast, rejig.syntaxtree.Suite):
+        assigned = _assigned(ast)
+        captured = set(y for x in mapping.values() for y in rejig.syntaxtree.freenames(x))
+        renames = dict((n, fresh(n)) for n in sorted(assigned & captured))
+        # a replaced name that the suite reassigns starts as an assignment of its replacement
+        let = [rejig.syntaxtree.Assign((rejig.syntaxtree.Name(renames.get(n, n), sourcepath=x.sourcepath, linestart=x.linestart),), x, sourcepath=x.sourcepath, linestart=x.linestart) for n, x in sorted(mapping.items()) if n in assigned]
+        mapping = dict((n, x) for n, x in mapping.items() if n not in assigned)
+        out = _substitutesuite(ast, mapping, fresh, renames)
+        return rejig.syntaxtree.Suite(tuple(let) + out.body, sourcepath=out.sourcepath, linestart=out.linestart)
+
+    elif isinstance(ast, rejig.syntaxtree.Call):
+        fcn = substitute(ast.fcn, mapping, fresh) if isinstance(ast.fcn, rejig.syntaxtree.AST) else ast.fcn
+        return rejig.syntaxtree.Call(fcn, *[substitute(x, mapping, fresh) if isinstance(x, rejig.syntaxtree.AST) else x for x in ast.args], sourcepath=ast.sourcepath, linestart=ast.linestart)
+
+    elif isinstance(ast, rejig.syntaxtree.CallKeyword):
+        fcn = substitute(ast.fcn, mapping, fresh) if isinstance(ast.fcn, rejig.syntaxtree.AST) else ast.fcn
+        args = tuple(substitute(x, mapping, fresh) if isinstance(x, rejig.syntaxtree.AST) else x for x in ast.args)
+        kwargs = [(n, substitute(x, mapping, fresh) if isinstance(x, rejig.syntaxtree.AST) else x) for n, x in ast.kwargs]
+        return rejig.syntaxtree.CallKeyword(fcn, args, kwargs, sourcepath=ast.sourcepath, linestart=ast.linestart)
+
+    else:
+        return ast
+
+def _substitutesuite(suite, mapping, fresh, renames):
+    # renames apply to the suite's own assignments as well as to its reads
+    body = []
+    for x in suite.body:
+        if isinstance(x, rejig.syntaxtree.Assign):
+            body.append(rejig.syntaxtree.Assign(tuple(_rename(y, renames) for y in x.targets), substitute(x.expr, mapping, fresh, renames), sourcepath=x.sourcepath, linestart=x.linestart))
+        elif _isif(x):
+            branches = [_substitutesuite(y, mapping, fresh, renames) if isinstance(y, rejig.syntaxtree.Suite) else substitute(y, mapping, fresh, renames) for y in x.args[1:]]
+            body.append(rejig.syntaxtree.Call("if", substitute(x.args[0], mapping, fresh, renames), *branches, sourcepath=x.sourcepath, linestart=x.linestart))
+        else:
+            body.append(substitute(x, mapping, fresh, renames))
+    return rejig.syntaxtree.Suite(tuple(body), sourcepath=suite.sourcepath, linestart=suite.linestart)
+
+def _uses(ast, name):
+    # how often name is read, where a read inside a lambda counts as many because a lambda's body runs once per item
+    if isinstance(ast, rejig.syntaxtree.Name):
+        return 1 if ast.name == name else 0
+    elif isinstance(ast, rejig.syntaxtree.Def):
+        if name in ast.argnames:
+            return 0
+        return 2 * _uses(ast.body, name)
+    elif isinstance(ast, rejig.syntaxtree.AST):
+        out = 0
+        for x in ast.params:
+            for y in (x if isinstance(x, tuple) else (x,)):
+                if isinstance(y, rejig.syntaxtree.AST):
+                    out += _uses(y, name)
+        return out
+    else:
+        return 0
+
+def beta(defn, args, fresh=None):
+    # defn applied to args: an argument that isn't a name or constant and would be read more than once is bound to a temporary instead of copied
+    if not len(defn.argnames) - len(defn.defaults) <= len(args) <= len(defn.argnames):
+        raise TypeError("wrong number of arguments{0}".format(args[0].errline() if len(args) > 0 else defn.errline()))
+    args = tuple(args) + tuple(defn.defaults[len(defn.defaults) - len(defn.argnames) + len(args):])
+
+    if fresh is None:
+        fresh = _Fresh(_allnames(defn).union(*[_allnames(x) for x in args]))
+
+    mapping = {}
+    temporaries = []
+    for n, x in zip(defn.argnames, args):
+        if isinstance(x, (rejig.syntaxtree.Name, rejig.syntaxtree.Const)) or _uses(defn.body, n) <= 1:
+            mapping[n] = x
+        else:
+            temp = rejig.syntaxtree.Name(fresh("_" + n), sourcepath=x.sourcepath, linestart=x.linestart)
+            temporaries.append(rejig.syntaxtree.Assign((temp,), x, sourcepath=x.sourcepath, linestart=x.linestart))
+            mapping[n] = temp
+
+    body = substitute(defn.body, mapping, fresh)
+    if len(temporaries) == 0 and len(body.body) == 1 and _isreturn(body.body[0]):
+        return body.body[0].args[0]
+    else:
+        # a suite in an expression's place is a let: its assignments are local to it
+        return rejig.syntaxtree.Suite(tuple(temporaries) + body.body, sourcepath=body.sourcepath, linestart=body.linestart)
+
+def inline(ast, budget=50, limit=1000, functions=None):
+    # replaces names of lambdas no bigger than budget with the lambdas themselves and beta-reduces every lambda that is called directly, at most limit times;
+    # functions maps names to Defs that are always inlined
+    functions = dict(functions or {})
+    fresh = _Fresh(_allnames(ast).union(*[_allnames(x) for x in functions.values()]))
+    reductions = [0]
+
+    def visible(lambdas, bound):
+        # a lambda can't be moved to where one of its free names means something else
+        return dict((n, x) for n, x in lambdas.items() if n not in bound and len(bound.intersection(rejig.syntaxtree.freenames(x))) == 0)
+
+    def expression(ast, lambdas, scope):
+        if isinstance(ast, rejig.syntaxtree.Name) and ast.name in lambdas:
+            return lambdas[ast.name]
+
+        elif isinstance(ast, rejig.syntaxtree.Def):
+            defaults = tuple(expression(x, lambdas, scope) for x in ast.defaults)
+            lambdas = dict((n, x) for n, x in lambdas.items() if n not in ast.argnames)
+            # arguments that would capture a lambda's free names or hide a name from an enclosing scope are renamed,
+            # so that a name means one thing everywhere and subtrees can be moved between scopes
+            captured = set(y for x in lambdas.values() for y in rejig.syntaxtree.freenames(x))
+            renames = dict((n, fresh(n)) for n in ast.argnames if n in captured or n in scope)
+            body = substitute(ast.body, {}, fresh, renames) if len(renames) > 0 else ast.body
+            argnames = tuple(renames.get(n, n) for n in ast.argnames)
+            return rejig.syntaxtree.Def(argnames, defaults, suite(body, lambdas, scope.union(argnames)), sourcepath=ast.sourcepath, linestart=ast.linestart)
+
+        elif isinstance(ast, rejig.syntaxtree.Suite):
+            return suite(ast, lambdas, scope)
+
+        elif isinstance(ast, rejig.syntaxtree.Call):
+            fcn = expression(ast.fcn, lambdas, scope) if isinstance(ast.fcn, rejig.syntaxtree.AST) else ast.fcn
+            args = tuple(expression(x, lambdas, scope) if isinstance(x, rejig.syntaxtree.AST) else x for x in ast.args)
+            if isinstance(fcn, rejig.syntaxtree.Def) and reductions[0] < limit:
+                reductions[0] += 1
+                return expression(beta(fcn, args, fresh), lambdas, scope)
+            return rejig.syntaxtree.Call(fcn, *args, sourcepath=ast.sourcepath, linestart=ast.linestart)
+
+        elif isinstance(ast, rejig.syntaxtree.CallKeyword):
+            args = tuple(expression(x, lambdas, scope) if isinstance(x, rejig.syntaxtree.AST) else x for x in ast.args)
+            kwargs = [(n, expression(x, lambdas, scope) if isinstance(x, rejig.syntaxtree.AST) else x) for n, x in ast.kwargs]
+            return rejig.syntaxtree.CallKeyword(ast.fcn, args, kwargs, sourcepath=ast.sourcepath, linestart=ast.linestart)
+
+        else:
+            return ast
+
+    def suite(ast, lambdas, scope):
+        lambdas = visible(lambdas, _assigned(ast) - set(lambdas))
+        scope = scope.union(_assigned(ast))
+        body = []
+        for x in ast.body:
+            if isinstance(x, rejig.syntaxtree.Assign):
+                expr = expression(x.expr, lambdas, scope)
+                bound = set()
+                for target in x.targets:
+                    bound.update(_targetnames(target) or ())
+                lambdas = visible(lambdas, bound)
+                if isinstance(expr, rejig.syntaxtree.Def) and size(expr) <= budget and all(isinstance(y, rejig.syntaxtree.Name) for y in x.targets) and len(bound.intersection(rejig.syntaxtree.freenames(expr))) == 0:
+                    # the assignment itself is left for dead-code elimination
+                    for target in x.targets:
+                        lambdas[target.name] = expr
+                body.append(rejig.syntaxtree.Assign(x.targets, expr, sourcepath=x.sourcepath, linestart=x.linestart))
+            elif _isif(x):
+                # a lambda assigned in one branch is unknown after the if
+                body.append(expression(x, lambdas, scope))
+                lambdas = visible(lambdas, _assigned(rejig.syntaxtree.Suite((x,))))
+            else:
+                body.append(expression(x, lambdas, scope))
+        return rejig.syntaxtree.Suite(tuple(body), sourcepath=ast.sourcepath, linestart=ast.linestart)
+
+    return expression(ast, functions, frozenset(rejig.syntaxtree.freenames(ast)).union(functions))
+
+def _returns(suite):
+    # whether a suite returns on some path
+    return any(_isreturn(x) or (_isif(x) and any(isinstance(y, rejig.syntaxtree.Suite) and _returns(y) for y in x.args[1:])) for x in suite.body)
+
+def _mightfail(ast):
+    # indexing and min/max of a possibly empty list raise where the untaken branch of an if would never have run
+    if isinstance(ast, rejig.syntaxtree.Call):
+        fcn = ast.fcn.name if isinstance(ast.fcn, rejig.syntaxtree.Name) else ast.fcn
+        if fcn == "[.]" or (fcn in ("min", "max") and len(ast.args) == 1):
+            return True
+    if isinstance(ast, rejig.syntaxtree.AST):
+        return any(_mightfail(y) for x in ast.params for y in (x if isinstance(x, tuple) else (x,)))
+    else:
+        return False
+
+def _let(statements, sourcepath, linestart):
+    if len(statements) == 1 and _isreturn(statements[0]):
+        return statements[0].args[0]
+    elif len(statements) == 2 and isinstance(statements[0], rejig.syntaxtree.Assign) and statements[0].targets == (statements[1].args[0],):
+        # "y = value; return y"
+        return statements[0].expr
+    else:
+        return rejig.syntaxtree.Suite(tuple(statements), sourcepath=sourcepath, linestart=linestart)
+
+def _ifstatements(body, fresh):
+    # body as straight-line assignments and a return, or None if it has statements other than those and convertible ifs
+    out = []
+    for i, statement in enumerate(body):
+        if isinstance(statement, rejig.syntaxtree.Assign):
+            # storing into an item or attribute is a side effect
+            if not all(isinstance(x, rejig.syntaxtree.Name) for x in statement.targets):
+                return None
+            out.append(rejig.syntaxtree.Assign(statement.targets, _ifexpression(statement.expr, fresh), sourcepath=statement.sourcepath, linestart=statement.linestart))
+
+        elif _isreturn(statement):
+            out.append(rejig.syntaxtree.Call("return", _ifexpression(statement.args[0], fresh), sourcepath=statement.sourcepath, linestart=statement.linestart))
+            return out
+
+        elif _isif(statement) and all(isinstance(x, rejig.syntaxtree.Suite) for x in statement.args[1:]):
+            sourcepath, linestart = statement.sourcepath, statement.linestart
+            branches = list(statement.args[1:])
+            if len(branches) == 1:
+                branches.append(rejig.syntaxtree.Suite((), sourcepath=sourcepath, linestart=linestart))
+            if any(_mightfail(x) for x in branches):
+                return None
+
+            condition = _ifexpression(statement.args[0], fresh)
+            if any(_returns(x) for x in branches):
+                # the rest of the suite continues whichever branch doesn't return
+                arms = [_ifstatements(x.body + tuple(body[i + 1:]), fresh) for x in branches]
+                if any(x is None or not _isreturn(x[-1]) or _mightfail(rejig.syntaxtree.Suite(tuple(x))) for x in arms):
+                    return None
+                out.append(rejig.syntaxtree.Call("return", rejig.syntaxtree.Call("where", condition, *[_let(x, sourcepath, linestart) for x in arms], sourcepath=sourcepath, linestart=linestart), sourcepath=sourcepath, linestart=linestart))
+                return out
+
+            arms = [_ifstatements(x.body, fresh) for x in branches]
+            if any(x is None for x in arms):
+                return None
+            names = sorted(set().union(*[_assigned(rejig.syntaxtree.Suite(tuple(x))) for x in arms]))
+            if len(names) == 0:
+                continue
+            if len(names) > 1 and not isinstance(condition, (rejig.syntaxtree.Name, rejig.syntaxtree.Const)):
+                # evaluated once for all of the names
+                temp = rejig.syntaxtree.Name(fresh("_c"), sourcepath=sourcepath, linestart=linestart)
+                out.append(rejig.syntaxtree.Assign((temp,), condition, sourcepath=sourcepath, linestart=linestart))
+                condition = temp
+
+            # every name's new value is computed from the old values before any is assigned
+            values = []
+            for n in names:
+                name = rejig.syntaxtree.Name(n, sourcepath=sourcepath, linestart=linestart)
+                choices = [_let(x + [rejig.syntaxtree.Call("return", name, sourcepath=sourcepath, linestart=linestart)], sourcepath, linestart) if n in _assigned(rejig.syntaxtree.Suite(tuple(x))) else name for x in arms]
+                values.append(rejig.syntaxtree.Call("where", condition, *choices, sourcepath=sourcepath, linestart=linestart))
+            if len(names) == 1:
+                out.append(rejig.syntaxtree.Assign((rejig.syntaxtree.Name(names[0], sourcepath=sourcepath, linestart=linestart),), values[0], sourcepath=sourcepath, linestart=linestart))
+            else:
+                temps = [rejig.syntaxtree.Name(fresh("_" + n), sourcepath=sourcepath, linestart=linestart) for n in names]
+                for temp, value in zip(temps, values):
+                    out.append(rejig.syntaxtree.Assign((temp,), value, sourcepath=sourcepath, linestart=linestart))
+                for n, temp in zip(names, temps):
+                    out.append(rejig.syntaxtree.Assign((rejig.syntaxtree.Name(n, sourcepath=sourcepath, linestart=linestart),), temp, sourcepath=sourcepath, linestart=linestart))
+
+        else:
+            return None
+
+    return out
+
+def _ifsuite(suite, fresh):
+    statements = _ifstatements(suite.body, fresh)
+    if statements is not None:
+        return rejig.syntaxtree.Suite(tuple(statements), sourcepath=suite.sourcepath, linestart=suite.linestart)
+
+    # the suite keeps its ifs, but what's inside them may still be converted
+    body = []
+    for x in suite.body:
+        if isinstance(x, rejig.syntaxtree.Assign):
+            body.append(rejig.syntaxtree.Assign(x.targets, _ifexpression(x.expr, fresh), sourcepath=x.sourcepath, linestart=x.linestart))
+        elif _isif(x):
+            body.append(rejig.syntaxtree.Call("if", _ifexpression(x.args[0], fresh), *[_ifsuite(y, fresh) if isinstance(y, rejig.syntaxtree.Suite) else y for y in x.args[1:]], sourcepath=x.sourcepath, linestart=x.linestart))
+        else:
+            body.append(_ifexpression(x, fresh))
+    return rejig.syntaxtree.Suite(tuple(body), sourcepath=suite.sourcepath, linestart=suite.linestart)
+
+def _ifexpression(ast, fresh):
+    if isinstance(ast, rejig.syntaxtree.Def):
+        return rejig.syntaxtree.Def(ast.argnames, ast.defaults, _ifsuite(ast.body, fresh), sourcepath=ast.sourcepath, linestart=ast.linestart)
+
+    elif isinstance(ast, rejig.syntaxtree.Suite):
+        return _ifsuite(ast, fresh)
+
+    elif isinstance(ast, rejig.syntaxtree.Call):
+        fcn = _ifexpression(ast.fcn, fresh) if isinstance(ast.fcn, rejig.syntaxtree.AST) else ast.fcn
+        args = tuple(_ifexpression(x, fresh) if isinstance(x, rejig.syntaxtree.AST) else x for x in ast.args)
+        if fcn == "?" and len(args) == 3 and not any(_mightfail(x) for x in args[1:]):
+            fcn = "where"
+        return rejig.syntaxtree.Call(fcn, *args, sourcepath=ast.sourcepath, linestart=ast.linestart)
+
+    else:
+        return ast
+
+def ifconvert(ast):
+    # if-conversion: ifs whose branches only assign names and return, and conditional expressions, become where(condition, then, else),
+    # which vectorized backends compute for every item with no branching; branches that might raise are left alone
+    return _ifexpression(ast, _Fresh(_allnames(ast)))
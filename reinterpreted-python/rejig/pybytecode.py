@@ -1,22 +1,204 @@
+import collections
+import copy
 import sys
 import types
 import numbers
 
+import numpy
+
 import spark_parser
 import uncompyle6.parser
 import uncompyle6.scanner
 
 import rejig.syntaxtree
 
-def ast(code, pyversion=None, debug_parser=spark_parser.DEFAULT_DEBUG, linestart=None):
+def ast(code, pyversion=None, debug_parser=spark_parser.DEFAULT_DEBUG, linestart=None, capture=None, scope=()):
+    # with capture, a Guard of the function being decompiled, its closure cells and globals with constant values become Consts
     if not isinstance(code, types.CodeType):
         code = code.__code__
-    return BytecodeWalker(code, pyversion=pyversion, debug_parser=debug_parser).ast(linestart=linestart)
+    return BytecodeWalker(code, pyversion=pyversion, debug_parser=debug_parser, capture=capture, scope=scope).ast(linestart=linestart)
+
+def define(fcn, pyversion=None, debug_parser=spark_parser.DEFAULT_DEBUG, capture=None):
+    # a whole function, so that other functions can call it by name and have it inlined
+    code = fcn.__code__
+    walker = BytecodeWalker(code, pyversion=pyversion, debug_parser=debug_parser, capture=capture)
+    linestart = code.co_firstlineno
+    defaults = tuple(walker.make_const(x, walker.sourcepath, linestart) for x in (fcn.__defaults__ or ()))
+    return rejig.syntaxtree.Def(code.co_varnames[:code.co_argcount], defaults, walker.ast(linestart=linestart), sourcepath=walker.sourcepath, linestart=linestart)
+
+def _constant(value):
+    # what make_const can express
+    if value is None or isinstance(value, (bool, numbers.Number, str)):
+        return True
+    elif isinstance(value, (tuple, list, set)):
+        return all(_constant(x) for x in value)
+    elif isinstance(value, dict):
+        return all(_constant(n) and _constant(x) for n, x in value.items())
+    else:
+        return False
+
+def _same(one, two):
+    if type(one) is not type(two):
+        return False
+    elif isinstance(one, float) and one != one:
+        return two != two
+    else:
+        return one == two
+
+class Guard(object):
+    # the closure cells and globals of fcn that were decompiled as constants, with their values then: anything built from them is stale once they change
+    # capture is a snapshot: nothing re-reads the values, and a kernel compiled from the tree keeps them after they change
+    # (the kernel cache keys on the Consts, so it never confuses two snapshots); call check() before reusing a kernel and decompile again if it fails
+    def __init__(self, fcn):
+        self.fcn = fcn
+        self.values = collections.OrderedDict()
+
+    def __repr__(self):
+        return "<Guard {0}>".format(", ".join("{0}={1}".format(n, repr(x)) for (n, cell), x in self.values.items()))
+
+    def current(self, name, cell):
+        # (True, value) for a closure cell or a global, (False, None) if there's no such name (or the cell is empty)
+        if cell:
+            freevars = self.fcn.__code__.co_freevars
+            if name not in freevars:
+                return False, None
+            try:
+                return True, self.fcn.__closure__[freevars.index(name)].cell_contents
+            except ValueError:
+                return False, None
+        elif name in self.fcn.__globals__:
+            return True, self.fcn.__globals__[name]
+        else:
+            return False, None
+
+    def capture(self, name, cell):
+        found, value = self.current(name, cell)
+        if not found or not _constant(value):
+            return False, None
+        # a copy, so that a list mutated in place counts as changed
+        self.values[name, cell] = copy.deepcopy(value)
+        return True, value
+
+    def changed(self):
+        out = []
+        for (name, cell), value in self.values.items():
+            found, now = self.current(name, cell)
+            if not found or not _same(now, value):
+                out.append(name)
+        return out
+
+    def check(self):
+        return len(self.changed()) == 0
+
+# tuples and lists of at least this many numbers of one kind become one array constant
+arrayconst = 16
+
+def _homogeneous(value):
+    # the dtype for a long enough tuple or list of all bools, all integers, or all floats and integers, or None
+    if len(value) < arrayconst:
+        return None
+    elif all(isinstance(x, bool) for x in value):
+        return numpy.dtype(numpy.bool_)
+    elif all(isinstance(x, numbers.Integral) and not isinstance(x, bool) for x in value):
+        # Python's integers are unbounded
+        if numpy.iinfo(numpy.int64).min <= min(value) and max(value) <= numpy.iinfo(numpy.int64).max:
+            return numpy.dtype(numpy.int64)
+        return None
+    elif all(isinstance(x, float) for x in value):
+        return numpy.dtype(numpy.float64)
+    elif all(isinstance(x, (numbers.Integral, float)) and not isinstance(x, bool) for x in value):
+        # as Python would compute with them, integers among floats are floats, as long as that doesn't round them
+        if all(isinstance(x, float) or abs(x) <= 2**53 for x in value):
+            return numpy.dtype(numpy.float64)
+        return None
+    else:
+        return None
+
+_accumulators = {"+": "sum", "*": "prod", "min": "min", "max": "max"}
+
+def _accumulation(statement):
+    # (name, reducer, item) for "s = s + item" and friends, or None
+    if isinstance(statement, rejig.syntaxtree.Assign) and len(statement.targets) == 1 and isinstance(statement.targets[0], rejig.syntaxtree.Name) and isinstance(statement.expr, rejig.syntaxtree.Call) and len(statement.expr.args) == 2:
+        name = statement.targets[0].name
+        op = statement.expr.fcn.name if isinstance(statement.expr.fcn, rejig.syntaxtree.Name) else statement.expr.fcn
+        if op not in _accumulators:
+            return None
+        left, right = statement.expr.args
+        if left == rejig.syntaxtree.Name(name):
+            item = right
+        elif right == rejig.syntaxtree.Name(name):
+            item = left
+        else:
+            return None
+        if name in rejig.syntaxtree.freenames(item):
+            return None
+        return name, _accumulators[op], item
+    else:
+        return None
+
+def reductions(iterable, target, body):
+    # the loop "for target in iterable: body" as assignments of reductions, if every statement of body accumulates into its own variable
+    if isinstance(target, rejig.syntaxtree.Name):
+        args = (target.name,)
+    elif isinstance(target, rejig.syntaxtree.Unpack) and all(isinstance(x, rejig.syntaxtree.Name) for x in target.subtargets):
+        args = tuple(x.name for x in target.subtargets)
+    else:
+        return None
+
+    def over(items, method, expr):
+        if method == "map" and isinstance(target, rejig.syntaxtree.Name) and expr == target:
+            return items
+        defn = rejig.syntaxtree.Def(args, (), rejig.syntaxtree.Suite((rejig.syntaxtree.Call("return", expr, sourcepath=expr.sourcepath, linestart=expr.linestart),), sourcepath=expr.sourcepath, linestart=expr.linestart), sourcepath=expr.sourcepath, linestart=expr.linestart)
+        return rejig.syntaxtree.Call(rejig.syntaxtree.Call(".", items, method, sourcepath=expr.sourcepath, linestart=expr.linestart), defn, sourcepath=expr.sourcepath, linestart=expr.linestart)
+
+    out = []
+    reads = set()
+    for statement in body.body:
+        condition = None
+        if isinstance(statement, rejig.syntaxtree.Call) and statement.fcn == "if" and len(statement.args) == 2 and len(statement.args[1].body) == 1:
+            condition, statement = statement.args[0], statement.args[1].body[0]
+
+        accumulation = _accumulation(statement)
+        if condition is not None and isinstance(statement, rejig.syntaxtree.Assign) and len(statement.targets) == 1 and isinstance(statement.targets[0], rejig.syntaxtree.Name) and isinstance(statement.expr, rejig.syntaxtree.Const) and statement.expr.value in (True, False) and isinstance(statement.expr.value, bool):
+            # "if c: found = True" and "if c: ok = False"
+            name = statement.targets[0].name
+            if statement.expr.value:
+                reducer, predicate = "any", condition
+            else:
+                reducer, predicate = "all", rejig.syntaxtree.Call("not", condition, sourcepath=condition.sourcepath, linestart=condition.linestart)
+            items = over(iterable, "map", predicate)
+            reads.update(rejig.syntaxtree.freenames(condition))
+
+        elif accumulation is not None:
+            name, reducer, item = accumulation
+            items = iterable
+            if condition is not None and reducer == "sum" and item == rejig.syntaxtree.Const(1):
+                # "if c: n += 1"
+                reducer, item, condition = "count", condition, None
+            if condition is not None:
+                items = over(items, "filter", condition)
+                reads.update(rejig.syntaxtree.freenames(condition))
+            items = over(items, "map", item)
+            reads.update(rejig.syntaxtree.freenames(item))
+
+        else:
+            return None
+
+        out.append(rejig.syntaxtree.Assign((rejig.syntaxtree.Name(name, sourcepath=statement.sourcepath, linestart=statement.linestart),), rejig.syntaxtree.Call(reducer, items, rejig.syntaxtree.Name(name, sourcepath=statement.sourcepath, linestart=statement.linestart), sourcepath=statement.sourcepath, linestart=statement.linestart), sourcepath=statement.sourcepath, linestart=statement.linestart))
+
+    # each accumulator is computed in a separate pass, so none may see another's partial value
+    names = [x.targets[0].name for x in out]
+    if len(set(names)) != len(names) or len(reads.intersection(names)) != 0 or len(set(args).intersection(names)) != 0:
+        return None
+    return tuple(out)
 
 class BytecodeWalker(object):
-    def __init__(self, code, pyversion=None, debug_parser=spark_parser.DEFAULT_DEBUG):
+    def __init__(self, code, pyversion=None, debug_parser=spark_parser.DEFAULT_DEBUG, capture=None, scope=()):
         self.code = code
         self.sourcepath = self.code.co_filename
+        self.capture = capture
+        # names local to the functions this code is nested in, which a closure cell of the same name refers to instead
+        self.scope = frozenset(scope)
 
         if pyversion is None:
             pyversion = float(sys.version[0:3])
@@ -90,7 +272,11 @@ class BytecodeWalker(object):
         return node
 
     def make_const(self, value, sourcepath, linestart):
-        if isinstance(value, tuple):
+        dtype = _homogeneous(value) if isinstance(value, (tuple, list)) else None
+        if dtype is not None:
+            # a lookup table is one node, not one per entry
+            return rejig.syntaxtree.Const(numpy.array(value, dtype=dtype), sourcepath=sourcepath, linestart=linestart)
+        elif isinstance(value, tuple):
             return rejig.syntaxtree.Call("tuple", *[self.make_const(x, sourcepath, linestart) for x in value], sourcepath=sourcepath, linestart=linestart)
         elif isinstance(value, list):
             return rejig.syntaxtree.Call("list", *[self.make_const(x, sourcepath, linestart) for x in value], sourcepath=sourcepath, linestart=linestart)
@@ -116,7 +302,7 @@ class BytecodeWalker(object):
 
             if isinstance(suite[-1], rejig.syntaxtree.Suite):
                 suite, flatten = suite[:-1], suite[-1]
-                for x in flatten:
+                for x in flatten.body:
                     suite.append(x)
 
             if isinstance(suite[-1], rejig.syntaxtree.Call) and suite[-1].fcn == "return":
@@ -150,6 +336,10 @@ class BytecodeWalker(object):
             mapper = rejig.syntaxtree.Def(args, (), rejig.syntaxtree.Suite((rejig.syntaxtree.Call("return", next, sourcepath=next.sourcepath, linestart=next.linestart),), sourcepath=next.sourcepath, linestart=next.linestart), sourcepath=next.sourcepath, linestart=next.linestart)
             return rejig.syntaxtree.Call(rejig.syntaxtree.Call(".", src, "map", sourcepath=next.sourcepath, linestart=next.linestart), mapper, sourcepath=next.sourcepath, linestart=next.linestart)
 
+    def nested(self, code, linestart):
+        # a lambda's or comprehension's code, which sees this code's variables
+        return ast(code, linestart=linestart, capture=self.capture, scope=self.scope.union(self.code.co_varnames, self.code.co_cellvars))
+
     def n(self, node):
         return getattr(self, "n_" + node.kind, self.default)(node)
 
@@ -181,7 +371,7 @@ class BytecodeWalker(object):
 
     def n_listcomp(self, node):
         source = self.n(node[3])
-        loops = ast(self.n(node[0]), linestart=node.linestart).params[0].args[0]
+        loops = self.nested(self.n(node[0]), node.linestart).params[0].args[0]
         return self.make_comp(source, loops)
 
     def n_LOAD_SETCOMP(self, node):
@@ -418,13 +608,15 @@ class BytecodeWalker(object):
         raise NotImplementedError(self.nameline('ROT_THREE', node))
 
     def n_aug_assign1(self, node):
-        raise NotImplementedError(self.nameline('aug_assign1', node))
+        if node[-1].kind != "store":
+            raise NotImplementedError(self.nameline('aug_assign1', node))
+        return rejig.syntaxtree.Assign(self.n(node[-1]), rejig.syntaxtree.Call(self.n(node[2]), self.n(node[0]), self.n(node[1]), sourcepath=self.sourcepath, linestart=node.linestart), sourcepath=self.sourcepath, linestart=node.linestart)
 
     def n_aug_assign2(self, node):
         raise NotImplementedError(self.nameline('aug_assign2', node))
 
     def n_inplace_op(self, node):
-        raise NotImplementedError(self.nameline('inplace_op', node))
+        return self.n(node[0])
 
     def n_STORE_SUBSCR(self, node):
         raise NotImplementedError(self.nameline('STORE_SUBSCR', node))
@@ -436,40 +628,40 @@ class BytecodeWalker(object):
         return node.pattr
 
     def n_INPLACE_ADD(self, node):
-        raise NotImplementedError(self.nameline('INPLACE_ADD', node))
+        return '+'
 
     def n_INPLACE_SUBTRACT(self, node):
-        raise NotImplementedError(self.nameline('INPLACE_SUBTRACT', node))
+        return '-'
 
     def n_INPLACE_MULTIPLY(self, node):
-        raise NotImplementedError(self.nameline('INPLACE_MULTIPLY', node))
+        return '*'
 
     def n_INPLACE_TRUE_DIVIDE(self, node):
-        raise NotImplementedError(self.nameline('INPLACE_TRUE_DIVIDE', node))
+        return '/'
 
     def n_INPLACE_FLOOR_DIVIDE(self, node):
-        raise NotImplementedError(self.nameline('INPLACE_FLOOR_DIVIDE', node))
+        return '//'
 
     def n_INPLACE_MODULO(self, node):
-        raise NotImplementedError(self.nameline('INPLACE_MODULO', node))
+        return '%'
 
     def n_INPLACE_POWER(self, node):
-        raise NotImplementedError(self.nameline('INPLACE_POWER', node))
+        return '**'
 
     def n_INPLACE_LSHIFT(self, node):
-        raise NotImplementedError(self.nameline('INPLACE_LSHIFT', node))
+        return '<<'
 
     def n_INPLACE_RSHIFT(self, node):
-        raise NotImplementedError(self.nameline('INPLACE_RSHIFT', node))
+        return '>>'
 
     def n_INPLACE_AND(self, node):
-        raise NotImplementedError(self.nameline('INPLACE_AND', node))
+        return '&'
 
     def n_INPLACE_XOR(self, node):
-        raise NotImplementedError(self.nameline('INPLACE_XOR', node))
+        return '^'
 
     def n_INPLACE_OR(self, node):
-        raise NotImplementedError(self.nameline('INPLACE_OR', node))
+        return '|'
 
     def n_call_stmt(self, node):
         '''
@@ -588,7 +780,10 @@ class BytecodeWalker(object):
         raise NotImplementedError(self.nameline('for_block', node))
 
     def n_l_stmts_opt(self, node):
-        raise NotImplementedError(self.nameline('l_stmts_opt', node))
+        return self.make_suite(node, self.sourcepath, node.linestart)
+
+    def n_lstmt(self, node):
+        return self.n(node[0])
 
     def n__come_froms(self, node):
         raise NotImplementedError(self.nameline('_come_froms', node))
@@ -637,7 +832,7 @@ class BytecodeWalker(object):
             source = self.n(node[3])
         else:
             raise NotImplementedError('generator_exp', node)
-        loops = ast(self.n(node[0]), linestart=node.linestart).params[0]
+        loops = self.nested(self.n(node[0]), node.linestart).params[0]
         return self.make_comp(source, loops)
 
     def n_LOAD_GENEXPR(self, node):
@@ -659,7 +854,7 @@ class BytecodeWalker(object):
         raise NotImplementedError(self.nameline('except_suite', node))
 
     def n_c_stmts_opt(self, node):
-        raise NotImplementedError(self.nameline('c_stmts_opt', node))
+        return self.n(node[0])
 
     def n_jmp_abs(self, node):
         raise NotImplementedError(self.nameline('jmp_abs', node))
@@ -678,10 +873,18 @@ class BytecodeWalker(object):
         elif node.pattr == "False":
             return rejig.syntaxtree.Const(False, sourcepath=self.sourcepath, linestart=node.linestart)
         else:
+            if self.capture is not None:
+                found, value = self.capture.capture(node.pattr, False)
+                if found:
+                    return self.make_const(value, self.sourcepath, node.linestart)
             return rejig.syntaxtree.Name(node.pattr, sourcepath=self.sourcepath, linestart=node.linestart)
 
     def n_LOAD_DEREF(self, node):
-        raise NotImplementedError(self.nameline('LOAD_DEREF', node))
+        if self.capture is not None and node.pattr not in self.scope:
+            found, value = self.capture.capture(node.pattr, True)
+            if found:
+                return self.make_const(value, self.sourcepath, node.linestart)
+        return rejig.syntaxtree.Name(node.pattr, sourcepath=self.sourcepath, linestart=node.linestart)
 
     def n_binary_expr(self, node):
         return rejig.syntaxtree.Call(self.n(node[2]), self.n(node[0]), self.n(node[1]), sourcepath=self.sourcepath, linestart=node.linestart)
@@ -817,7 +1020,7 @@ class BytecodeWalker(object):
 
     def n_mklambda(self, node):
         code = node[0].attr
-        return rejig.syntaxtree.Def(code.co_varnames[:code.co_argcount], (), ast(code, linestart=node.linestart), sourcepath=self.sourcepath, linestart=node.linestart)
+        return rejig.syntaxtree.Def(code.co_varnames[:code.co_argcount], (), self.nested(code, node.linestart), sourcepath=self.sourcepath, linestart=node.linestart)
 
     def n_conditional(self, node):
         return rejig.syntaxtree.Call("?", self.n(node[0]), self.n(node[2]), self.n(node[4]), sourcepath=self.sourcepath, linestart=node.linestart)
@@ -954,7 +1157,17 @@ class BytecodeWalker(object):
         raise NotImplementedError(self.nameline('else_suitel', node))
 
     def n_for(self, node):
-        raise NotImplementedError(self.nameline('for', node))
+        # only accumulator loops, which become reductions
+        iterable = self.n([x for x in node if x.kind == "expr"][0])
+        target = self.n([x for x in node if x.kind == "store"][0])[0]
+        block = [x for x in node if x.kind == "for_block"][0]
+        body = [self.n(x) for x in block if x.kind in ("l_stmts_opt", "l_stmts")]
+        if len(body) != 1 or not isinstance(body[0], rejig.syntaxtree.Suite):
+            raise NotImplementedError(self.nameline('for', node))
+        out = reductions(iterable, target, body[0])
+        if out is None:
+            raise NotImplementedError(self.nameline('for (only accumulations like "s += x" and "if c: n += 1" can be vectorized)', node))
+        return rejig.syntaxtree.Suite(out, sourcepath=self.sourcepath, linestart=node.linestart)
 
     def n_returns(self, node):
         if node[0].kind == "_stmts" and len(node[0]) > 1 and node[0][0][0].kind == "ifstmt":
@@ -985,7 +1198,7 @@ class BytecodeWalker(object):
 
     def n_mkfunc(self, node):
         code = node[0].attr
-        return rejig.syntaxtree.Def(code.co_varnames[:code.co_argcount], (), ast(code, linestart=node.linestart), sourcepath=self.sourcepath, linestart=node.linestart)
+        return rejig.syntaxtree.Def(code.co_varnames[:code.co_argcount], (), self.nested(code, node.linestart), sourcepath=self.sourcepath, linestart=node.linestart)
 
     def n_function_def_deco(self, node):
         raise NotImplementedError(self.nameline('function_def_deco', node))
@@ -1045,7 +1258,7 @@ class BytecodeWalker(object):
         raise NotImplementedError(self.nameline('continues', node))
 
     def n_lastl_stmt(self, node):
-        raise NotImplementedError(self.nameline('lastl_stmt', node))
+        return self.n(node[0])
 
     def n_assert2(self, node):
         raise NotImplementedError(self.nameline('assert2', node))
@@ -1164,8 +1377,16 @@ class BytecodeWalker(object):
     def n_iflaststmt(self, node):
         raise NotImplementedError(self.nameline('iflaststmt', node))
 
+    def n_ifstmtl(self, node):
+        # an if without an else, inside a loop
+        return rejig.syntaxtree.Call("if", self.n(node[0]), self.n(node[1]), sourcepath=self.sourcepath, linestart=node.linestart)
+
+    def n__ifstmts_jumpl(self, node):
+        return self.n(node[0])
+
     def n_iflaststmtl(self, node):
-        raise NotImplementedError(self.nameline('iflaststmtl', node))
+        # the same, as the last statement of a loop
+        return self.n_ifstmtl(node)
 
     def n_tryfinallystmt(self, node):
         raise NotImplementedError(self.nameline('tryfinallystmt', node))
@@ -1416,7 +1637,7 @@ class BytecodeWalker(object):
         raise NotImplementedError(self.nameline('conditional_false', node))
 
     def n_INPLACE_DIVIDE(self, node):
-        raise NotImplementedError(self.nameline('INPLACE_DIVIDE', node))
+        return '/'
 
     def n_BINARY_DIVIDE(self, node):
         return "/"
@@ -1493,7 +1714,7 @@ class BytecodeWalker(object):
         raise NotImplementedError(self.nameline('ifelsestmtc', node))
 
     def n_l_stmts(self, node):
-        raise NotImplementedError(self.nameline('l_stmts', node))
+        return self.make_suite(node, self.sourcepath, node.linestart)
 
     def n_ifelsestmtl(self, node):
         raise NotImplementedError(self.nameline('ifelsestmtl', node))
@@ -1780,7 +2001,7 @@ class BytecodeWalker(object):
         raise NotImplementedError(self.nameline('async_forelse_stmt', node))
 
     def n_INPLACE_MATRIX_MULTIPLY(self, node):
-        raise NotImplementedError(self.nameline('INPLACE_MATRIX_MULTIPLY', node))
+        return '@'
 
     def n_BINARY_MATRIX_MULTIPLY(self, node):
         raise NotImplementedError(self.nameline('BINARY_MATRIX_MULTIPLY', node))
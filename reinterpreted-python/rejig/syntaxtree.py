@@ -1,3 +1,5 @@
+import numpy
+
 class AST(object):
     def __init__(self, id, *params, **options):
         self.id = id
@@ -105,6 +107,19 @@ class Const(AST):
     def value(self):
         return self.params[0]
 
+    # a large literal table is kept as one numpy array, which compares by value like any other constant
+    def __eq__(self, other):
+        if isinstance(self.value, numpy.ndarray) or isinstance(getattr(other, "value", None), numpy.ndarray):
+            return type(self) == type(other) and isinstance(self.value, numpy.ndarray) and isinstance(other.value, numpy.ndarray) and self.value.dtype == other.value.dtype and numpy.array_equal(self.value, other.value)
+        else:
+            return super(Const, self).__eq__(other)
+
+    def __hash__(self):
+        if isinstance(self.value, numpy.ndarray):
+            return hash((Const, self.value.dtype.str, self.value.tobytes()))
+        else:
+            return super(Const, self).__hash__()
+
     def __repr__(self):
         return "Const({0})".format(repr(self.value))
 
@@ -205,3 +220,55 @@ class Unpack(AST):
 
     def __str__(self):
         return "({0})".format(", ".join(str(x) for x in self.subtargets))
+
+def _boundnames(target):
+    if isinstance(target, Name):
+        return [target.name]
+    elif isinstance(target, Unpack):
+        return [n for x in target.subtargets for n in _boundnames(x)]
+    else:
+        # an item or attribute assignment binds no name
+        return []
+
+def freenames(ast, bound=()):
+    if isinstance(ast, Name):
+        if ast.name in bound:
+            return []
+        else:
+            return [ast.name]
+
+    elif isinstance(ast, Def):
+        return freenames(ast.body, bound + tuple(ast.argnames))
+
+    elif isinstance(ast, Call):
+        out = []
+        if isinstance(ast.fcn, AST):
+            out.extend(freenames(ast.fcn, bound))
+        for x in ast.args:
+            if isinstance(x, AST):
+                out.extend(freenames(x, bound))
+        return out
+
+    elif isinstance(ast, CallKeyword):
+        out = []
+        if isinstance(ast.fcn, AST):
+            out.extend(freenames(ast.fcn, bound))
+        for x in tuple(ast.args) + tuple(x for n, x in ast.kwargs):
+            if isinstance(x, AST):
+                out.extend(freenames(x, bound))
+        return out
+
+    elif isinstance(ast, Suite):
+        # a name assigned by one statement is bound in the statements after it (but not by an assignment in a branch, which may not run)
+        out = []
+        for x in ast.body:
+            out.extend(freenames(x, bound))
+            if isinstance(x, Assign):
+                bound = bound + tuple(n for y in x.targets for n in _boundnames(y))
+        return out
+
+    elif isinstance(ast, Assign):
+        return freenames(ast.expr, bound)
+
+    else:
+        return []
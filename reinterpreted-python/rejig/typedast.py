@@ -1,3 +1,5 @@
+import numbers
+
 import numpy
 
 import awkward.type
@@ -23,9 +25,11 @@ def typecheck(value, type):
     return True   # TODO
 
 class Action(object):
-    def __init__(self, typedast, argtypes):
+    def __init__(self, typedast, argtypes, precision="strict"):
         self.typedast = typedast
         self.argtypes = argtypes
+        self.precision = precision
+        self._compiled = {}
 
     def __repr__(self):
         return "<Action {0} from {1}>".format(repr(self.typedast), repr(self.argtypes))
@@ -33,13 +37,52 @@ class Action(object):
     def __str__(self):
         return str(self.typedast.ast) + "\n" + _typeargs(list(self.argtypes.items()) + [("", self.typedast.rettype)])
 
+    def __getstate__(self):
+        # compiled functions can't be pickled; they're rebuilt on demand
+        state = dict(self.__dict__)
+        state["_compiled"] = {}
+        return state
+
+    def compile(self, backend="python"):
+        if backend not in self._compiled:
+            import rejig.codegen
+            self._compiled[backend] = rejig.codegen.build(self, backend)
+        return self._compiled[backend]
+
     def aspython(self):
-        FIXME
+        return self.compile("python")
+
+def shapeof(type):
+    out = ()
+    while isinstance(type, awkward.type.ArrayType):
+        if type.takes == numpy.inf:
+            out = out + ((0, numpy.inf),)
+        else:
+            out = out + ((type.takes, type.takes),)
+        type = type.to
+    return out
+
+def broadcast(*shapes):
+    out = ()
+    for dims in zip(*[x for x in shapes if len(x) != 0]):
+        lo = max(x for x, y in dims)
+        hi = min(y for x, y in dims)
+        if lo > hi:
+            return None
+        out = out + ((lo, hi),)
+    return out
 
 class AST(object):
-    def __init__(self, ast, rettype):
+    def __init__(self, ast, rettype, shape=None):
         self.ast = ast
         self.rettype = rettype
+        if shape is None:
+            shape = shapeof(rettype)
+        self.shape = shape
+
+    @property
+    def fixedshape(self):
+        return all(lo == hi for lo, hi in self.shape)
 
     def __eq__(self, other):
         return type(self) == type(other) and self.ast == other.ast and self.rettype == other.rettype
@@ -87,8 +130,8 @@ class Name(AST):
         return self.ast.name
     
 class Call(AST):
-    def __init__(self, ast, rettype, typedfcn, typedargs):
-        super(Call, self).__init__(ast, rettype)
+    def __init__(self, ast, rettype, typedfcn, typedargs, shape=None):
+        super(Call, self).__init__(ast, rettype, shape=shape)
         self.typedfcn = typedfcn
         self.typedargs = typedargs
 
@@ -108,7 +151,7 @@ class Call(AST):
 
 class Def(AST):
     def __init__(self, ast, rettype, argtypes, typedbody):
-        super(Def, self).__init__(ast, rettype)
+        super(Def, self).__init__(ast, rettype, shape=typedbody.shape)
         self.argtypes = argtypes
         self.typedbody = typedbody
 
@@ -126,26 +169,86 @@ class Def(AST):
     def body(self):
         return self.ast.body
 
-    def apply(self, typedargs):
-        typedargs = dict(zip(self.argnames, typedargs))
-        def build(node):
-            if isinstance(node, Name):
-                return typedargs.get(node.name, node)
-            elif isinstance(node, Call):
-                return Call(node.ast, node.rettype, node.typedfcn, tuple(build(x) for x in node.typedargs))
-            else:
-                return node
-        return build(self.typedbody)
+def literal(value, precision="strict"):
+    if isinstance(value, numpy.ndarray):
+        # a literal table, whose length is known
+        dtype = value.dtype
+        if precision == "fast-float32" and dtype == numpy.dtype(numpy.float64):
+            dtype = numpy.dtype(numpy.float32)
+        return awkward.type.ArrayType(len(value), dtype)
+    elif precision == "fast-float32" and isinstance(value, float):
+        return numpy.dtype(numpy.float32)
+    elif precision == "fast-float32" and isinstance(value, complex):
+        return numpy.dtype(numpy.complex64)
+    else:
+        return numpy.dtype(type(value))
+
+def _representable(value, dtype):
+    if isinstance(value, (bool, numpy.bool_)):
+        return True
+    elif isinstance(value, numbers.Integral) and issubclass(dtype.type, numpy.integer):
+        return numpy.iinfo(dtype.type).min <= value <= numpy.iinfo(dtype.type).max
+    elif isinstance(value, numbers.Real) and issubclass(dtype.type, (numpy.floating, numpy.complexfloating)):
+        return True
+    elif isinstance(value, numbers.Complex) and issubclass(dtype.type, numpy.complexfloating):
+        return True
+    else:
+        return False
+
+def _weakliteral(value):
+    if isinstance(value, (bool, numpy.bool_)):
+        return numpy.dtype(numpy.bool_)
+    elif isinstance(value, numbers.Integral):
+        return numpy.min_scalar_type(value)
+    elif isinstance(value, numbers.Real):
+        return numpy.dtype(numpy.float16)
+    else:
+        return numpy.dtype(numpy.complex64)
+
+def promote(typedargs, precision="strict"):
+    types = [x.rettype for x in typedargs]
+    if precision == "strict" or not all(isinstance(x, numpy.dtype) for x in types):
+        return numerical(*types, precision=precision)
+
+    columns = [x.rettype for x in typedargs if not isinstance(x, Const)]
+    if len(columns) == 0:
+        return numerical(*types, precision=precision)
+
+    # literals are "weak": they only widen the result if the columns can't represent them
+    out = numerical(*columns, precision=precision)
+    for x in typedargs:
+        if out is not None and isinstance(x, Const) and isinstance(x.value, numbers.Number) and not _representable(x.value, out):
+            out = numerical(out, _weakliteral(x.value), precision=precision)
+    return out
+
+def numerical(*types, **options):
+    precision = options.pop("precision", "strict")
+    if len(options) != 0:
+        raise TypeError("unrecognized keyword argument")
 
-def numerical(*types):
     assert all(isinstance(x, numpy.dtype) for x in types)
 
+    out = _numerical(*types)
+    if precision == "fast-float32" and out == numpy.dtype(numpy.float64):
+        return numpy.dtype(numpy.float32)
+    elif precision == "fast-float32" and out == numpy.dtype(numpy.complex128):
+        return numpy.dtype(numpy.complex64)
+    else:
+        return out
+
+def _numerical(*types):
     if len(types) == 0:
         return None
 
     elif len(types) == 1:
         return types[0]
 
+    elif len(types) > 2:
+        out = _numerical(*types[:2])
+        if out is None:
+            return None
+        return _numerical(out, *types[2:])
+
     elif len(types) == 2:
         x, y = types
         if issubclass(x.type, (numpy.bool, numpy.bool_)) and issubclass(y.type, (numpy.bool, numpy.bool_)):
@@ -3,15 +3,79 @@ try:
 except ImportError:
     from collections import MutableMapping
 
+import json
+import numbers
+import timeit
+
 import numpy
 
+import rejig.optimize
 import rejig.syntaxtree
 import rejig.typedast
 
+precisions = ("strict", "preserve", "fast-float32")
+
+class Profiler(object):
+    def __init__(self):
+        self.functions = {}
+        self.lines = {}
+
+    def __repr__(self):
+        return "<Profiler of {0} Function types on {1} lines>".format(len(self.functions), len(self.lines))
+
+    @staticmethod
+    def _accumulate(stats, key, seconds, failed):
+        if key not in stats:
+            stats[key] = {"calls": 0, "time": 0.0, "failures": 0}
+        stats[key]["calls"] += 1
+        stats[key]["time"] += seconds
+        if failed:
+            stats[key]["failures"] += 1
+
+    def record(self, fcn, ast, seconds, failed):
+        # times are cumulative: a Call's time includes typing its arguments
+        self._accumulate(self.functions, type(fcn).__name__, seconds, failed)
+        if ast.sourcepath is None:
+            line = "{0}".format(ast.linestart)
+        else:
+            line = "{0}:{1}".format(ast.sourcepath, ast.linestart)
+        self._accumulate(self.lines, line, seconds, failed)
+
+    def tojson(self):
+        # copies, which later typing doesn't change
+        return {"functions": dict((n, dict(x)) for n, x in self.functions.items()), "lines": dict((n, dict(x)) for n, x in self.lines.items())}
+
+    def dumps(self, **options):
+        return json.dumps(self.tojson(), **options)
+
 class SymbolTable(MutableMapping):
-    def __init__(self, parent):
+    def __init__(self, parent, precision=None, profiler=None):
+        if precision is not None and precision not in precisions:
+            raise ValueError("unrecognized precision policy: {0} (must be one of {1})".format(repr(precision), ", ".join(repr(x) for x in precisions)))
         self.parent = parent
+        self._precision = precision
+        self._profiler = profiler
         self.types = {}
+        self.shapes = {}
+        self.values = {}
+
+    @property
+    def precision(self):
+        if self._precision is not None:
+            return self._precision
+        elif self.parent is not None:
+            return self.parent.precision
+        else:
+            return "strict"
+
+    @property
+    def profiler(self):
+        if self._profiler is not None:
+            return self._profiler
+        elif self.parent is not None:
+            return self.parent.profiler
+        else:
+            return None
 
     def __getitem__(self, symbol):
         if symbol in self.types:
@@ -23,9 +87,51 @@ class SymbolTable(MutableMapping):
 
     def __setitem__(self, symbol, type):
         self.types[symbol] = type
+        self.shapes.pop(symbol, None)
+        self.values.pop(symbol, None)
 
     def __delitem__(self, symbol):
         del self.types[symbol]
+        self.shapes.pop(symbol, None)
+        self.values.pop(symbol, None)
+
+    def bind(self, symbol, value):
+        # an assigned name stands for its typed expression (or an untyped lambda), which every read shares
+        if isinstance(value, rejig.typedast.AST):
+            self[symbol] = value.rettype
+            self.refine(symbol, value.shape)
+        else:
+            self[symbol] = value
+        self.values[symbol] = value
+
+    def owner(self, symbol):
+        if symbol in self.types:
+            return self
+        elif self.parent is not None:
+            return self.parent.owner(symbol)
+        else:
+            return None
+
+    def value(self, symbol):
+        if symbol in self.types:
+            return self.values.get(symbol)
+        elif self.parent is not None:
+            return self.parent.value(symbol)
+        else:
+            return None
+
+    def shape(self, symbol):
+        if symbol in self.shapes:
+            return self.shapes[symbol]
+        elif symbol in self.types:
+            return None
+        elif self.parent is not None:
+            return self.parent.shape(symbol)
+        else:
+            return None
+
+    def refine(self, symbol, shape):
+        self.shapes[symbol] = shape
 
     def __contains__(self, symbol):
         if symbol in self.types:
@@ -54,17 +160,117 @@ def tofcn(fcnarg, ast, symboltable):
     else:
         raise AssertionError(fcnarg)
 
+def _islength(node, argname):
+    if isinstance(node, rejig.typedast.Call) and node.fcn == "len" and isinstance(node.typedargs[0], rejig.typedast.Name):
+        return node.typedargs[0].name == argname
+    elif isinstance(node, rejig.typedast.Call) and node.fcn == "." and node.typedargs[1] == "size" and isinstance(node.typedargs[0], rejig.typedast.Name):
+        return node.typedargs[0].name == argname
+    else:
+        return False
+
+_flipped = {"==": "==", "!=": "!=", "<": ">", "<=": ">=", ">": "<", ">=": "<="}
+
+def refinements(predicate, argname):
+    # bounds on len(argname) wherever the typed predicate is True
+    lo, hi = 0, numpy.inf
+
+    if isinstance(predicate, rejig.typedast.Call) and predicate.fcn == "and":
+        for x in predicate.typedargs:
+            xlo, xhi = refinements(x, argname)
+            lo, hi = max(lo, xlo), min(hi, xhi)
+
+    elif isinstance(predicate, rejig.typedast.Call) and predicate.fcn in _flipped and len(predicate.typedargs) == 2:
+        op = predicate.fcn
+        left, right = predicate.typedargs
+        if _islength(right, argname):
+            op = _flipped[op]
+            left, right = right, left
+        if _islength(left, argname) and isinstance(right, rejig.typedast.Const) and isinstance(right.value, numbers.Integral):
+            k = right.value
+            if op == ">=":
+                lo = k
+            elif op == ">":
+                lo = k + 1
+            elif op == "==":
+                lo = hi = k
+            elif op == "<=":
+                hi = k
+            elif op == "<":
+                hi = k - 1
+
+    return max(lo, 0), hi
+
+def refine(shape, lo, hi):
+    if len(shape) == 0:
+        return shape
+    else:
+        (oldlo, oldhi), rest = shape[0], shape[1:]
+        return ((max(oldlo, lo), min(oldhi, hi)),) + rest
+
+def minlength(node, depth=0):
+    if depth < len(node.shape):
+        return node.shape[depth][0]
+    else:
+        return 0
+
+def nonempty(node, depth=0):
+    return minlength(node, depth) > 0
+
+def boundscheck(call):
+    # False if the refinements prove that this [.] can't go out of bounds
+    array, index = call.typedargs
+    if isinstance(index, rejig.typedast.Const) and isinstance(index.value, numbers.Integral):
+        if index.value >= 0:
+            return not minlength(array) > index.value
+        else:
+            return not minlength(array) >= -index.value
+    else:
+        return True
+
+def _typifycall(ast, fcn, symboltable):
+    # checked here, so that the profiler counts a wrong number of arguments as a failure of the call
+    if not fcn.numargs(ast.args):
+        raise TypeError("wrong number of arguments{0}\n{1}\n{2}".format(ast.errline(), _indent("function: " + str(fcn)), _indent(rejig.typedast._typeargs([(str(i), x) for i, x in enumerate(ast.args)]))))
+
+    typedargs = []
+    for i, x in enumerate(ast.args):
+        fcnarg = fcn.fcnarg(i)
+        if isinstance(x, rejig.syntaxtree.Name) and isinstance(symboltable.value(x.name), rejig.syntaxtree.Def):
+            x = typifystep(x, symboltable)
+        if fcnarg is not None and not isinstance(x, rejig.syntaxtree.Def):
+            typedargs.append(tofcn(fcnarg, x, symboltable))
+        elif isinstance(x, str):
+            typedargs.append(x)
+        else:
+            typedargs.append(typifystep(x, symboltable))
+
+    typedargs = tuple(typedargs)
+    out = fcn.infer(ast, fcn, typedargs, symboltable)
+    if out is None:
+        raise TypeError("wrong argument type(s){0}\n{1}\n{2}".format(ast.errline(), _indent("function: " + str(fcn)), _indent(rejig.typedast._typeargs(fcn.typedargs(typedargs, ()).items()))))
+    else:
+        return out
+
 def typifystep(ast, symboltable):
     import rejig.library
 
     if isinstance(ast, rejig.syntaxtree.Suite):
-        if len(ast.body) != 1:
+        if len(ast.body) == 0 or not (isinstance(ast.body[-1], rejig.syntaxtree.Call) and ast.body[-1].fcn == "return"):
             raise NotImplementedError
 
-        if isinstance(ast.body[-1], rejig.syntaxtree.Call) and ast.body[-1].fcn == "return":
-            return typifystep(ast.body[-1].args[0], symboltable)
+        scope = symboltable
+        for statement in ast.body[:-1]:
+            if not isinstance(statement, rejig.syntaxtree.Assign) or not all(isinstance(x, rejig.syntaxtree.Name) for x in statement.targets):
+                raise NotImplementedError
+            if isinstance(statement.expr, rejig.syntaxtree.Def):
+                value = statement.expr
+            else:
+                value = typifystep(statement.expr, scope)
+            scope = SymbolTable(scope)
+            for target in statement.targets:
+                scope.bind(target.name, value)
 
-        raise AssertionError(type(ast))
+        return typifystep(ast.body[-1].args[0], scope)
 
     elif isinstance(ast, rejig.syntaxtree.Call):
         if isinstance(ast.fcn, str):
@@ -73,37 +279,48 @@ def typifystep(ast, symboltable):
             fcn = symboltable[ast.fcn]
         else:
             fcn = typifystep(ast.fcn, symboltable)
+            if isinstance(fcn, rejig.typedast.Name) and isinstance(fcn.rettype, rejig.library.Function):
+                # a builtin called by name, as decompiled code does
+                fcn = fcn.rettype
+
+        if isinstance(fcn, rejig.syntaxtree.Def):
+            # a lambda that survived inlining is inlined where it's called
+            return typifystep(rejig.optimize.beta(fcn, ast.args), symboltable)
 
         if not isinstance(fcn, rejig.library.Function):
             raise TypeError("not a function{0}\n{1}".format(ast.errline(), _indent(str(fcn))))
 
-        if not fcn.numargs(ast.args):
-            raise TypeError("wrong number of arguments{0}\n{1}\n{2}".format(ast.errline(), _indent("function: " + str(fcn)), _indent(rejig.typedast._typeargs([(str(i), x) for i, x in enumerate(ast.args)]))))
+        profiler = symboltable.profiler
+        if profiler is None:
+            return _typifycall(ast, fcn, symboltable)
 
-        typedargs = []
-        for i, x in enumerate(ast.args):
-            fcnarg = fcn.fcnarg(i)
-            if fcnarg is not None and not isinstance(x, rejig.syntaxtree.Def):
-                typedargs.append(tofcn(fcnarg, x, symboltable))
-            elif isinstance(x, str):
-                typedargs.append(x)
-            else:
-                typedargs.append(typifystep(x, symboltable))
-
-        out = fcn.infer(ast, fcn, typedargs, symboltable)
-        if out is None:
-            raise TypeError("wrong argument type(s){0}\n{1}\n{2}".format(ast.errline(), _indent("function: " + str(fcn)), _indent(rejig.typedast._typeargs(fcn.typedargs(typedargs, ()).items()))))
+        starttime = timeit.default_timer()
+        try:
+            out = _typifycall(ast, fcn, symboltable)
+        except Exception:
+            profiler.record(fcn, ast, timeit.default_timer() - starttime, True)
+            raise
         else:
+            profiler.record(fcn, ast, timeit.default_timer() - starttime, False)
             return out
 
     elif isinstance(ast, rejig.syntaxtree.Const):
-        return rejig.typedast.Const(ast, numpy.dtype(type(ast.value)))
+        return rejig.typedast.Const(ast, rejig.typedast.literal(ast.value, symboltable.precision))
 
     elif isinstance(ast, rejig.syntaxtree.Name):
         if symboltable[ast.name] is None:
             raise TypeError("unrecognized name{0}\n{1}".format(ast.errline(), _indent("name: " + str(ast.name))))
+        elif isinstance(symboltable.value(ast.name), rejig.syntaxtree.Def):
+            # a lambda is typed where it's used, so its free names must mean the same there as where it was assigned
+            defined = symboltable.owner(ast.name)
+            for n in rejig.syntaxtree.freenames(symboltable.value(ast.name)):
+                if symboltable.owner(n) is not defined.owner(n):
+                    raise NotImplementedError("lambda {0} is used where {1} means something else{2}".format(repr(ast.name), repr(n), ast.errline()))
+            return symboltable.value(ast.name)
+        elif symboltable.value(ast.name) is not None:
+            return symboltable.value(ast.name)
         else:
-            return rejig.typedast.Name(ast, symboltable[ast.name])
+            return rejig.typedast.Name(ast, symboltable[ast.name], shape=symboltable.shape(ast.name))
 
     elif isinstance(ast, rejig.syntaxtree.Def):
         return ast
@@ -111,11 +328,33 @@ def typifystep(ast, symboltable):
     else:
         raise NotImplementedError(type(ast))
 
-def typify(ast, argtypes):
+def definition(fcn):
+    if isinstance(fcn, rejig.syntaxtree.Def):
+        return fcn
+    else:
+        # only decompiling needs uncompyle6
+        from rejig.pybytecode import define
+        return define(fcn)
+
+def typify(ast, argtypes, precision="strict", profiler=None, functions=None):
+    # functions maps names to Python functions or Defs that ast may call; they're inlined and typed as part of one Action
     import rejig.library
 
-    symboltable = SymbolTable(rejig.library.root)
+    symboltable = SymbolTable(rejig.library.root, precision=precision, profiler=profiler)
+    if functions is not None:
+        functions = dict((n, definition(x)) for n, x in functions.items())
+        for n, x in functions.items():
+            if n in rejig.syntaxtree.freenames(x):
+                raise NotImplementedError("function {0} is recursive{1}".format(repr(n), x.errline()))
+            symboltable.bind(n, x)
+        symboltable = SymbolTable(symboltable)
+        # an argument can't be read by a function body that refers to something else by that name
+        functions = dict((n, x) for n, x in functions.items() if n not in argtypes and not set(argtypes).intersection(rejig.syntaxtree.freenames(x)))
+
     for n, x in argtypes.items():
         symboltable[n] = x
 
-    return rejig.typedast.Action(typifystep(ast, symboltable), argtypes)
+    if isinstance(ast, rejig.syntaxtree.Suite):
+        ast = rejig.optimize.eliminate(rejig.optimize.ifconvert(rejig.optimize.eliminate(rejig.optimize.inline(ast, functions=functions))))
+
+    return rejig.typedast.Action(typifystep(ast, symboltable), argtypes, precision=precision)
@@ -0,0 +1,148 @@
+import numbers
+
+import numpy
+
+import awkward.type
+
+import rejig.typedast
+
+class Interval(object):
+    def __init__(self, min, max):
+        self.min = min
+        self.max = max
+
+    def __eq__(self, other):
+        return type(self) == type(other) and self.min == other.min and self.max == other.max
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash((type(self), self.min, self.max))
+
+    def __repr__(self):
+        return "Interval({0}, {1})".format(repr(self.min), repr(self.max))
+
+    def __str__(self):
+        return "[{0}, {1}]".format(self.min, self.max)
+
+    @property
+    def bounded(self):
+        return -numpy.inf < self.min and self.max < numpy.inf
+
+    def union(self, other):
+        return Interval(min(self.min, other.min), max(self.max, other.max))
+
+    @staticmethod
+    def ofdtype(dtype):
+        if isinstance(dtype, numpy.dtype) and issubclass(dtype.type, (numpy.bool, numpy.bool_)):
+            return Interval(0, 1)
+        elif isinstance(dtype, numpy.dtype) and issubclass(dtype.type, numpy.integer):
+            return Interval(int(numpy.iinfo(dtype.type).min), int(numpy.iinfo(dtype.type).max))
+        elif isinstance(dtype, numpy.dtype) and issubclass(dtype.type, numpy.number):
+            return Interval(-numpy.inf, numpy.inf)
+        else:
+            return None
+
+# narrowest first; at equal width, unsigned wins if the interval allows it
+narrowable = (numpy.uint8, numpy.int8, numpy.uint16, numpy.int16, numpy.uint32, numpy.int32, numpy.uint64, numpy.int64)
+
+def narrowest(interval):
+    if interval is None or not interval.bounded:
+        return None
+    for out in narrowable:
+        if numpy.iinfo(out).min <= interval.min and numpy.iinfo(out).max >= interval.max:
+            return numpy.dtype(out)
+    else:
+        return None
+
+def _leaf(type):
+    while isinstance(type, awkward.type.ArrayType):
+        type = type.to
+    return type
+
+def _intersect(interval, dtype):
+    # a node can never hold values outside of what its dtype represents
+    bydtype = Interval.ofdtype(_leaf(dtype))
+    if interval is None:
+        return bydtype
+    elif bydtype is None:
+        return interval
+    else:
+        return Interval(max(interval.min, bydtype.min), min(interval.max, bydtype.max))
+
+def ranges(action, argranges):
+    out = {}
+    scope = dict(argranges)
+
+    def recurse(node, scope):
+        if isinstance(node, rejig.typedast.Const):
+            if isinstance(node.value, numbers.Real):
+                result = Interval(node.value, node.value)
+            elif isinstance(node.value, numpy.ndarray) and len(node.value) > 0 and issubclass(node.value.dtype.type, (numpy.integer, numpy.floating)):
+                # a table's items, which is what indexing it gives
+                result = Interval(node.value.min(), node.value.max())
+            else:
+                result = None
+
+        elif isinstance(node, rejig.typedast.Name):
+            result = scope.get(node.name, None)
+
+        elif isinstance(node, rejig.typedast.Call):
+            argranges = []
+            for i, x in enumerate(node.typedargs):
+                if isinstance(x, rejig.typedast.Def):
+                    inner = dict(scope)
+                    paramranges = node.typedfcn.paramranges(i, lambda y: recurse(y, scope))
+                    for n, r in zip(x.argnames, paramranges):
+                        inner[n] = r
+                    argranges.append(recurse(x, inner))
+                elif isinstance(x, rejig.typedast.AST):
+                    argranges.append(recurse(x, scope))
+                else:
+                    argranges.append(None)
+            result = node.typedfcn.valuerange(argranges, lambda y: recurse(y, scope))
+
+        elif isinstance(node, rejig.typedast.Def):
+            result = recurse(node.typedbody, scope)
+
+        else:
+            raise NotImplementedError(type(node))
+
+        result = _intersect(result, node.rettype)
+        if node in out and out[node] is not None and result is not None:
+            # structurally equal nodes in different scopes share one (conservative) interval
+            out[node] = out[node].union(result)
+        else:
+            out[node] = result
+        return result
+
+    recurse(action.typedast, scope)
+    return out
+
+def narrow(action, argranges):
+    intervals = ranges(action, argranges)
+
+    def retype(type, interval):
+        if isinstance(type, awkward.type.ArrayType):
+            return awkward.type.ArrayType(type.takes, retype(type.to, interval))
+        elif isinstance(type, numpy.dtype) and issubclass(type.type, numpy.integer):
+            dtype = narrowest(interval)
+            if dtype is not None and dtype.itemsize < type.itemsize:
+                return dtype
+        return type
+
+    def rebuild(node):
+        if isinstance(node, rejig.typedast.Const):
+            return rejig.typedast.Const(node.ast, retype(node.rettype, intervals[node]))
+        elif isinstance(node, rejig.typedast.Name):
+            return node
+        elif isinstance(node, rejig.typedast.Def):
+            typedbody = rebuild(node.typedbody)
+            return rejig.typedast.Def(node.ast, typedbody.rettype, node.argtypes, typedbody)
+        elif isinstance(node, rejig.typedast.Call):
+            return rejig.typedast.Call(node.ast, retype(node.rettype, intervals[node]), node.typedfcn, tuple(rebuild(x) if isinstance(x, rejig.typedast.AST) else x for x in node.typedargs), shape=node.shape)
+        else:
+            raise NotImplementedError(type(node))
+
+    return rejig.typedast.Action(rebuild(action.typedast), action.argtypes, precision=action.precision)
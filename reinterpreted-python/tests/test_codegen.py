@@ -0,0 +1,183 @@
+import numpy
+
+import awkward.type
+
+import rejig.typing
+from rejig.syntaxtree import *
+
+def check(ast, argtypes, args, what_should_be):
+    action = rejig.typing.typify(ast, argtypes)
+    fcn = action.aspython()
+    print(fcn.source)
+    assert action.aspython() is fcn
+    result = fcn(*args)
+    assert result == what_should_be, "\nshould be: " + repr(what_should_be) + "\nyet it is: " + repr(result)
+
+flat = awkward.type.ArrayType(numpy.inf, numpy.dtype(int))
+jagged = awkward.type.ArrayType(numpy.inf, numpy.inf, numpy.dtype(int))
+
+check(Suite((Call('return', Call('+', Name('x'), Const(3.5))),)), {"x": numpy.dtype(int)}, (1,), 4.5)
+check(Suite((Call('return', Call('+', Name('x'), Name('y'), Const(1))),)), {"x": numpy.dtype(int), "y": numpy.dtype(int)}, (1, 2), 4)
+check(Suite((Call('return', Call('<', Name('x'), Const(3))),)), {"x": numpy.dtype(int)}, (1,), True)
+check(Suite((Call('return', Call(Call('.', Name('a'), 'map'), Def(('x',), (), Suite((Call('return', Call('+', Name('x'), Const(1))),))))),)), {"a": flat}, ([1, 2, 3],), [2, 3, 4])
+check(Suite((Call('return', Call(Call('.', Name('a'), 'filter'), Def(('x',), (), Suite((Call('return', Call('>', Name('x'), Const(1))),))))),)), {"a": flat}, ([1, 2, 3],), [2, 3])
+check(Suite((Call('return', Call('.', Name('a'), 'size')),)), {"a": flat}, ([1, 2, 3],), 3)
+check(Suite((Call('return', Call(Call('.', Name('a'), 'map'), Def(('x',), (), Suite((Call('return', Call(Call('.', Name('x'), 'map'), Def(('y',), (), Suite((Call('return', Call('+', Name('y'), Const(1))),))))),))))),)), {"a": jagged}, ([[1, 2], [], [3]],), [[2, 3], [], [4]])
+check(Suite((Call('return', Call(Call('.', Call(Call('.', Name('a'), 'filter'), Def(('x',), (), Suite((Call('return', Call('>=', Call('len', Name('x')), Const(2))),)))), 'map'), Def(('x',), (), Suite((Call('return', Call('[.]', Name('x'), Const(1))),))))),)), {"a": jagged}, ([[1, 2], [], [3]],), [2])
+
+import rejig.execute
+
+def check_numpy(ast, argtypes, args, what_should_be, **options):
+    action = rejig.typing.typify(ast, argtypes, **options)
+    fcn = action.compile("numpy")
+    print(fcn.source)
+    result = rejig.execute.Executor(action, "numpy")(*args)
+    assert numpy.array_equal(result, what_should_be), "\nshould be: " + repr(what_should_be) + "\nyet it is: " + repr(result)
+    if isinstance(action.typedast.rettype, awkward.type.ArrayType):
+        assert result.dtype == action.typedast.rettype.to, "\nshould be: " + repr(action.typedast.rettype.to) + "\nyet it is: " + repr(result.dtype)
+
+floats = awkward.type.ArrayType(numpy.inf, numpy.dtype(numpy.float32))
+
+check_numpy(Suite((Call('return', Call('+', Name('x'), Const(1))),)), {"x": numpy.dtype(int)}, (1,), 2)
+check_numpy(Suite((Call('return', Call(Call('.', Name('a'), 'map'), Def(('x',), (), Suite((Call('return', Call('+', Name('x'), Name('x'), Const(1))),))))),)), {"a": flat}, (numpy.array([1, 2, 3]),), [3, 5, 7])
+check_numpy(Suite((Call('return', Call(Call('.', Name('a'), 'map'), Def(('x',), (), Suite((Call('return', Call('+', Name('x'), Const(0.5))),))))),)), {"a": floats}, (numpy.array([1, 2, 3], numpy.float32),), [1.5, 2.5, 3.5], precision="preserve")
+check_numpy(Suite((Call('return', Call(Call('.', Name('a'), 'map'), Def(('x',), (), Suite((Call('return', Call('+', Name('n'), Const(1))),))))),)), {"a": flat, "n": numpy.dtype(int)}, (numpy.array([1, 2, 3]), 5), [6, 6, 6])
+check_numpy(Suite((Call('return', Call(Call('.', Name('a'), 'filter'), Def(('x',), (), Suite((Call('return', Call('>', Name('x'), Const(1))),))))),)), {"a": flat}, (numpy.array([1, 2, 3]),), [2, 3])
+check_numpy(Suite((Call('return', Call('len', Name('a'))),)), {"a": flat}, (numpy.array([1, 2, 3]),), 3)
+
+import awkward
+
+def check_jagged(ast, argtypes, args, what_should_be):
+    action = rejig.typing.typify(ast, argtypes)
+    fcn = action.compile("numpy")
+    print(fcn.source)
+    result = fcn(*args)
+    if hasattr(result, "tolist"):
+        result = result.tolist()
+    assert result == what_should_be, "\nshould be: " + repr(what_should_be) + "\nyet it is: " + repr(result)
+
+jaggedfloats = awkward.type.ArrayType(numpy.inf, numpy.inf, numpy.dtype(float))
+events = awkward.JaggedArray.fromcounts(numpy.array([2, 0, 1, 3]), numpy.array([1.0, 2.0, 3.0, 4.0, 5.0, 6.0]))
+
+check_jagged(Suite((Call('return', Call(Call('.', Name('a'), 'map'), Def(('x',), (), Suite((Call('return', Call(Call('.', Name('x'), 'map'), Def(('y',), (), Suite((Call('return', Call('+', Name('y'), Const(1.0))),))))),))))),)), {"a": jaggedfloats}, (events,), [[2.0, 3.0], [], [4.0], [5.0, 6.0, 7.0]])
+check_jagged(Suite((Call('return', Call(Call('.', Name('a'), 'map'), Def(('x',), (), Suite((Call('return', Call(Call('.', Name('x'), 'map'), Def(('y',), (), Suite((Call('return', Call('+', Name('y'), Call('len', Name('x')))),))))),))))),)), {"a": jaggedfloats}, (events,), [[3.0, 4.0], [], [4.0], [7.0, 8.0, 9.0]])
+check_jagged(Suite((Call('return', Call(Call('.', Name('a'), 'map'), Def(('x',), (), Suite((Call('return', Call(Call('.', Name('x'), 'filter'), Def(('y',), (), Suite((Call('return', Call('>', Name('y'), Const(2.5))),))))),))))),)), {"a": jaggedfloats}, (events,), [[], [], [3.0], [4.0, 5.0, 6.0]])
+check_jagged(Suite((Call('return', Call(Call('.', Name('a'), 'map'), Def(('x',), (), Suite((Call('return', Call('len', Name('x'))),))))),)), {"a": jaggedfloats}, (events,), [2, 0, 1, 3])
+check_jagged(Suite((Call('return', Call(Call('.', Call(Call('.', Name('a'), 'filter'), Def(('x',), (), Suite((Call('return', Call('>=', Call('len', Name('x')), Const(1))),)))), 'map'), Def(('x',), (), Suite((Call('return', Call('[.]', Name('x'), Const(-1))),))))),)), {"a": jaggedfloats}, (events,), [2.0, 3.0, 6.0])
+
+try:
+    check_jagged(Suite((Call('return', Call(Call('.', Name('a'), 'map'), Def(('x',), (), Suite((Call('return', Call('[.]', Name('x'), Const(0))),))))),)), {"a": jaggedfloats}, (events,), None)
+except IndexError:
+    pass
+else:
+    raise AssertionError("x[0] on an empty list should raise IndexError")
+
+import rejig.codegen
+
+# numexpr and numba are slow to import, so kernels of the other backends don't import them
+action = rejig.typing.typify(Suite((Call('return', Call('+', Name('x'), Const(1))),)), {"x": numpy.dtype(int)})
+for backend in ("python", "numpy"):
+    assert "numexpr" not in action.compile(backend).__globals__ and "numba" not in action.compile(backend).__globals__
+
+# one numexpr evaluation per maximal subtree of numexpr-able functions
+action = rejig.typing.typify(Suite((Call('return', Call(Call('.', Name('a'), 'map'), Def(('x',), (), Suite((Call('return', Call('>', Call('+', Name('x'), Name('n'), Const(1.5)), Call('[.]', Name('b'), Const(0)))),))))),)), {"a": floats, "b": floats, "n": numpy.dtype(numpy.float32)})
+source = rejig.codegen.NumexprGenerator(action).source("fcn")
+assert source.count("numexpr.evaluate") == 1 and "'((_e0 + _e1 + 1.5) > _e2)'" in source
+
+try:
+    import numexpr
+except ImportError:
+    assert action.compile("numexpr").source == action.compile("numpy").source
+else:
+    assert numpy.array_equal(action.compile("numexpr")(numpy.array([1, 2, 3], numpy.float32), numpy.array([4], numpy.float32), numpy.float32(1)), [False, True, True])
+
+# a filter/map chain becomes one parallel loop for the predicates and one for the survivors
+action = rejig.typing.typify(Suite((Call('return', Call(Call('.', Call(Call('.', Name('a'), 'filter'), Def(('x',), (), Suite((Call('return', Call('>=', Call('len', Name('x')), Const(1))),)))), 'map'), Def(('x',), (), Suite((Call('return', Call('+', Call('[.]', Name('x'), Const(-1)), Name('n'))),))))),)), {"a": jaggedfloats, "n": numpy.dtype(float)})
+source = rejig.codegen.NumbaGenerator(action).source("fcn")
+assert "@numba.njit('float64[:](int64[:], int64[:], float64[:], float64)', parallel=True)" in source and source.count("numba.prange") == 2 and "IndexError" not in source
+
+try:
+    import numba
+except ImportError:
+    assert action.compile("numba").source == action.compile("numpy").source
+else:
+    assert action.compile("numba")(events, 1.0).tolist() == [3.0, 4.0, 7.0]
+
+# the items of a regular array are rows, indexed like any array
+action = rejig.typing.typify(Suite((Call('return', Call(Call('.', Name('a'), 'map'), Def(('x',), (), Suite((Call('return', Call('[.]', Name('x'), Const(1))),))))),)), {"a": awkward.type.ArrayType(numpy.inf, 3, numpy.dtype(int))})
+source = rejig.codegen.NumbaGenerator(action).source("fcn")
+assert "x = a[_i]" in source and "= x[1]" in source
+compile(source, "<numba>", "exec")
+
+# what doesn't depend on a lambda's argument is computed once, before the loop
+action = rejig.typing.typify(Suite((Call('return', Call(Call('.', Name('a'), 'map'), Def(('x',), (), Suite((Call('return', Call('+', Name('x'), Call('+', Name('b'), Name('c')))),))))),)), {"a": awkward.type.ArrayType(numpy.inf, numpy.dtype(float)), "b": numpy.dtype(float), "c": numpy.dtype(float)})
+fcn = action.compile("python")
+assert "_s0 = (b + c)" in fcn.source and fcn(numpy.array([1.0, 2.0]), 1.0, 2.0) == [4.0, 5.0]
+source = rejig.codegen.NumbaGenerator(action).source("fcn")
+assert source.index("(b + c)") < source.index("numba.prange")
+
+# unless it might fail where the loop never runs
+fcn = rejig.typing.typify(Suite((Call('return', Call(Call('.', Name('a'), 'map'), Def(('x',), (), Suite((Call('return', Call('+', Name('x'), Call('[.]', Name('a'), Const(0)))),))))),)), {"a": awkward.type.ArrayType(numpy.inf, numpy.dtype(float))}).compile("python")
+assert "_s0" not in fcn.source and fcn(numpy.array([], dtype=float)) == []
+
+# loops that accumulate, as the decompiler lowers them, reduce whole arrays or each list inside a .map
+reduced = Suite((Assign((Name('s'),), Const(0)), Assign((Name('s'),), Call('sum', Call(Call('.', Name('a'), 'filter'), Def(('x',), (), Suite((Call('return', Call('>', Name('x'), Const(1))),)))), Name('s'))), Call('return', Name('s')),))
+action = rejig.typing.typify(reduced, {"a": flat})
+assert action.typedast.rettype == numpy.dtype(numpy.int64)
+assert action.compile("python")(numpy.array([1, 2, 3])) == 5
+assert action.compile("numpy")(numpy.array([1, 2, 3])) == 5
+
+action = rejig.typing.typify(Suite((Call('return', Call(Call('.', Name('a'), 'map'), Def(('x',), (), Suite((Call('return', Call('max', Name('x'), Const(0.0))),))))),)), {"a": jaggedfloats})
+assert action.compile("numpy")(events).tolist() == [2.0, 0.0, 3.0, 6.0]
+assert action.compile("python")(events) == [2.0, 0.0, 3.0, 6.0]
+action = rejig.typing.typify(Suite((Call('return', Call(Call('.', Name('a'), 'map'), Def(('x',), (), Suite((Call('return', Call('count', Call(Call('.', Name('x'), 'map'), Def(('y',), (), Suite((Call('return', Call('>', Name('y'), Const(2.5))),)))))),))))),)), {"a": jaggedfloats})
+assert action.compile("numpy")(events).tolist() == [0, 0, 1, 3]
+
+try:
+    rejig.typing.typify(Suite((Call('return', Call(Call('.', Name('a'), 'map'), Def(('x',), (), Suite((Call('return', Call('min', Name('x'))),))))),)), {"a": jaggedfloats}).compile("numpy")(events)
+except ValueError:
+    pass
+else:
+    assert False, "min() of an empty list should fail"
+
+# "and" computes each later argument only for the items the earlier ones left, so a guarded [.] never sees an empty list
+guarded = Suite((Call('return', Call(Call('.', Name('a'), 'filter'), Def(('x',), (), Suite((Call('return', Call('and', Call('>', Call('len', Name('x')), Const(0)), Call('>', Call('[.]', Name('x'), Const(0)), Const(2.0)))),))))),))
+action = rejig.typing.typify(guarded, {"a": jaggedfloats})
+assert [list(x) for x in action.compile("python")(events)] == [[3.0], [4.0, 5.0, 6.0]]
+fcn = action.compile("numpy")
+assert "numpy.flatnonzero" in fcn.source and fcn(events).tolist() == [[3.0], [4.0, 5.0, 6.0]]
+source = rejig.codegen.NumbaGenerator(action).source("fcn")
+assert source.index("if _v0:") < source.index("IndexError")
+
+# and outside any .map, the guarded argument isn't computed at all
+action = rejig.typing.typify(Suite((Call('return', Call('and', Call('>', Call('len', Name('a')), Const(0)), Call('>', Call('[.]', Name('a'), Const(0)), Const(2.0)))),)), {"a": flat})
+for backend in ("python", "numpy"):
+    fcn = action.compile(backend)
+    assert not fcn(numpy.array([], dtype=numpy.int64)) and fcn(numpy.array([3])) and not fcn(numpy.array([1]))
+
+# the arguments that decide the most items for the least work go first: for "or", those most likely to be True
+action = rejig.typing.typify(Suite((Call('return', Call(Call('.', Name('a'), 'map'), Def(('x',), (), Suite((Call('return', Call(Call('.', Name('x'), 'filter'), Def(('y',), (), Suite((Call('return', Call('or', Call('not', Call('<', Name('y'), Call('len', Name('x')))), Call('==', Name('y'), Const(5.0)))),))))),))))),)), {"a": jaggedfloats})
+assert [str(x.typedfcn) for x in rejig.codegen.junctionorder(action.typedast.typedargs[0].typedbody.typedargs[0].typedbody)] == ["not", "=="]
+assert action.compile("numpy")(events).tolist() == [[2.0], [], [3.0], [4.0, 5.0, 6.0]]
+assert action.compile("python")(events) == [[2.0], [], [3.0], [4.0, 5.0, 6.0]]
+
+# a literal table is one constant, built once, and looking it up for every item is a gather
+table = Const(numpy.arange(20) * 3)
+action = rejig.typing.typify(Suite((Call('return', Call(Call('.', Name('a'), 'map'), Def(('x',), (), Suite((Call('return', Call('+', Call('[.]', table, Name('x')), Call('len', table))),))))),)), {"a": flat})
+fcn = action.compile("numpy")
+assert fcn.source.startswith("_c0 = numpy.array([0, 3, 6,") and "_gather(_c0, a, True)" in fcn.source
+assert fcn(numpy.array([0, 1, 19, -1])).tolist() == [20, 23, 77, 77]
+assert action.compile("python")(numpy.array([0, 1, 19, -1])) == [20, 23, 77, 77]
+try:
+    fcn(numpy.array([20]))
+except IndexError:
+    pass
+else:
+    assert False, "index 20 of a 20-item table should fail"
+
+# a lambda whose argument has the same name as an enclosing one's hides it only until it returns
+shadowed = Suite((Assign((Name('y'),), Call(Call('.', Name('a'), 'map'), Def(('x',), (), Suite((Call('return', Call('+', Name('x'), Const(1))),))))),
+                  Call('return', Call(Call('.', Name('a'), 'map'), Def(('x',), (), Suite((Call('return', Call('+', Name('x'), Call('len', Name('y')))),))))),))
+action = rejig.typing.typify(shadowed, {"a": flat})
+assert action.compile("python")(numpy.array([1, 2])) == [3, 4]
+assert action.compile("numpy")(numpy.array([1, 2])).tolist() == [3, 4]
@@ -0,0 +1,106 @@
+import numpy
+
+import awkward
+import awkward.type
+
+import rejig.execute
+import rejig.typing
+from rejig.syntaxtree import *
+
+floats = awkward.type.ArrayType(numpy.inf, numpy.dtype(float))
+jaggedfloats = awkward.type.ArrayType(numpy.inf, numpy.inf, numpy.dtype(float))
+
+numpy.random.seed(12345)
+counts = numpy.random.poisson(2, 1000)
+events = awkward.JaggedArray.fromcounts(counts, numpy.random.normal(0, 1, counts.sum()))
+values = numpy.random.normal(0, 1, 1000)
+noevents = awkward.JaggedArray.fromcounts(numpy.array([], dtype=numpy.int64), numpy.array([]))
+
+def tolist(x):
+    return x.tolist() if hasattr(x, "tolist") else x
+
+def check(executor, ast, argtypes, args):
+    action = rejig.typing.typify(ast, argtypes)
+    result = executor(action)(*args)
+    what_should_be = action.compile("numpy")(*args)
+    assert tolist(result) == tolist(what_should_be), "\nshould be: " + repr(what_should_be) + "\nyet it is: " + repr(result)
+
+lastplusn = Suite((Call('return', Call(Call('.', Call(Call('.', Name('a'), 'filter'), Def(('x',), (), Suite((Call('return', Call('>=', Call('len', Name('x')), Const(1))),)))), 'map'), Def(('x',), (), Suite((Call('return', Call('+', Call('[.]', Name('x'), Const(-1)), Name('n'))),))))),))
+pluslen = Suite((Call('return', Call(Call('.', Name('a'), 'map'), Def(('x',), (), Suite((Call('return', Call(Call('.', Name('x'), 'map'), Def(('y',), (), Suite((Call('return', Call('+', Name('y'), Call('len', Name('x')), Name('n'))),))))),))))),))
+positive = Suite((Call('return', Call(Call('.', Name('a'), 'filter'), Def(('x',), (), Suite((Call('return', Call('>', Name('x'), Const(0.5))),))))),))
+double = Suite((Call('return', Call(Call('.', Name('a'), 'map'), Def(('x',), (), Suite((Call('return', Call('+', Name('x'), Name('x'), Const(1))),))))),))
+length = Suite((Call('return', Call('len', Name('a'))),))
+
+for backend in ("numpy", "python"):
+    executor = lambda action: rejig.execute.ChunkedExecutor(action, backend, blocksize=37)
+    check(executor, lastplusn, {"a": jaggedfloats, "n": numpy.dtype(float)}, (events, 1.0))
+    check(executor, pluslen, {"a": jaggedfloats, "n": numpy.dtype(float)}, (events, 1.0))
+    check(executor, positive, {"a": floats}, (values,))
+    check(executor, double, {"a": floats}, (values,))
+    check(executor, length, {"a": floats}, (values,))
+    # no items, so no blocks
+    check(executor, pluslen, {"a": jaggedfloats, "n": numpy.dtype(float)}, (noevents, 1.0))
+    check(executor, positive, {"a": floats}, (values[:0],))
+
+# buffers are sized by the block, not by the input, and kept between calls
+executor = rejig.execute.ChunkedExecutor(rejig.typing.typify(double, {"a": floats}), blocksize=100)
+executor(numpy.random.normal(0, 1, 100000))
+assert executor.pool.stats()["peak"] <= 1024 and executor.pool.stats()["allocations"] == 1
+executor(numpy.random.normal(0, 1, 100000))
+assert executor.pool.stats()["allocations"] == 1
+executor.pool.clear()
+assert executor.pool.stats() == {"allocations": 0, "reuses": 0, "nbytes": 0, "peak": 0}
+executor(numpy.random.normal(0, 1, 100000))
+assert executor.pool.stats()["allocations"] == 1 and executor.pool.stats()["nbytes"] == executor.pool.stats()["peak"]
+
+import rejig.codegen
+
+threesums = Suite((Call('return', Call(Call('.', Name('a'), 'map'), Def(('x',), (), Suite((Call('return', Call('>', Call('+', Call('+', Name('x'), Name('x')), Call('+', Name('x'), Name('x'))), Call('+', Name('x'), Name('x')))),))))),))
+fcn = rejig.codegen.asnumpy(rejig.typing.typify(threesums, {"a": floats}), scratch=True)
+assert fcn.source.count("_alloc(") == 4 and fcn.numbuffers == 3
+pool = rejig.execute.BufferPool()
+assert fcn(values, pool).tolist() == rejig.typing.typify(threesums, {"a": floats}).compile("numpy")(values).tolist()
+assert pool.stats()["allocations"] == 3
+assert [(start, stop) for start, stop in rejig.execute.boundaries(awkward.JaggedArray.fromcounts(numpy.array([3, 3, 0, 5, 1]), numpy.arange(12)), 4)] == [(0, 1), (1, 3), (3, 4), (4, 5)]
+
+for backend in ("numpy", "python"):
+    executor = lambda action: rejig.execute.ThreadedExecutor(action, backend, workers=3, partitions=7)
+    check(executor, lastplusn, {"a": jaggedfloats, "n": numpy.dtype(float)}, (events, 1.0))
+    check(executor, pluslen, {"a": jaggedfloats, "n": numpy.dtype(float)}, (events, 1.0))
+    check(executor, positive, {"a": floats}, (values,))
+    check(executor, double, {"a": floats}, (values,))
+    check(executor, length, {"a": floats}, (values,))
+    check(executor, lastplusn, {"a": jaggedfloats, "n": numpy.dtype(float)}, (noevents, 1.0))
+    check(executor, pluslen, {"a": jaggedfloats, "n": numpy.dtype(float)}, (noevents, 1.0))
+    check(executor, positive, {"a": floats}, (values[:0],))
+    check(executor, double, {"a": floats}, (values[:0],))
+
+executor = rejig.execute.ThreadedExecutor(rejig.typing.typify(double, {"a": floats}), workers=2, partitions=4)
+executor(values)
+assert [(x["start"], x["stop"]) for x in executor.timing] == [(0, 250), (250, 500), (500, 750), (750, 1000)]
+assert all(x["time"] >= 0 for x in executor.timing)
+
+import pickle
+
+action = rejig.typing.typify(double, {"a": floats})
+action.aspython()
+assert pickle.loads(pickle.dumps(action)).aspython()(values[:3]) == action.aspython()(values[:3])
+
+# ProcessExecutor's workers import this script again, as __mp_main__, and must not start workers themselves
+if __name__ != "__mp_main__":
+    try:
+        import numba
+    except ImportError:
+        pass
+    else:
+        # numba's thread pool is running after a parallel kernel, which a forked worker would inherit
+        assert "parallel=True" in rejig.typing.typify(lastplusn, {"a": jaggedfloats, "n": numpy.dtype(float)}).compile("numba").source
+        check(lambda action: action.compile("numba"), lastplusn, {"a": jaggedfloats, "n": numpy.dtype(float)}, (events, 1.0))
+
+    for backend in ("python", "numpy"):
+        executor = lambda action: rejig.execute.ProcessExecutor(action, backend, workers=2, partitions=5)
+        check(executor, lastplusn, {"a": jaggedfloats, "n": numpy.dtype(float)}, (events, 1.0))
+        check(executor, pluslen, {"a": jaggedfloats, "n": numpy.dtype(float)}, (events, 1.0))
+        check(executor, positive, {"a": floats}, (values,))
+        check(executor, double, {"a": floats}, (values,))
+        check(executor, length, {"a": floats}, (values,))
@@ -0,0 +1,56 @@
+import os
+import shutil
+import tempfile
+
+import numpy
+
+import awkward.type
+
+import rejig.codegen
+import rejig.execute
+import rejig.kernelcache
+import rejig.typing
+from rejig.syntaxtree import *
+
+floats = awkward.type.ArrayType(numpy.inf, numpy.dtype(float))
+plusone = Suite((Call('return', Call(Call('.', Name('a'), 'map'), Def(('x',), (), Suite((Call('return', Call('+', Name('x'), Const(1))),))))),))
+positive = Suite((Call('return', Call(Call('.', Name('a'), 'filter'), Def(('x',), (), Suite((Call('return', Call('>', Name('x'), Const(0))),))))),))
+
+directory = tempfile.mkdtemp()
+try:
+    cache = rejig.kernelcache.enable(directory)
+
+    fcn = rejig.typing.typify(plusone, {"a": floats}).compile("numpy")
+    assert fcn(numpy.array([1.0, 2.0])).tolist() == [2.0, 3.0]
+    assert (cache.hits, cache.misses) == (0, 1)
+
+    # a new process would start from a new Action with the same structure
+    again = rejig.typing.typify(plusone, {"a": floats}).compile("numpy")
+    assert (cache.hits, cache.misses) == (1, 1) and again.source == fcn.source
+
+    rejig.typing.typify(plusone, {"a": floats}).compile("python")
+    rejig.typing.typify(plusone, {"a": floats}, precision="fast-float32").compile("numpy")
+    rejig.typing.typify(plusone, {"a": awkward.type.ArrayType(numpy.inf, numpy.dtype(numpy.int32))}).compile("numpy")
+    assert (cache.hits, cache.misses) == (1, 4)
+
+    # the same kernel over a different argument is a different kernel
+    other = Suite((Call('return', Call(Call('.', Name('b'), 'map'), Def(('x',), (), Suite((Call('return', Call('+', Name('x'), Const(1))),))))),))
+    action = rejig.typing.typify(other, {"a": floats, "b": floats})
+    assert cache.key(action, "numpy") != cache.key(rejig.typing.typify(plusone, {"a": floats, "b": floats}), "numpy")
+
+    # ChunkedExecutor's scratch kernels are cached too, apart from the ordinary ones
+    executor = rejig.execute.ChunkedExecutor(rejig.typing.typify(plusone, {"a": floats}), blocksize=2)
+    assert (cache.hits, cache.misses) == (1, 5) and "_alloc" in executor.fcn.source
+    again = rejig.execute.ChunkedExecutor(rejig.typing.typify(plusone, {"a": floats}), blocksize=2)
+    assert (cache.hits, cache.misses) == (2, 5) and again(numpy.array([1.0, 2.0, 3.0])).tolist() == [2.0, 3.0, 4.0]
+    assert executor.fcn.numbuffers == again.fcn.numbuffers == rejig.codegen.asnumpy(executor.action, scratch=True).numbuffers == 1
+
+    # only the most recently used kernel fits
+    cache.maxbytes = 1
+    rejig.typing.typify(positive, {"a": floats}).compile("numpy")
+    kernels = [x for x in os.listdir(directory) if x.endswith(".py")]
+    assert kernels == ["rejig_{0}.py".format(cache.key(rejig.typing.typify(positive, {"a": floats}), "numpy"))]
+
+finally:
+    rejig.kernelcache.disable()
+    shutil.rmtree(directory)
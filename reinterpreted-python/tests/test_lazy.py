@@ -0,0 +1,56 @@
+import numpy
+
+import awkward.type
+
+import rejig.execute
+import rejig.lazy
+from rejig.syntaxtree import *
+
+floats = awkward.type.ArrayType(numpy.inf, numpy.dtype(float))
+
+# y = a.map(x -> x + 1); z = y.map(x -> x + n); unused = y.map(x -> x + undefined); y = z.filter(x -> x > 3); return y.map(x -> x + y.size)
+suite = Suite((
+    Assign((Name('y'),), Call(Call('.', Name('a'), 'map'), Def(('x',), (), Suite((Call('return', Call('+', Name('x'), Const(1))),))))),
+    Assign((Name('z'),), Call(Call('.', Name('y'), 'map'), Def(('x',), (), Suite((Call('return', Call('+', Name('x'), Name('n'))),))))),
+    Assign((Name('unused'),), Call(Call('.', Name('y'), 'map'), Def(('x',), (), Suite((Call('return', Call('+', Name('x'), Name('undefined'))),))))),
+    Assign((Name('y'),), Call(Call('.', Name('z'), 'filter'), Def(('x',), (), Suite((Call('return', Call('>', Name('x'), Const(3))),))))),
+    Call('return', Call(Call('.', Name('y'), 'map'), Def(('x',), (), Suite((Call('return', Call('+', Name('x'), Call('.', Name('y'), 'size'))),))))),
+    ))
+
+graph = rejig.lazy.graph(suite, {"a": floats, "n": numpy.dtype(float)})
+assert list(graph.outputs) == ["z", "unused", "y", "return"]
+
+executed = []
+def executor(action):
+    executed.append(action)
+    return rejig.execute.Executor(action, "numpy")
+
+session = rejig.lazy.Session(graph, {"a": numpy.array([1.0, 2.0, 3.0]), "n": 1.0}, executor=executor)
+assert session["z"].tolist() == [3.0, 4.0, 5.0]
+assert len(executed) == 2 and "y" not in session
+assert session["return"].tolist() == [6.0, 7.0]
+assert len(executed) == 4
+assert session["y"].tolist() == [4.0, 5.0]
+assert len(executed) == 4
+
+# the dead branch with an unknown name is never even typed
+assert graph.outputs["unused"]._action is None
+try:
+    session["unused"]
+except TypeError:
+    pass
+else:
+    raise AssertionError("unused should fail to type")
+
+# a named lambda isn't a column: it is substituted where it's used, and what it reads becomes their dependencies
+suite = Suite((
+    Assign((Name('y'),), Call(Call('.', Name('a'), 'map'), Def(('v',), (), Suite((Call('return', Call('+', Name('v'), Const(1))),))))),
+    Assign((Name('f'),), Def(('x',), (), Suite((Call('return', Call('+', Name('x'), Name('n'), Call('len', Name('y')))),)))),
+    Assign((Name('z'),), Call(Call('.', Name('y'), 'map'), Name('f'))),
+    Call('return', Call(Call('.', Name('a'), 'map'), Name('f'))),
+    ))
+graph = rejig.lazy.graph(suite, {"a": floats, "n": numpy.dtype(float)})
+assert list(graph.outputs) == ["y", "z", "return"] and list(graph.outputs["return"].dependencies) == ["a", "n", "y"]
+session = rejig.lazy.Session(graph, {"a": numpy.array([1.0, 2.0]), "n": 10.0})
+assert session["z"].tolist() == [14.0, 15.0]
+assert session["return"].tolist() == [13.0, 14.0]
@@ -0,0 +1,75 @@
+import numpy
+
+import awkward.type
+
+import rejig.optimize
+import rejig.typing
+from rejig.syntaxtree import *
+
+def check(ast, what_should_be):
+    result = rejig.optimize.eliminate(ast)
+    assert result == what_should_be, "\nshould be: " + repr(what_should_be) + "\nyet it is: " + repr(result)
+
+# unused and overwritten assignments
+check(Suite((Assign((Name('y'),), Call('+', Name('x'), Const(1))), Assign((Name('z'),), Name('y')), Call('return', Name('x')))), Suite((Call('return', Name('x')),)))
+check(Suite((Assign((Name('y'),), Const(1)), Assign((Name('y'),), Const(2)), Call('return', Name('y')))), Suite((Assign((Name('y'),), Const(2)), Call('return', Name('y')))))
+check(Suite((Assign((Name('a'),), Const(1)), Assign((Name('b'),), Name('a')), Call('return', Name('b')))), Suite((Assign((Name('a'),), Const(1)), Assign((Name('b'),), Name('a')), Call('return', Name('b')))))
+check(Suite((Assign((Unpack((Name('a'), Name('b'))),), Name('t')), Call('return', Name('b')))), Suite((Assign((Unpack((Name('a'), Name('b'))),), Name('t')), Call('return', Name('b')))))
+check(Suite((Assign((Call('[.]', Name('a'), Const(0)),), Const(1)), Call('return', Name('x')))), Suite((Assign((Call('[.]', Name('a'), Const(0)),), Const(1)), Call('return', Name('x')))))
+
+# branches that can never be taken
+check(Suite((Call('if', Const(False), Suite((Call('return', Name('x')),)), Suite((Assign((Name('y'),), Name('x')), Call('return', Name('y'))))),)), Suite((Assign((Name('y'),), Name('x')), Call('return', Name('y')))))
+check(Suite((Assign((Name('y'),), Name('x')), Call('if', Const(True), Suite((Call('return', Name('x')),)), Suite((Call('return', Name('y')),))))), Suite((Call('return', Name('x')),)))
+check(Suite((Call('return', Call('if', Const(0), Suite((Name('x'),)), Suite((Name('y'),)))),)), Suite((Call('return', Name('y')),)))
+
+# liveness through branches that remain
+check(Suite((Assign((Name('y'),), Name('x')), Assign((Name('z'),), Name('x')), Call('if', Name('c'), Suite((Call('return', Name('y')),)), Suite((Call('return', Name('x')),))))), Suite((Assign((Name('y'),), Name('x')), Call('if', Name('c'), Suite((Call('return', Name('y')),)), Suite((Call('return', Name('x')),))))))
+
+# inside lambdas, too
+check(Suite((Call('return', Call(Call('.', Name('a'), 'map'), Def(('x',), (), Suite((Assign((Name('unused'),), Name('x')), Call('return', Name('x'))))))),)), Suite((Call('return', Call(Call('.', Name('a'), 'map'), Def(('x',), (), Suite((Call('return', Name('x')),))))),)))
+
+# a name a lambda assigns before reading it isn't free, so an outer assignment of the same name is still dead
+assert freenames(Suite((Assign((Name('y'),), Call('+', Name('y'), Name('x'))), Assign((Unpack((Name('z'), Name('w'))),), Name('y')), Call('return', Call('+', Name('z'), Name('v')))))) == ['y', 'x', 'v']
+assert freenames(Suite((Call('if', Name('c'), Suite((Assign((Name('y'),), Name('x')),))), Call('return', Name('y'))))) == ['c', 'x', 'y']
+local = Call('return', Call(Call('.', Name('a'), 'map'), Def(('x',), (), Suite((Assign((Name('y'),), Name('x')), Call('return', Name('y')))))))
+check(Suite((Assign((Name('y'),), Const(1)), local)), Suite((local,)))
+
+# typify eliminates dead code first
+assert rejig.typing.typify(Suite((Assign((Name('y'),), Name('undefined')), Call('return', Call('+', Name('x'), Const(1))))), {"x": numpy.dtype(int)}).typedast.rettype == numpy.dtype(int)
+
+# beta reduction: names and constants are substituted, an expensive argument read twice gets a temporary
+square = Def(('y',), (), Suite((Call('return', Call('+', Name('y'), Name('y'))),)))
+assert rejig.optimize.beta(square, (Name('x'),)) == Call('+', Name('x'), Name('x'))
+assert rejig.optimize.beta(square, (Call('+', Name('x'), Const(1)),)) == Suite((Assign((Name('_y_0'),), Call('+', Name('x'), Const(1))), Call('return', Call('+', Name('_y_0'), Name('_y_0')))))
+assert rejig.optimize.beta(Def(('y', 'z'), (Const(2),), Suite((Call('return', Call('+', Name('y'), Name('z'))),))), (Name('x'),)) == Call('+', Name('x'), Const(2))
+
+# without capturing the free names of what's substituted
+assert rejig.optimize.substitute(Def(('k',), (), Suite((Call('return', Call('+', Name('k'), Name('z'))),))), {'z': Name('k')}, rejig.optimize._Fresh(['k', 'z'])) == Def(('k_0',), (), Suite((Call('return', Call('+', Name('k_0'), Name('k'))),)))
+assert rejig.optimize.beta(Def(('y',), (), Suite((Assign((Name('y'),), Call('+', Name('y'), Const(1))), Call('return', Name('y'))))), (Name('x'),)) == Suite((Assign((Name('y'),), Name('x')), Assign((Name('y'),), Call('+', Name('y'), Const(1))), Call('return', Name('y'))))
+
+# small lambdas assigned to names are inlined into .map, big ones are not
+plusk = Def(('y',), (), Suite((Call('return', Call('+', Name('y'), Name('k'))),)))
+ast = Suite((Assign((Name('f'),), plusk), Call('return', Call(Call('.', Name('a'), 'map'), Def(('k',), (), Suite((Call('return', Call(Name('f'), Name('k'))),)))))))
+assert rejig.optimize.eliminate(rejig.optimize.inline(ast)) == Suite((Call('return', Call(Call('.', Name('a'), 'map'), Def(('k_0',), (), Suite((Call('return', Call('+', Name('k_0'), Name('k'))),))))),))
+assert rejig.optimize.inline(ast, budget=1) == Suite((Assign((Name('f'),), plusk), Call('return', Call(Call('.', Name('a'), 'map'), Def(('k_0',), (), Suite((Call('return', Call(Name('f'), Name('k_0'))),)))))))
+
+# and typify applies them: an inlined temporary is computed once
+action = rejig.typing.typify(Suite((Call('return', Call(Call('.', Name('a'), 'map'), Def(('x',), (), Suite((Call('return', Call(square, Call('+', Name('x'), Name('b')))),))))),)), {"a": awkward.type.ArrayType(numpy.inf, numpy.dtype(float)), "b": numpy.dtype(float)})
+assert action.compile("numpy").source.count("numpy.add") == 2
+assert action.compile("numpy")(numpy.array([1.0, 2.0]), 1.0).tolist() == [4.0, 6.0]
+assert action.compile("python")(numpy.array([1.0, 2.0]), 1.0) == [4.0, 6.0]
+
+# side-effect-free ifs become where(condition, then, else)
+sign = Suite((Call('if', Call('<', Name('x'), Const(0)), Suite((Assign((Name('y'),), Const(-1)),)), Suite((Call('if', Call('>', Name('x'), Const(0)), Suite((Assign((Name('y'),), Const(1)),)), Suite((Assign((Name('y'),), Const(0)),))),))), Call('return', Name('y'))))
+assert rejig.optimize.eliminate(rejig.optimize.ifconvert(sign)) == Suite((Assign((Name('y'),), Call('where', Call('<', Name('x'), Const(0)), Const(-1), Call('where', Call('>', Name('x'), Const(0)), Const(1), Const(0)))), Call('return', Name('y'))))
+early = Suite((Call('if', Call('<', Name('x'), Const(0)), Suite((Call('return', Const(0)),))), Call('return', Name('x'))))
+assert rejig.optimize.ifconvert(early) == Suite((Call('return', Call('where', Call('<', Name('x'), Const(0)), Const(0), Name('x'))),))
+
+# but not if a branch might raise where it would never have run
+guarded = Suite((Call('if', Call('>', Call('len', Name('x')), Const(0)), Suite((Call('return', Call('[.]', Name('x'), Const(0))),))), Call('return', Const(0))))
+assert rejig.optimize.ifconvert(guarded) == guarded
+
+action = rejig.typing.typify(Suite((Call('return', Call(Call('.', Name('a'), 'map'), Def(('x',), (), sign))),)), {"a": awkward.type.ArrayType(numpy.inf, numpy.dtype(float))})
+assert "numpy.where" in action.compile("numpy").source
+assert action.compile("numpy")(numpy.array([-2.0, 0.0, 3.0])).tolist() == [-1, 0, 1]
+assert action.compile("python")(numpy.array([-2.0, 0.0, 3.0])) == [-1, 0, 1]
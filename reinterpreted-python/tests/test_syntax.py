@@ -1,4 +1,12 @@
+import tempfile
+
+import numpy
+
+import awkward.type
+
+import rejig.kernelcache
 import rejig.pybytecode
+import rejig.typing
 from rejig.syntaxtree import *
 
 def check(what_is, what_should_be):
@@ -686,3 +694,56 @@ check('x = y[:, ...], z = 1', Suite((Assign((Name('x'), Unpack((Call('[.]', Name
 check('x = y = z[:, ...] = 1', Suite((Assign((Name('x'), Name('y'), Call('[.]', Name('z'), Call('slice', Const(None), Const(None), Const(None)), Const(Ellipsis)),), Const(1)), Call('return', Const(None)),)))
 check('x, y = z[:, ...] = 1', Suite((Assign((Unpack((Name('x'), Name('y'))), Call('[.]', Name('z'), Call('slice', Const(None), Const(None), Const(None)), Const(Ellipsis)),), Const(1)), Call('return', Const(None)),)))
 check('x = y, z[:, ...] = 1', Suite((Assign((Name('x'), Unpack((Name('y'), Call('[.]', Name('z'), Call('slice', Const(None), Const(None), Const(None)), Const(Ellipsis)))),), Const(1)), Call('return', Const(None)),)))
+
+check('s = 0\nfor x in a:\n    s += x\nreturn s', Suite((Assign((Name('s'),), Const(0)), Assign((Name('s'),), Call('sum', Name('a'), Name('s'))), Call('return', Name('s')),)))
+check('s = 1\nfor x in a:\n    s *= x + 1\nreturn s', Suite((Assign((Name('s'),), Const(1)), Assign((Name('s'),), Call('prod', Call(Call('.', Name('a'), 'map'), Def(('x',), (), Suite((Call('return', Call('+', Name('x'), Const(1))),)))), Name('s'))), Call('return', Name('s')),)))
+check('n = 0\nfor x in a:\n    if x > 3:\n        n += 1\nreturn n', Suite((Assign((Name('n'),), Const(0)), Assign((Name('n'),), Call('count', Call(Call('.', Name('a'), 'map'), Def(('x',), (), Suite((Call('return', Call('>', Name('x'), Const(3))),)))), Name('n'))), Call('return', Name('n')),)))
+check('found = False\nfor x in a:\n    if x > 3:\n        found = True\nreturn found', Suite((Assign((Name('found'),), Const(False)), Assign((Name('found'),), Call('any', Call(Call('.', Name('a'), 'map'), Def(('x',), (), Suite((Call('return', Call('>', Name('x'), Const(3))),)))), Name('found'))), Call('return', Name('found')),)))
+check('ok = True\nfor x in a:\n    if x > 3:\n        ok = False\nreturn ok', Suite((Assign((Name('ok'),), Const(True)), Assign((Name('ok'),), Call('all', Call(Call('.', Name('a'), 'map'), Def(('x',), (), Suite((Call('return', Call('not', Call('>', Name('x'), Const(3)))),)))), Name('ok'))), Call('return', Name('ok')),)))
+
+# and run, from the function's own bytecode to a compiled kernel
+def total(a):
+    s = 0
+    for x in a:
+        if x > 2:
+            s += x + 1
+    return s
+def many(a):
+    n = 0
+    for x in a:
+        if x > 2:
+            n += 1
+    return n
+for fcn, expect in ((total, 9), (many, 2)):
+    action = rejig.typing.typify(rejig.pybytecode.ast(fcn), {"a": awkward.type.ArrayType(numpy.inf, numpy.dtype(numpy.int64))})
+    assert action.compile("python")(numpy.array([1, 2, 3, 4])) == expect
+    assert action.compile("numpy")(numpy.array([1, 2, 3, 4])) == expect
+
+# closure cells and globals can be decompiled as the constants they are now, with a guard that notices when they change
+cut = 3
+def selection(low):
+    def f(x):
+        return x > low and x < cut
+    return f
+guard = rejig.pybytecode.Guard(selection(2.5))
+ast = rejig.pybytecode.ast(guard.fcn, capture=guard)
+assert ast == Suite((Call('return', Call('and', Call('>', Name('x'), Const(2.5)), Call('<', Name('x'), Const(3)))),)), repr(ast)
+assert rejig.pybytecode.ast(guard.fcn) == Suite((Call('return', Call('and', Call('>', Name('x'), Name('low')), Call('<', Name('x'), Name('cut')))),))
+assert guard.check()
+floats = awkward.type.ArrayType(numpy.inf, numpy.dtype(numpy.float64))
+snapshot = rejig.typing.typify(Suite((Call('return', Call(Call('.', Name('a'), 'filter'), Def(('x',), (), ast))),)), {"a": floats})
+cut = 4
+assert guard.changed() == ["cut"] and not guard.check()
+# capture is a snapshot: a kernel compiled from it still cuts at 3 until the function is decompiled again
+assert snapshot.compile("numpy")(numpy.array([2.0, 3.5, 3.7])).tolist() == []
+ast = rejig.pybytecode.ast(guard.fcn, capture=rejig.pybytecode.Guard(guard.fcn))
+assert ast == Suite((Call('return', Call('and', Call('>', Name('x'), Const(2.5)), Call('<', Name('x'), Const(4)))),))
+fresh = rejig.typing.typify(Suite((Call('return', Call(Call('.', Name('a'), 'filter'), Def(('x',), (), ast))),)), {"a": floats})
+assert fresh.compile("numpy")(numpy.array([2.0, 3.5, 3.7])).tolist() == [3.5, 3.7]
+# and the captured values are part of the kernel cache's key
+cache = rejig.kernelcache.KernelCache(tempfile.mkdtemp())
+assert cache.key(snapshot, "numpy") != cache.key(fresh, "numpy")
+
+# long enough tables of one kind of number are one constant
+check('(' + ', '.join(str(x * 2) for x in range(20)) + ')[y]', Suite((Call('return', Call('[.]', Const(numpy.arange(20) * 2), Name('y'))),)))
+check('(' + ', '.join(str(x * 0.5) if x % 2 == 1 else str(x) for x in range(20)) + ')[y]', Suite((Call('return', Call('[.]', Const(numpy.array([x * 0.5 if x % 2 == 1 else x for x in range(20)], dtype=numpy.float64)), Name('y'))),)))
@@ -0,0 +1,86 @@
+import json
+
+import numpy
+
+import awkward.type
+
+import rejig.typing
+from rejig.syntaxtree import *
+
+def check(ast, argtypes, what_should_be, **options):
+    action = rejig.typing.typify(ast, argtypes, **options)
+    print(str(action))
+    assert action.typedast.rettype == what_should_be, "\nshould be: " + repr(what_should_be) + "\nyet it is: " + repr(action.typedast.rettype)
+
+check(Suite((Call('return', Call('+', Name('x'), Const(3.14))),)), {"x": numpy.dtype(numpy.float32)}, numpy.dtype(numpy.float64))
+check(Suite((Call('return', Call('+', Name('x'), Const(3.14))),)), {"x": numpy.dtype(numpy.float32)}, numpy.dtype(numpy.float64), precision="strict")
+check(Suite((Call('return', Call('+', Name('x'), Const(3.14))),)), {"x": numpy.dtype(numpy.float32)}, numpy.dtype(numpy.float32), precision="preserve")
+check(Suite((Call('return', Call('+', Name('x'), Const(3.14))),)), {"x": numpy.dtype(numpy.int64)}, numpy.dtype(numpy.float64), precision="preserve")
+check(Suite((Call('return', Call('+', Name('x'), Const(1))),)), {"x": numpy.dtype(numpy.int16)}, numpy.dtype(numpy.int16), precision="preserve")
+check(Suite((Call('return', Call('+', Name('x'), Name('y'))),)), {"x": numpy.dtype(numpy.float64), "y": numpy.dtype(numpy.float32)}, numpy.dtype(numpy.float32), precision="fast-float32")
+check(Suite((Call('return', Const(3.14)),)), {}, numpy.dtype(numpy.float32), precision="fast-float32")
+check(Suite((Call('return', Call(Call('.', Name('a'), 'map'), Def(('x',), (), Suite((Call('return', Call('+', Name('x'), Const(3.14))),))))),)), {"a": awkward.type.ArrayType(10, numpy.dtype(numpy.float32))}, awkward.type.ArrayType(10, numpy.dtype(numpy.float32)), precision="preserve")
+
+assert rejig.typing.typify(Suite((Call('return', Name('x')),)), {"x": numpy.dtype(int)}, precision="preserve").precision == "preserve"
+
+def check_shape(ast, argtypes, what_should_be):
+    action = rejig.typing.typify(ast, argtypes)
+    assert action.typedast.shape == what_should_be, "\nshould be: " + repr(what_should_be) + "\nyet it is: " + repr(action.typedast.shape)
+
+check_shape(Suite((Call('return', Call('+', Name('x'), Const(1))),)), {"x": numpy.dtype(int)}, ())
+check_shape(Suite((Call('return', Name('a')),)), {"a": awkward.type.ArrayType(numpy.inf, 3, numpy.dtype(int))}, ((0, numpy.inf), (3, 3)))
+check_shape(Suite((Call('return', Call(Call('.', Name('a'), 'map'), Def(('x',), (), Suite((Call('return', Call('+', Name('x'), Const(1))),))))),)), {"a": awkward.type.ArrayType(10, numpy.dtype(int))}, ((10, 10),))
+check_shape(Suite((Call('return', Call(Call('.', Name('a'), 'filter'), Def(('x',), (), Suite((Call('return', Call('>', Name('x'), Const(0))),))))),)), {"a": awkward.type.ArrayType(10, numpy.dtype(int))}, ((0, 10),))
+check_shape(Suite((Call('return', Call(Call('.', Name('a'), 'map'), Def(('x',), (), Suite((Call('return', Call(Call('.', Name('x'), 'filter'), Def(('y',), (), Suite((Call('return', Call('>', Name('y'), Const(0))),))))),))))),)), {"a": awkward.type.ArrayType(10, 3, numpy.dtype(int))}, ((10, 10), (0, 3)))
+
+jagged = {"a": awkward.type.ArrayType(numpy.inf, numpy.inf, numpy.dtype(int))}
+def firstafter(predicate, index):
+    return Suite((Call('return', Call(Call('.', Call(Call('.', Name('a'), 'filter'), Def(('x',), (), Suite((Call('return', predicate),)))), 'map'), Def(('x',), (), Suite((Call('return', Call('[.]', Name('x'), Const(index))),))))),))
+
+def check_boundscheck(ast, argtypes, what_should_be):
+    action = rejig.typing.typify(ast, argtypes)
+    getitem = action.typedast.typedargs[0].typedbody
+    assert rejig.typing.boundscheck(getitem) == what_should_be, str(action)
+
+check_boundscheck(firstafter(Call('>=', Call('len', Name('x')), Const(2)), 1), jagged, False)
+check_boundscheck(firstafter(Call('>=', Call('len', Name('x')), Const(2)), 2), jagged, True)
+check_boundscheck(firstafter(Call('>', Call('.', Name('x'), 'size'), Const(0)), 0), jagged, False)
+check_boundscheck(firstafter(Call('<', Const(0), Call('len', Name('x'))), -1), jagged, False)
+check_boundscheck(firstafter(Call('<', Call('len', Name('x')), Const(5)), 0), jagged, True)
+check_boundscheck(firstafter(Call('>', Call('[.]', Name('x'), Const(0)), Const(0)), 2), {"a": awkward.type.ArrayType(numpy.inf, 3, numpy.dtype(int))}, False)
+check_boundscheck(firstafter(Call('>', Call('[.]', Name('x'), Const(0)), Const(0)), 3), {"a": awkward.type.ArrayType(numpy.inf, 3, numpy.dtype(int))}, True)
+check_shape(Suite((Call('return', Call(Call('.', Name('a'), 'filter'), Def(('x',), (), Suite((Call('return', Call('==', Call('len', Name('x')), Const(2))),))))),)), jagged, ((0, numpy.inf), (2, 2)))
+
+profiler = rejig.typing.Profiler()
+rejig.typing.typify(Suite((Call('return', Call('+', Name('x'), Call('+', Name('x'), Const(1), linestart=2), linestart=3)),)), {"x": numpy.dtype(int)}, profiler=profiler)
+try:
+    rejig.typing.typify(Suite((Call('return', Call('+', Name('a'), Const(1), sourcepath="analysis.py", linestart=7)),)), {"a": awkward.type.ArrayType(10, numpy.dtype(int))}, profiler=profiler)
+except TypeError:
+    pass
+assert profiler.tojson()["functions"]["Add"]["calls"] == 3
+assert profiler.tojson()["functions"]["Add"]["failures"] == 1
+assert profiler.tojson()["lines"]["analysis.py:7"]["failures"] == 1
+assert profiler.tojson()["lines"]["3"]["time"] >= profiler.tojson()["lines"]["2"]["time"]
+assert json.loads(profiler.dumps()) == profiler.tojson()
+before = profiler.tojson()
+try:
+    rejig.typing.typify(Suite((Call('return', Call('not', Name('x'), Name('x'), linestart=9)),)), {"x": numpy.dtype(bool)}, profiler=profiler)
+except TypeError:
+    pass
+else:
+    raise AssertionError("not with two arguments should raise TypeError")
+# a wrong number of arguments is a failure of the call, like any other
+assert (profiler.tojson()["functions"]["Not"]["calls"], profiler.tojson()["functions"]["Not"]["failures"]) == (1, 1)
+assert profiler.tojson()["lines"]["9"]["failures"] == 1
+# and what tojson returned before is a copy, unchanged by typing since, and changing it doesn't change the profiler
+assert "Not" not in before["functions"] and "9" not in before["lines"]
+before["functions"]["Add"]["calls"] = 0
+assert profiler.tojson()["functions"]["Add"]["calls"] == 3
+
+# calls to other functions are inlined and typed as one Action
+shift = Def(('x', 'by'), (Const(1.0),), Suite((Call('return', Call('+', Name('x'), Name('by'))),)))
+double = Def(('x',), (), Suite((Call('return', Call(Name('shift'), Name('x'), Name('x'))),)))
+action = rejig.typing.typify(Suite((Call('return', Call(Call('.', Name('a'), 'map'), Def(('y',), (), Suite((Call('return', Call(Name('double'), Call(Name('shift'), Name('y')))),))))),)), {"a": awkward.type.ArrayType(numpy.inf, numpy.dtype(float))}, functions={"shift": shift, "double": double})
+assert action.typedast.rettype == awkward.type.ArrayType(numpy.inf, numpy.dtype(float))
+assert action.compile("python")(numpy.array([1.0, 2.0])) == [4.0, 6.0]
+assert rejig.typing.typify(Suite((Call('return', Call(Call('.', Name('a'), 'map'), Name('double'))),)), {"a": awkward.type.ArrayType(numpy.inf, numpy.dtype(float))}, functions={"shift": shift, "double": double}).compile("python")(numpy.array([1.0, 2.0])) == [2.0, 4.0]
@@ -0,0 +1,24 @@
+import numpy
+
+import awkward.type
+
+import rejig.typing
+from rejig.syntaxtree import *
+from rejig.valuerange import *
+
+def check(ast, argtypes, argranges, what_should_be):
+    action = narrow(rejig.typing.typify(ast, argtypes), argranges)
+    print(str(action))
+    assert action.typedast.rettype == what_should_be, "\nshould be: " + repr(what_should_be) + "\nyet it is: " + repr(action.typedast.rettype)
+
+assert narrowest(Interval(0, 255)) == numpy.dtype(numpy.uint8)
+assert narrowest(Interval(-1, 127)) == numpy.dtype(numpy.int8)
+assert narrowest(Interval(-1, 128)) == numpy.dtype(numpy.int16)
+assert narrowest(Interval(0, numpy.inf)) is None
+
+check(Suite((Call('return', Call('+', Name('x'), Const(3))),)), {"x": numpy.dtype(int)}, {"x": Interval(-3, 3)}, numpy.dtype(numpy.int8))
+check(Suite((Call('return', Call('+', Name('x'), Const(3))),)), {"x": numpy.dtype(int)}, {"x": Interval(0, 1000)}, numpy.dtype(numpy.uint16))
+check(Suite((Call('return', Call('+', Name('x'), Const(3))),)), {"x": numpy.dtype(int)}, {}, numpy.dtype(numpy.int64))
+check(Suite((Call('return', Call('+', Name('x'), Const(3.14))),)), {"x": numpy.dtype(int)}, {"x": Interval(-3, 3)}, numpy.dtype(numpy.float64))
+check(Suite((Call('return', Call('+', Name('x'), Const(-100), Const(100))),)), {"x": numpy.dtype(int)}, {"x": Interval(0, 100)}, numpy.dtype(numpy.int8))
+check(Suite((Call('return', Call(Call('.', Name('a'), 'map'), Def(('x',), (), Suite((Call('return', Call('+', Name('x'), Name('n'))),))))),)), {"a": awkward.type.ArrayType(10, numpy.dtype(int)), "n": numpy.dtype(int)}, {"a": Interval(0, 1), "n": Interval(0, 10)}, awkward.type.ArrayType(10, numpy.dtype(numpy.uint8)))